@@ -1,129 +1,254 @@
 import psycopg2
 import pandas as pd
 from psycopg2 import Error
-from datetime import datetime
+import argparse
+import io
 import os
+import sys
+import time
 from dotenv import load_dotenv
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from frontline.departments import department_for
+from frontline.opening_hours import compile_opening_hours
+from frontline_worker.database import connection_params
+
 load_dotenv()
-# -----------------------------
-# Database connection settings
-# -----------------------------
-DB_HOST = os.getenv("DB_HOST")
-DB_NAME = os.getenv("DB_NAME")
-DB_USER = os.getenv("DB_USER")
-DB_PASS = os.getenv("DB_PASSWORD")
-
-def parse_timestamp(val):
-    """Convert timestamp field safely to datetime or None."""
-    if pd.isna(val):
-        return None
-    try:
-        # Some may be float like 1.234e+09, treat as Unix timestamp
-        if isinstance(val, (int, float)):
-            return datetime.fromtimestamp(val)
-        # Otherwise, try parsing string
-        return pd.to_datetime(val, errors="coerce")
-    except Exception:
-        return None
-
-try:
-    print("📂 Loading CSV file...")
-    df = pd.read_csv("pakistan.csv")
-    print(f"✅ Loaded {len(df)} rows from CSV.")
-
-    print("🔗 Connecting to PostgreSQL...")
-    conn = psycopg2.connect(
-        host=DB_HOST,
-        dbname=DB_NAME,
-        user=DB_USER,
-        password=DB_PASS,
-        port=5432
-    )
-    cur = conn.cursor()
-    print("✅ Connection established.")
-
-    # -----------------------------
-    # Create table
-    # -----------------------------
-    create_table_query = """
-    CREATE TABLE IF NOT EXISTS health_facilities (
-        id SERIAL PRIMARY KEY,
-        x DOUBLE PRECISION,
-        y DOUBLE PRECISION,
-        osm_id BIGINT,
-        osm_type VARCHAR(50),
-        completeness INT,
-        is_in_health_zone VARCHAR(50),
-        amenity VARCHAR(100),
-        speciality VARCHAR(255),
-        addr_full TEXT,
-        operator VARCHAR(255),
-        water_source VARCHAR(255),
-        changeset_id BIGINT,
-        insurance VARCHAR(255),
-        staff_doctors VARCHAR(50),
-        contact_number VARCHAR(100),
-        uuid VARCHAR(100),
-        electricity VARCHAR(50),
-        opening_hours VARCHAR(255),
-        operational_status VARCHAR(50),
-        source VARCHAR(255),
-        is_in_health_area VARCHAR(50),
-        health_amenity_type VARCHAR(255),
-        changeset_version INT,
-        emergency VARCHAR(50),
-        changeset_timestamp TIMESTAMP,
-        name VARCHAR(255),
-        staff_nurses VARCHAR(50),
-        changeset_user VARCHAR(255),
-        wheelchair VARCHAR(50),
-        beds VARCHAR(50),
-        url TEXT,
-        dispensing VARCHAR(50),
-        healthcare VARCHAR(100),
-        operator_type VARCHAR(100)
-    );
-    """
-    cur.execute(create_table_query)
+
+# health_facilities columns in COPY order (the CSV's columns, lower-cased, plus the derived ones)
+COLUMNS = [
+    "x", "y", "osm_id", "osm_type", "completeness", "is_in_health_zone", "amenity", "speciality", "addr_full",
+    "operator", "water_source", "changeset_id", "insurance", "staff_doctors", "contact_number", "uuid",
+    "electricity", "opening_hours", "operational_status", "source", "is_in_health_area", "health_amenity_type",
+    "changeset_version", "emergency", "changeset_timestamp", "name", "staff_nurses", "changeset_user",
+    "wheelchair", "beds", "url", "dispensing", "healthcare", "operator_type", "department",
+    "opening_hours_imputed", "opening_hours_bitmap",
+]
+INTEGER_COLUMNS = ["osm_id", "completeness", "changeset_id", "changeset_version"]
+
+# facility_lookup (frontline.models.FacilityLookup) is the slim copy the app reads
+LOOKUP_COLUMNS = ["id", "x", "y", "department", "name", "health_amenity_type", "opening_hours", "opening_hours_bitmap"]
+# health_facilities expression per lookup column; imputed opening hours are not shown or ranked on
+LOOKUP_SELECT = {
+    column: f"CASE WHEN opening_hours_imputed THEN NULL ELSE {column} END"
+    if column in ("opening_hours", "opening_hours_bitmap") else column
+    for column in LOOKUP_COLUMNS
+}
+
+# Unquoted empty fields are NULL in CSV format, which is how to_csv writes NaN
+COPY_QUERY = "COPY {table} (" + ", ".join(COLUMNS) + ") FROM STDIN WITH (FORMAT csv)"
+
+create_table_query = """
+CREATE TABLE IF NOT EXISTS health_facilities (
+    id SERIAL PRIMARY KEY,
+    x DOUBLE PRECISION,
+    y DOUBLE PRECISION,
+    osm_id BIGINT,
+    osm_type VARCHAR(50),
+    completeness INT,
+    is_in_health_zone VARCHAR(50),
+    amenity VARCHAR(100),
+    speciality VARCHAR(255),
+    addr_full TEXT,
+    operator VARCHAR(255),
+    water_source VARCHAR(255),
+    changeset_id BIGINT,
+    insurance VARCHAR(255),
+    staff_doctors VARCHAR(50),
+    contact_number VARCHAR(100),
+    uuid VARCHAR(100),
+    electricity VARCHAR(50),
+    opening_hours VARCHAR(255),
+    operational_status VARCHAR(50),
+    source VARCHAR(255),
+    is_in_health_area VARCHAR(50),
+    health_amenity_type VARCHAR(255),
+    changeset_version INT,
+    emergency VARCHAR(50),
+    changeset_timestamp TIMESTAMP,
+    name VARCHAR(255),
+    staff_nurses VARCHAR(50),
+    changeset_user VARCHAR(255),
+    wheelchair VARCHAR(50),
+    beds VARCHAR(50),
+    url TEXT,
+    dispensing VARCHAR(50),
+    healthcare VARCHAR(100),
+    operator_type VARCHAR(100)
+);
+"""
+
+
+def connect():
+    # Same DB_* settings as the Django app, including DB_PORT
+    return psycopg2.connect(application_name=os.path.basename(sys.argv[0]) or "db_utils", **connection_params())
+
+
+def create_table(conn):
+    with conn.cursor() as cur:
+        # Newer columns such as department come from the frontline migrations; run ``manage.py migrate`` first
+        cur.execute(create_table_query)
     conn.commit()
-    print("✅ Table is ready.")
-
-    # -----------------------------
-    # Insert data
-    # -----------------------------
-    insert_query = """
-    INSERT INTO health_facilities (
-        x, y, osm_id, osm_type, completeness, is_in_health_zone, amenity, speciality, addr_full, operator, 
-        water_source, changeset_id, insurance, staff_doctors, contact_number, uuid, electricity, opening_hours, 
-        operational_status, source, is_in_health_area, health_amenity_type, changeset_version, emergency, 
-        changeset_timestamp, name, staff_nurses, changeset_user, wheelchair, beds, url, dispensing, healthcare, operator_type
-    )
-    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+
+
+def refresh_lookup(cur, ids=None):
+    """
+    Rebuild facility_lookup rows from health_facilities: all of them, or the
+    given facility ids. Runs in the caller's transaction.
+
+    A full rebuild also logs a reload row in facility_changes, so running
+    processes (and snapshots taken before it) rebuild their facility index
+    instead of applying ids one by one.
+
+    Returns:
+        bool: False when facility_lookup does not exist (run ``manage.py migrate``)
+    """
+    cur.execute("SELECT to_regclass('facility_lookup')")
+    if cur.fetchone()[0] is None:
+        return False
+    columns = ", ".join(LOOKUP_COLUMNS)
+    select = ", ".join(LOOKUP_SELECT[column] for column in LOOKUP_COLUMNS)
+    located = "x IS NOT NULL AND y IS NOT NULL"
+    if ids is None:
+        cur.execute("TRUNCATE facility_lookup")
+        cur.execute(f"INSERT INTO facility_lookup ({columns}) SELECT {select} FROM health_facilities WHERE {located}")
+        cur.execute("SELECT to_regclass('facility_changes')")
+        if cur.fetchone()[0] is not None:
+            cur.execute("INSERT INTO facility_changes (facility_id, operation, created_at) VALUES (NULL, 'reload', now())")
+    else:
+        ids = list(ids)
+        cur.execute("DELETE FROM facility_lookup WHERE id = ANY(%s)", [ids])
+        cur.execute(f"INSERT INTO facility_lookup ({columns}) SELECT {select} FROM health_facilities "
+                    f"WHERE id = ANY(%s) AND {located}", [ids])
+    return True
+
+
+def prepare(df):
+    """
+    Shape the CSV's DataFrame into health_facilities columns.
+
+    Integer columns read as floats because of their gaps ("74023681.0") are
+    made nullable integers, timestamps are parsed in one vectorized pass,
+    and the normalized department and compiled opening hours are added.
+    Imputed opening hours (ingest.OpeningHoursPool) are not compiled: their
+    bitmap stays NULL, which the app treats as unknown hours.
+    """
+    df = df.rename(columns={"X": "x", "Y": "y"})
+    for column in INTEGER_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors="coerce").round().astype("Int64")
+    df["changeset_timestamp"] = pd.to_datetime(df["changeset_timestamp"], format="%Y/%m/%d %H:%M:%S", errors="coerce")
+    # Normalized department category, so lookups are an indexed equality match
+    df["department"] = [department_for(a, h) for a, h in zip(df["amenity"], df["healthcare"])]
+    # Set by ingest.OpeningHoursPool on the rows whose hours it made up
+    if "opening_hours_imputed" in df:
+        df["opening_hours_imputed"] = df["opening_hours_imputed"].fillna(False).astype(bool)
+    else:
+        df["opening_hours_imputed"] = False
+    # bytea hex input; backslashes are literal in COPY's CSV format
+    bitmaps = [None if imputed else compile_opening_hours(value)
+               for value, imputed in zip(df["opening_hours"], df["opening_hours_imputed"])]
+    df["opening_hours_bitmap"] = [None if bitmap is None else "\\x" + bitmap.hex() for bitmap in bitmaps]
+    return df[COLUMNS]
+
+
+def copy_rows(cur, frame, table="health_facilities"):
+    """Stream the frame into ``table`` with one COPY FROM STDIN."""
+    buffer = io.StringIO()
+    frame.to_csv(buffer, header=False, index=False, date_format="%Y-%m-%d %H:%M:%S")
+    buffer.seek(0)
+    cur.copy_expert(COPY_QUERY.format(table=table), buffer)
+
+
+def copy_batch(conn, frame, rejects, table="health_facilities"):
     """
+    COPY one batch. A batch the server rejects is rolled back and split in
+    half until the offending rows are isolated; those go to ``rejects`` as
+    (row, error) and the rest of the batch is still loaded.
 
-    print("⬆️ Inserting rows...")
-    for idx, row in df.iterrows():
+    Returns:
+        int: Rows loaded
+    """
+    with conn.cursor() as cur:
         try:
-            row_list = list(row)
-            row_list[24] = parse_timestamp(row_list[24])
-
-            cur.execute(insert_query, tuple(row_list))
-            conn.commit()  # commit per row
-            if idx % 100 == 0:
-                print(f"   Inserted {idx} rows...")
-        except Exception as e:
-            print(f"⚠️ Skipping row {idx} due to error: {e}")
+            copy_rows(cur, frame, table)
+            conn.commit()
+            return len(frame)
+        except Error as e:
             conn.rollback()
+            if len(frame) == 1:
+                rejects.append((frame, str(e).strip().splitlines()[0]))
+                return 0
+    middle = len(frame) // 2
+    return copy_batch(conn, frame.iloc[:middle], rejects, table) + copy_batch(conn, frame.iloc[middle:], rejects, table)
+
+
+def write_rejects(rejects, path, append=False):
+    frame = pd.concat([row.assign(error=error) for row, error in rejects])
+    frame.to_csv(path, index_label="csv_row", mode="a" if append else "w", header=not append)
+
+
+def load(conn, df, batch_size=5000, rejects_path="rejected_rows.csv"):
+    """
+    Load the prepared DataFrame in batches of ``batch_size`` rows.
+
+    Returns:
+        tuple: (rows loaded, rows rejected)
+    """
+    rejects = []
+    loaded = 0
+    started = time.perf_counter()
+    for start in range(0, len(df), batch_size):
+        loaded += copy_batch(conn, df.iloc[start:start + batch_size], rejects)
+        elapsed = time.perf_counter() - started
+        print(f"   Copied {loaded} rows ({loaded / elapsed:,.0f} rows/sec)...")
+
+    if rejects:
+        write_rejects(rejects, rejects_path)
+        print(f"⚠️ {len(rejects)} rows rejected, written to {rejects_path}")
+    elapsed = time.perf_counter() - started
+    print(f"✅ Loaded {loaded} rows in {elapsed:.2f}s ({loaded / elapsed:,.0f} rows/sec).")
+    sync_lookup(conn)
+    return loaded, len(rejects)
+
+
+def sync_lookup(conn):
+    with conn.cursor() as cur:
+        refreshed = refresh_lookup(cur)
+    conn.commit()
+    print("✅ facility_lookup refreshed." if refreshed else "⚠️ facility_lookup missing; run manage.py migrate.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load a health facilities CSV into health_facilities with COPY.")
+    parser.add_argument("csv", nargs="?", default="pakistan.csv")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Rows per COPY (and per commit)")
+    parser.add_argument("--rejects", default="rejected_rows.csv", help="Where rows the database refuses are written")
+    args = parser.parse_args()
+
+    conn = None
+    try:
+        print("📂 Loading CSV file...")
+        df = prepare(pd.read_csv(args.csv))
+        print(f"✅ Loaded {len(df)} rows from CSV.")
+
+        print("🔗 Connecting to PostgreSQL...")
+        conn = connect()
+        print("✅ Connection established.")
+
+        create_table(conn)
+        print("✅ Table is ready.")
+
+        print("⬆️ Copying rows...")
+        load(conn, df, args.batch_size, args.rejects)
+
+    except (Exception, Error) as e:
+        print("❌ Error:", e)
 
-    print("✅ All rows inserted successfully.")
+    finally:
+        if conn is not None:
+            conn.close()
+        print("🔒 Connection closed.")
 
-except (Exception, Error) as e:
-    print("❌ Error:", e)
 
-finally:
-    if 'cur' in locals():
-        cur.close()
-    if 'conn' in locals():
-        conn.close()
-    print("🔒 Connection closed.")
+if __name__ == "__main__":
+    main()
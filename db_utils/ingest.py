@@ -0,0 +1,148 @@
+"""
+Single-pass ingestion of an OSM health facilities CSV into health_facilities.
+
+Replaces the fill_X_Y.py -> fill_opening_hours.py -> create_db.py chain:
+the CSV is read in chunks and each chunk is cleaned and COPYed before the
+next one is read, so memory stays bounded by the chunk size and no
+intermediate CSVs are written.
+
+    python ingest.py pakistan.csv --chunk-size 50000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from psycopg2 import Error
+
+from create_db import connect, create_table, prepare, copy_batch, write_rejects, sync_lookup
+
+
+class CoordinateFill:
+    """Forward-fill of missing X/Y that carries the last seen values across chunks."""
+
+    def __init__(self):
+        self.last = {"X": np.nan, "Y": np.nan}
+
+    def __call__(self, chunk):
+        for column in ("X", "Y"):
+            values = pd.to_numeric(chunk[column], errors="coerce").ffill()
+            chunk[column] = values.fillna(self.last[column])
+            if chunk[column].notna().any():
+                self.last[column] = chunk[column].dropna().iloc[-1]
+        return chunk
+
+
+class OpeningHoursPool:
+    """
+    Imputes missing opening_hours with a random value seen in the file, and
+    flags those rows in opening_hours_imputed: the values are made up, so
+    the app treats them as unknown hours.
+
+    fill_opening_hours.py drew from every distinct value in the CSV; a
+    single pass only knows the values read so far, so the pool grows as
+    chunks arrive and is capped at ``max_size`` distinct values (reservoir
+    replacement beyond that).
+    """
+
+    def __init__(self, max_size=10000, seed=None):
+        self.max_size = max_size
+        self.values = []
+        self._seen = set()
+        self._offered = 0
+        self._rng = np.random.default_rng(seed)
+
+    def add(self, values):
+        for value in values:
+            if value in self._seen:
+                continue
+            self._offered += 1
+            if len(self.values) < self.max_size:
+                self.values.append(value)
+                self._seen.add(value)
+            else:
+                slot = self._rng.integers(self._offered)
+                if slot < self.max_size:
+                    self._seen.discard(self.values[slot])
+                    self.values[slot] = value
+                    self._seen.add(value)
+
+    def __call__(self, chunk):
+        hours = chunk["opening_hours"]
+        self.add(hours.dropna().unique())
+        missing = hours.isna()
+        chunk["opening_hours_imputed"] = False
+        if self.values and missing.any():
+            chunk.loc[missing, "opening_hours"] = self._rng.choice(self.values, missing.sum())
+            chunk.loc[missing, "opening_hours_imputed"] = True
+        return chunk
+
+
+def clean_chunks(path, chunk_size=50000, seed=None, pool_size=10000):
+    """Yield the CSV as cleaned, prepared DataFrames of at most ``chunk_size`` rows."""
+    fill_coordinates = CoordinateFill()
+    fill_opening_hours = OpeningHoursPool(pool_size, seed)
+    # Everything as text; prepare() does the typed conversions, so dtypes cannot drift between chunks
+    for chunk in pd.read_csv(path, chunksize=chunk_size, dtype=str):
+        yield prepare(fill_opening_hours(fill_coordinates(chunk)))
+
+
+def ingest(conn, path, chunk_size=50000, rejects_path="rejected_rows.csv", seed=None, pool_size=10000,
+           table="health_facilities"):
+    """
+    Read, clean and COPY the CSV into ``table`` one chunk at a time.
+
+    Returns:
+        tuple: (rows loaded, rows rejected)
+    """
+    loaded = rejected = 0
+    started = time.perf_counter()
+
+    for chunk in clean_chunks(path, chunk_size, seed, pool_size):
+        rejects = []
+        loaded += copy_batch(conn, chunk, rejects, table)
+        if rejects:
+            write_rejects(rejects, rejects_path, append=rejected > 0)
+            rejected += len(rejects)
+        elapsed = time.perf_counter() - started
+        print(f"   Ingested {loaded} rows ({loaded / elapsed:,.0f} rows/sec)...")
+
+    if rejected:
+        print(f"⚠️ {rejected} rows rejected, written to {rejects_path}")
+    elapsed = time.perf_counter() - started
+    print(f"✅ Ingested {loaded} rows in {elapsed:.2f}s ({loaded / elapsed:,.0f} rows/sec).")
+    if table == "health_facilities":
+        sync_lookup(conn)
+    return loaded, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Clean and bulk load a health facilities CSV in one streaming pass.")
+    parser.add_argument("csv", nargs="?", default="pakistan.csv")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="Rows read, cleaned and COPYed at a time")
+    parser.add_argument("--rejects", default="rejected_rows.csv", help="Where rows the database refuses are written")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the opening_hours imputation")
+    parser.add_argument("--pool-size", type=int, default=10000, help="Distinct opening_hours values kept for imputation")
+    args = parser.parse_args()
+
+    conn = None
+    try:
+        print("🔗 Connecting to PostgreSQL...")
+        conn = connect()
+        create_table(conn)
+        print("✅ Table is ready.")
+
+        print(f"⬆️ Ingesting {args.csv}...")
+        ingest(conn, args.csv, args.chunk_size, args.rejects, args.seed, args.pool_size)
+
+    except (Exception, Error) as e:
+        print("❌ Error:", e)
+
+    finally:
+        if conn is not None:
+            conn.close()
+        print("🔒 Connection closed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Incremental re-sync of health_facilities from a new OSM dump.
+
+Instead of dropping and reloading the table, the dump is streamed into a
+staging table (same cleaning as ingest.py) and diffed against
+health_facilities on the OSM identity (osm_type, osm_id):
+
+- elements not in the table are inserted
+- elements whose changeset_version (or derived department or imputed-hours
+  flag) differs are updated
+- rows whose element is gone from the dump are deleted
+
+All three happen in one statement, which also records every affected id
+in facility_changes; the same transaction refreshes those ids in
+facility_lookup. Running processes poll facility_changes and refresh only
+the index partitions that changed (frontline.facility_index.sync_facility_index).
+Run ``manage.py migrate`` first so facility_changes, facility_lookup and the
+osm index exist.
+
+    python sync.py pakistan.csv
+"""
+import argparse
+import time
+
+from psycopg2 import Error
+
+from create_db import COLUMNS, connect, create_table, refresh_lookup
+from ingest import ingest
+
+STAGING_TABLE = "facility_staging"
+
+_MATCH = "h.osm_type IS NOT DISTINCT FROM s.osm_type AND h.osm_id = s.osm_id"
+
+# Newest version of each element in the dump
+_INCOMING = f"""
+incoming AS (
+    SELECT DISTINCT ON (osm_type, osm_id) *
+    FROM {STAGING_TABLE}
+    WHERE osm_id IS NOT NULL
+    ORDER BY osm_type, osm_id, changeset_version DESC NULLS LAST
+)"""
+
+_UPSERT = f"""
+updated AS (
+    UPDATE health_facilities h
+    SET ({", ".join(COLUMNS)}) = ({", ".join("s." + c for c in COLUMNS)})
+    FROM incoming s
+    WHERE {_MATCH}
+      AND (h.changeset_version IS DISTINCT FROM s.changeset_version
+           OR h.department IS DISTINCT FROM s.department
+           OR h.opening_hours_imputed IS DISTINCT FROM s.opening_hours_imputed)
+    RETURNING h.id
+),
+inserted AS (
+    INSERT INTO health_facilities ({", ".join(COLUMNS)})
+    SELECT {", ".join("s." + c for c in COLUMNS)}
+    FROM incoming s
+    WHERE NOT EXISTS (SELECT 1 FROM health_facilities h WHERE {_MATCH})
+    RETURNING id
+)"""
+
+_DELETE = f"""
+deleted AS (
+    DELETE FROM health_facilities h
+    WHERE h.osm_id IS NOT NULL
+      AND NOT EXISTS (SELECT 1 FROM incoming s WHERE {_MATCH})
+    RETURNING h.id
+)"""
+
+
+def stage(conn, path, chunk_size, rejects_path, seed):
+    """Stream the cleaned dump into a session-local staging table."""
+    with conn.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {STAGING_TABLE}")
+        cur.execute(f"CREATE TEMP TABLE {STAGING_TABLE} (LIKE health_facilities)")
+        cur.execute(f"ALTER TABLE {STAGING_TABLE} DROP COLUMN id")
+    conn.commit()
+    loaded, _ = ingest(conn, path, chunk_size, rejects_path, seed, table=STAGING_TABLE)
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE INDEX ON {STAGING_TABLE} (osm_type, osm_id)")
+        cur.execute(f"ANALYZE {STAGING_TABLE}")
+    conn.commit()
+    return loaded
+
+
+def count_deletions(cur):
+    cur.execute(f"""
+        WITH {_INCOMING}
+        SELECT (SELECT count(*) FROM health_facilities h
+                WHERE h.osm_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM incoming s WHERE {_MATCH})),
+               (SELECT count(*) FROM health_facilities)
+    """)
+    return cur.fetchone()
+
+
+def apply(conn, delete=True, max_delete_fraction=0.2):
+    """
+    Diff the staging table against health_facilities and apply the changes,
+    with the matching facility_lookup rows, in one transaction.
+
+    Returns:
+        dict: Number of inserted, updated and deleted facilities
+    """
+    with conn.cursor() as cur:
+        if delete:
+            doomed, total = count_deletions(cur)
+            if total and doomed / total > max_delete_fraction:
+                raise ValueError(
+                    f"sync would delete {doomed} of {total} facilities; is the dump complete? "
+                    f"Raise --max-delete-fraction or pass --no-delete."
+                )
+
+        ctes = [_INCOMING, _UPSERT] + ([_DELETE] if delete else [])
+        log = [f"SELECT id, '{operation}', now() FROM {cte}"
+               for operation, cte in (("insert", "inserted"), ("update", "updated"), ("delete", "deleted"))
+               if delete or cte != "deleted"]
+        cur.execute(f"""
+            WITH {", ".join(ctes)}
+            INSERT INTO facility_changes (facility_id, operation, created_at)
+            {" UNION ALL ".join(log)}
+            RETURNING facility_id, operation
+        """)
+        counts = {"insert": 0, "update": 0, "delete": 0}
+        changed = set()
+        for facility_id, operation in cur.fetchall():
+            counts[operation] += 1
+            changed.add(facility_id)
+        if changed:
+            refresh_lookup(cur, changed)
+    conn.commit()
+    return counts
+
+
+def prune_changes(conn, keep_days):
+    """Drop change log rows every process has long since applied."""
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM facility_changes WHERE created_at < now() - %s * interval '1 day'", [keep_days])
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incrementally sync health_facilities with a new OSM dump.")
+    parser.add_argument("csv", nargs="?", default="pakistan.csv")
+    parser.add_argument("--chunk-size", type=int, default=50000, help="Rows read, cleaned and COPYed at a time")
+    parser.add_argument("--rejects", default="rejected_rows.csv", help="Where rows the database refuses are written")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for the opening_hours imputation")
+    parser.add_argument("--no-delete", action="store_true", help="Keep facilities that are missing from the dump")
+    parser.add_argument("--max-delete-fraction", type=float, default=0.2,
+                        help="Abort when more than this share of the table would be deleted")
+    parser.add_argument("--keep-days", type=int, default=7, help="Days of facility_changes history to keep")
+    args = parser.parse_args()
+
+    conn = None
+    try:
+        print("🔗 Connecting to PostgreSQL...")
+        conn = connect()
+        create_table(conn)
+
+        started = time.perf_counter()
+        print(f"⬆️ Staging {args.csv}...")
+        stage(conn, args.csv, args.chunk_size, args.rejects, args.seed)
+
+        print("🔁 Applying changes...")
+        counts = apply(conn, delete=not args.no_delete, max_delete_fraction=args.max_delete_fraction)
+        prune_changes(conn, args.keep_days)
+        print(f"✅ Synced in {time.perf_counter() - started:.2f}s: {counts['insert']} inserted, "
+              f"{counts['update']} updated, {counts['delete']} deleted.")
+
+    except (Exception, Error) as e:
+        print("❌ Error:", e)
+
+    finally:
+        if conn is not None:
+            conn.close()
+        print("🔒 Connection closed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class FrontlineConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'frontline'
+
+    def ready(self):
+        # Connect the facility index invalidation signals
+        from . import facility_index  # noqa: F401
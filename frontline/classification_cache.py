@@ -0,0 +1,77 @@
+"""
+Cache of classify_emergency_agent results keyed by a normalized message.
+
+Messages are case-folded, whitespace-collapsed, and have emails, phone
+numbers and other digits masked, so "I need a Pharmacy " and
+"i need a pharmacy" share one entry and no PII ends up in cache keys.
+Entries live in a per-process LRU; when CLASSIFICATION_CACHE_BACKEND names
+a Django cache alias, that cache is consulted on a local miss so all
+gunicorn workers share results.
+"""
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .cache import LRUCache
+from .metrics import register_cache
+
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(\.[\w-]+)+")
+_PHONE = re.compile(r"\+?\d[\d\s().-]{6,}\d")
+_DIGITS = re.compile(r"\d+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_message(message):
+    text = str(message).casefold()
+    text = _EMAIL.sub("<email>", text)
+    text = _PHONE.sub("<phone>", text)
+    text = _DIGITS.sub("<num>", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class ClassificationCache:
+    def __init__(self, max_size, ttl, backend=None):
+        self.ttl = ttl
+        self.backend = backend
+        self._local = LRUCache(max_size, ttl)
+        self.shared_hits = 0
+
+    @staticmethod
+    def _key(message):
+        normalized = normalize_message(message)
+        return "classification:" + hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+    def get(self, message):
+        """Cached classification for the message, or None."""
+        key = self._key(message)
+        result = self._local.get(key)
+        if result is None and self.backend:
+            result = caches[self.backend].get(key)
+            if result is not None:
+                self.shared_hits += 1
+                self._local.set(key, result)
+        return dict(result) if result is not None else None
+
+    def set(self, message, result):
+        key = self._key(message)
+        self._local.set(key, dict(result))
+        if self.backend:
+            caches[self.backend].set(key, dict(result), self.ttl)
+
+    def clear(self):
+        self._local.clear()
+
+    def stats(self):
+        stats = self._local.stats()
+        stats["shared_hits"] = self.shared_hits
+        return stats
+
+
+classification_cache = ClassificationCache(
+    max_size=settings.CLASSIFICATION_CACHE_SIZE,
+    ttl=settings.CLASSIFICATION_CACHE_TTL,
+    backend=settings.CLASSIFICATION_CACHE_BACKEND,
+)
+register_cache("classification", classification_cache)
@@ -0,0 +1,60 @@
+"""
+Per-request latency budget for the chat pipeline.
+
+The client's ``latency`` field is the number of seconds it is willing to
+wait. Each LLM stage gets a timeout carved out of what is left of that
+budget (LATENCY_STAGE_SHARES), so an early slow stage cannot starve the
+later ones. Stages that run out of time are recorded in ``skipped`` and the
+view substitutes a degraded result.
+"""
+import time
+
+from django.conf import settings
+
+from .metrics import STAGES_SKIPPED
+
+
+class Deadline:
+    def __init__(self, budget):
+        self.budget = budget
+        self.started = time.monotonic()
+        self.skipped = []
+
+    @classmethod
+    def from_latency(cls, latency):
+        """Deadline for the request's latency field; falls back to DEFAULT_LATENCY_BUDGET."""
+        try:
+            budget = float(latency)
+        except (TypeError, ValueError):
+            budget = None
+        if budget is None or budget <= 0:
+            budget = settings.DEFAULT_LATENCY_BUDGET
+        return cls(budget)
+
+    def remaining(self):
+        """Seconds left, or None when the request has no budget."""
+        if self.budget is None:
+            return None
+        return max(0.0, self.budget - (time.monotonic() - self.started))
+
+    def timeout_for(self, stage):
+        """
+        Timeout for the stage's LLM call.
+
+        Returns:
+            float | None: Seconds, 0 when there is no point starting the stage, None for no limit
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        timeout = remaining * settings.LATENCY_STAGE_SHARES.get(stage, 1.0)
+        return timeout if timeout >= settings.LATENCY_MIN_STAGE_SECONDS else 0
+
+    @property
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining < settings.LATENCY_MIN_STAGE_SECONDS
+
+    def skip(self, stage):
+        self.skipped.append(stage)
+        STAGES_SKIPPED.inc(stage)
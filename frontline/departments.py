@@ -0,0 +1,69 @@
+"""
+Department categories used for triage and facility lookups.
+
+The emergency classifier answers with one of DEPARTMENTS, and every
+HealthFacility row carries the matching category in ``department`` so the
+lookup is an equality match. This module is kept free of Django imports so
+the db_utils loaders can use the same mapping.
+"""
+
+DEPARTMENTS = (
+    "Police post",
+    "Police Station",
+    "Hospital",
+    "Clinic",
+    "Pharmacy",
+    "Doctors",
+    "Dentist",
+)
+
+# Fallback category when classification fails; matches any facility
+GENERAL = "General"
+
+# OSM ``amenity`` values
+AMENITY_DEPARTMENTS = {
+    "hospital": "Hospital",
+    "clinic": "Clinic",
+    "pharmacy": "Pharmacy",
+    "chemist": "Pharmacy",
+    "doctors": "Doctors",
+    "dentist": "Dentist",
+    "police": "Police Station",
+}
+
+# OSM ``healthcare`` values, used when ``amenity`` is missing or unknown
+HEALTHCARE_DEPARTMENTS = {
+    "hospital": "Hospital",
+    "clinic": "Clinic",
+    "pharmacy": "Pharmacy",
+    "doctor": "Doctors",
+    "dentist": "Dentist",
+    "laboratory": "Clinic",
+    "blood_donation": "Hospital",
+    "physiotherapist": "Doctors",
+    "optometrist": "Doctors",
+    "alternative": "Doctors",
+}
+
+_BY_LOWER = {name.lower(): name for name in DEPARTMENTS}
+
+
+def _key(value):
+    return value.strip().lower() if isinstance(value, str) else ""
+
+
+def department_for(amenity, healthcare=None):
+    """
+    Map raw OSM amenity/healthcare values to a department.
+
+    Returns:
+        str | None: One of DEPARTMENTS, or None when nothing matches
+    """
+    return AMENITY_DEPARTMENTS.get(_key(amenity)) or HEALTHCARE_DEPARTMENTS.get(_key(healthcare))
+
+
+def normalize_department(department):
+    """
+    Canonical spelling of a classifier department; anything unknown becomes GENERAL.
+    """
+    return _BY_LOWER.get(_key(department), GENERAL)
@@ -0,0 +1,455 @@
+"""
+Process-local spatial index over HealthFacility coordinates.
+
+Facilities are loaded once from the slim facility_lookup table into NumPy
+arrays, partitioned by department and sorted by grid cell inside each
+partition, so a nearest-k lookup only has to look at the cells around the
+query point instead of ranking the whole health_facilities table in the
+database. With FACILITY_SNAPSHOT_PATH set, each process maps a snapshot
+file (facility_snapshot.py) at startup instead of loading the table.
+
+HealthFacility stores longitude in ``x`` and latitude in ``y``.
+"""
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .departments import GENERAL, normalize_department
+from .facility_snapshot import SnapshotError, StringColumn, read_snapshot, write_snapshot
+from .geo import bounding_box, haversine_km
+from .models import FacilityChange, FacilityLookup, HealthFacility
+from .opening_hours import BITMAP_BYTES, compile_opening_hours, open_mask
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = FacilityLookup.FIELDS
+
+# Grid cell size in degrees
+CELL_SIZE = 0.1
+
+# Smallest radius of the first bounding box; it doubles until k hits are found
+INITIAL_RADIUS_KM = 5.0
+
+# Cell coordinates are offset so they stay positive when packed into one key
+_CELL_OFFSET = 1 << 20
+
+
+# Every index instance gets a new version, so caches of lookups can tell when data was reloaded
+_versions = itertools.count(1)
+
+
+def _cell_key(cx, cy):
+    return ((cx + _CELL_OFFSET) << 21) | (cy + _CELL_OFFSET)
+
+
+def _cell_of(value):
+    return np.floor(np.asarray(value, dtype=np.float64) / CELL_SIZE).astype(np.int64)
+
+
+class FacilityIndex:
+    """
+    Immutable nearest-facility index.
+
+    All columns are stored in one set of arrays sorted by (partition, cell);
+    ``partitions`` maps a department to its [start, end) slice; facilities
+    without a department live under the empty key. ``change_cursor`` is the
+    last facility_changes row the index reflects and ``reload_id`` the last
+    full reload row it was built after; ``version`` is unique to this
+    instance.
+
+    Opening hours are kept as packed weekly bitmaps in ``hours``, with
+    ``hours_known`` False where the string is missing or not understood.
+    """
+
+    def __init__(self, ids, xs, ys, departments, names, amenity_types, opening_hours, opening_hours_bitmaps,
+                 change_cursor=0, reload_id=None):
+        self.version = next(_versions)
+        self.change_cursor = change_cursor
+        self.reload_id = reload_id
+        keys = [d or "" for d in departments]
+        partition_names = sorted(set(keys))
+        code_of = {key: code for code, key in enumerate(partition_names)}
+        codes = np.array([code_of[k] for k in keys], dtype=np.int64)
+
+        lons = np.asarray(xs, dtype=np.float64)
+        lats = np.asarray(ys, dtype=np.float64)
+        cells = _cell_key(_cell_of(lons), _cell_of(lats))
+        order = np.lexsort((cells, codes))
+
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.lon = lons[order]
+        self.lat = lats[order]
+        self.cells = cells[order]
+        self.keys = [keys[i] for i in order]
+        self.names = [names[i] for i in order]
+        self.amenity_types = [amenity_types[i] for i in order]
+        self.opening_hours = [opening_hours[i] for i in order]
+        self.hours = np.zeros((len(order), BITMAP_BYTES), dtype=np.uint8)
+        self.hours_known = np.zeros(len(order), dtype=bool)
+        for position, i in enumerate(order):
+            # Rows written before the bitmap column existed are compiled here
+            bitmap = opening_hours_bitmaps[i]
+            bitmap = compile_opening_hours(opening_hours[i]) if bitmap is None else bitmap
+            if bitmap is not None:
+                self.hours[position] = np.frombuffer(bitmap, dtype=np.uint8)
+                self.hours_known[position] = True
+
+        codes = codes[order]
+        self.partitions = {}
+        self._extents = {}
+        for code, key in enumerate(partition_names):
+            start, end = np.searchsorted(codes, [code, code + 1])
+            if start == end:
+                continue
+            self.partitions[key] = (int(start), int(end))
+            cx = _cell_of(self.lon[start:end])
+            cy = _cell_of(self.lat[start:end])
+            self._extents[key] = (int(cx.min()), int(cx.max()), int(cy.min()), int(cy.max()))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def _load(condition=Q()):
+        # The slim read model: tuples straight from the cursor, no model instances
+        return list(FacilityLookup.objects.filter(condition).values_list(*_COLUMNS))
+
+    @classmethod
+    def build(cls):
+        """Load every facility with coordinates from the database."""
+        # Read the cursor first: changes logged during the load are applied again on the next poll
+        cursor = FacilityChange.objects.aggregate(cursor=Max("id"))["cursor"] or 0
+        reload_id = latest_reload_id()
+        rows = cls._load()
+        columns = list(zip(*rows)) if rows else [()] * len(_COLUMNS)
+        return cls(*columns, change_cursor=cursor, reload_id=reload_id)
+
+    def save_snapshot(self, path):
+        """Write the index to a snapshot file (see facility_snapshot.py)."""
+        meta = {
+            "change_cursor": int(self.change_cursor),
+            "reload_id": self.reload_id,
+            "cell_size": CELL_SIZE,
+            "partitions": self.partitions,
+            "extents": self._extents,
+        }
+        write_snapshot(path, meta, {
+            "ids": self.ids,
+            "lon": self.lon,
+            "lat": self.lat,
+            "cells": self.cells,
+            "hours": self.hours,
+            "hours_known": self.hours_known,
+            **{name: StringColumn.encode(getattr(self, name))
+               for name in ("keys", "names", "amenity_types", "opening_hours")},
+        })
+
+    @classmethod
+    def load_snapshot(cls, path):
+        """
+        Map a snapshot written by save_snapshot; the arrays stay read-only
+        views of the file.
+
+        Raises:
+            SnapshotError: When the file is not a usable snapshot
+        """
+        meta, columns = read_snapshot(path)
+        if meta["cell_size"] != CELL_SIZE:
+            raise SnapshotError(f"{path} was written with cell size {meta['cell_size']}, expected {CELL_SIZE}")
+        index = cls.__new__(cls)
+        index.version = next(_versions)
+        index.change_cursor = meta["change_cursor"]
+        index.reload_id = meta.get("reload_id")
+        for name, column in columns.items():
+            setattr(index, name, column)
+        index.partitions = {key: tuple(bounds) for key, bounds in meta["partitions"].items()}
+        index._extents = {key: tuple(extent) for key, extent in meta["extents"].items()}
+        return index
+
+    def apply_changes(self, facility_ids, change_cursor):
+        """
+        Return a new index with the changed facilities' partitions reloaded.
+
+        Only the partitions the facilities were in before or are in now are
+        read from the database; every other partition is carried over from
+        this index.
+        """
+        changed = np.fromiter(facility_ids, dtype=np.int64)
+        touched = np.isin(self.ids, changed)
+        affected = {self.keys[position] for position in np.flatnonzero(touched)}
+        affected.update(
+            department or ""
+            for department in FacilityLookup.objects.filter(id__in=changed.tolist()).values_list("department", flat=True)
+        )
+
+        kept = [np.arange(start, end) for key, (start, end) in self.partitions.items() if key not in affected]
+        kept = np.concatenate(kept) if kept else np.empty(0, dtype=np.int64)
+        columns = [
+            self.ids[kept], self.lon[kept], self.lat[kept],
+            *([values[p] for p in kept] for values in (self.keys, self.names, self.amenity_types, self.opening_hours)),
+            [self.hours[p].tobytes() if self.hours_known[p] else None for p in kept],
+        ]
+
+        condition = Q(department__in=[key for key in affected if key])
+        if "" in affected:
+            condition |= Q(department__isnull=True) | Q(department="")
+        rows = self._load(condition)
+        if rows:
+            loaded = list(zip(*rows))
+            columns = [np.concatenate([kept_values, np.asarray(new_values, dtype=kept_values.dtype)])
+                       if isinstance(kept_values, np.ndarray) else kept_values + list(new_values)
+                       for kept_values, new_values in zip(columns, loaded)]
+        return type(self)(*columns, change_cursor=change_cursor, reload_id=self.reload_id)
+
+    def matching_partitions(self, department):
+        """Partitions to search for ``department``; GENERAL searches all of them."""
+        department = normalize_department(department)
+        if department == GENERAL:
+            return list(self.partitions)
+        return [department] if department in self.partitions else []
+
+    def _initial_radius(self, key, k):
+        """Radius expected to hold k facilities if the partition were spread evenly."""
+        start, end = self.partitions[key]
+        min_cx, max_cx, min_cy, max_cy = self._extents[key]
+        cell_km = CELL_SIZE * 111.0
+        mid_lat = math.radians((min_cy + max_cy + 1) * CELL_SIZE / 2)
+        area_km2 = (max_cx - min_cx + 1) * (max_cy - min_cy + 1) * cell_km * cell_km * math.cos(mid_lat)
+        return max(INITIAL_RADIUS_KM, math.sqrt(k * area_km2 / (math.pi * (end - start))))
+
+    def _box(self, key, min_lat, max_lat, min_lon, max_lon):
+        """
+        Indices of all points of ``key`` inside the lat/lon box.
+
+        Returns:
+            tuple: (indices, covers_partition)
+        """
+        start, end = self.partitions[key]
+        min_cx, max_cx, min_cy, max_cy = self._extents[key]
+        lo_cx = max(math.floor(min_lon / CELL_SIZE), min_cx)
+        hi_cx = min(math.floor(max_lon / CELL_SIZE), max_cx)
+        lo_cy = max(math.floor(min_lat / CELL_SIZE), min_cy)
+        hi_cy = min(math.floor(max_lat / CELL_SIZE), max_cy)
+        # Only a box around every cell of the partition is sure to hold all of its points
+        covers = (min_lon <= min_cx * CELL_SIZE and max_lon >= (max_cx + 1) * CELL_SIZE
+                  and min_lat <= min_cy * CELL_SIZE and max_lat >= (max_cy + 1) * CELL_SIZE)
+        if lo_cx > hi_cx or lo_cy > hi_cy:
+            return np.empty(0, dtype=np.int64), covers
+
+        columns = np.arange(lo_cx, hi_cx + 1, dtype=np.int64)
+        cells = self.cells[start:end]
+        lo = np.searchsorted(cells, _cell_key(columns, lo_cy), side="left")
+        hi = np.searchsorted(cells, _cell_key(columns, hi_cy), side="right")
+        lengths = hi - lo
+        total = int(lengths.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64), covers
+        # Expand the [lo, hi) ranges into one flat index array
+        offsets = np.repeat(lo - np.cumsum(lengths) + lengths, lengths)
+        candidates = start + offsets + np.arange(total, dtype=np.int64)
+
+        # Cells overhang the box, so trim to the exact bounds
+        lat, lon = self.lat[candidates], self.lon[candidates]
+        inside = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+        return candidates[inside], covers
+
+    def nearest(self, department, lat, lon, k=3, open_at=None, open_within=0, candidates=None):
+        """
+        Return positions of the ``k`` facilities closest to (lat, lon) in
+        ``department``, together with their great-circle distances in km.
+
+        A bounding box around the point is grown until it holds k facilities
+        within its radius; only the facilities inside it are ranked.
+
+        With ``open_at`` (a week slot, see opening_hours.week_slot) the
+        ``candidates`` nearest facilities are ranked open first (or opening
+        within ``open_within`` minutes), then unknown hours, then closed,
+        and by distance inside each group.
+        """
+        if open_at is None:
+            return self._nearest(department, lat, lon, k)
+        positions, dist = self._nearest(department, lat, lon, max(k, candidates or k))
+        order = np.lexsort((dist, self.open_rank(positions, open_at, open_within)))[:k]
+        return positions[order], dist[order]
+
+    def open_rank(self, positions, open_at, open_within=0):
+        """0 for open facilities, 1 for unknown hours and 2 for closed ones."""
+        is_open = open_mask(self.hours[positions], open_at, open_within)
+        return np.where(self.hours_known[positions], np.where(is_open, 0, 2), 1)
+
+    def within(self, department, lat, lon, radius_km):
+        """Positions and distances of every ``department`` facility within ``radius_km`` of (lat, lon)."""
+        box = bounding_box(lat, lon, radius_km)
+        found = [self._box(key, *box)[0] for key in self.matching_partitions(department)]
+        positions = np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+        dist = haversine_km(lat, lon, self.lat[positions], self.lon[positions])
+        inside = dist <= radius_km
+        return positions[inside], dist[inside]
+
+    def _nearest(self, department, lat, lon, k):
+        keys = self.matching_partitions(department)
+        if not keys or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        candidates = np.empty(0, dtype=np.int64)
+        dist = np.empty(0, dtype=np.float64)
+        for key in keys:
+            if len(dist) >= k:
+                # Later partitions only matter inside the current k-th distance
+                bound = dist[k - 1]
+                found, _ = self._box(key, *bounding_box(lat, lon, bound))
+                found_dist = haversine_km(lat, lon, self.lat[found], self.lon[found])
+                hits = found_dist <= bound
+                found, found_dist = found[hits], found_dist[hits]
+            else:
+                found, found_dist = self._nearest_in(key, lat, lon, k)
+            candidates = np.concatenate([candidates, found])
+            dist = np.concatenate([dist, found_dist])
+            order = np.argsort(dist, kind="stable")[:k]
+            candidates, dist = candidates[order], dist[order]
+        return candidates, dist
+
+    def _nearest_in(self, key, lat, lon, k):
+        """Grow the box inside one partition until it holds k hits within its radius."""
+        radius_km = self._initial_radius(key, k)
+        while True:
+            candidates, covers = self._box(key, *bounding_box(lat, lon, radius_km))
+            if len(candidates) < k and not covers:
+                radius_km *= 2
+                continue
+            dist = haversine_km(lat, lon, self.lat[candidates], self.lon[candidates])
+            if covers:
+                return candidates, dist
+            # Anything outside the box is further than radius_km away
+            hits = dist <= radius_km
+            if hits.sum() >= k:
+                return candidates[hits], dist[hits]
+            radius_km *= 2
+
+    def row(self, position, distance_km=None, open_at=None):
+        open_now = None
+        if open_at is not None and self.hours_known[position]:
+            open_now = bool(open_mask(self.hours[position], open_at)[0])
+        return {
+            "id": int(self.ids[position]),
+            "department_name": self.amenity_types[position],
+            "location_name": self.names[position],
+            "working_hours": self.opening_hours[position],
+            "open_now": open_now,
+            "distance_km": None if distance_km is None else round(float(distance_km), 2),
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+_polled_at = 0.0
+
+
+def latest_reload_id():
+    """Id of the newest full reload row in facility_changes, or None."""
+    return (FacilityChange.objects.filter(operation=FacilityChange.RELOAD)
+            .order_by("-id").values_list("id", flat=True).first())
+
+
+def _initial_index():
+    """
+    The snapshot brought up to date, when one is configured; otherwise a
+    build. A snapshot taken before the latest full reload is rejected, even
+    when pruning has removed the reload row it would otherwise sync past.
+    """
+    path = settings.FACILITY_SNAPSHOT_PATH
+    if path and os.path.exists(path):
+        try:
+            index = FacilityIndex.load_snapshot(path)
+            reload_id = latest_reload_id()
+            if index.reload_id != reload_id:
+                raise SnapshotError(f"written after reload {index.reload_id}, the database is at reload {reload_id}")
+            return sync_facility_index(index)
+        except (OSError, ValueError, KeyError, SnapshotError) as e:
+            logger.warning("Ignoring snapshot %s: %s", path, e)
+    return FacilityIndex.build()
+
+
+def get_facility_index():
+    """
+    Return the shared index, loading it on first use.
+
+    Every FACILITY_CHANGES_POLL_SECONDS one caller also applies new
+    facility_changes rows; concurrent callers keep using the current index.
+    """
+    global _index, _polled_at
+    index = _index
+    if index is None:
+        with _index_lock:
+            if _index is None:
+                _index = _initial_index()
+                _polled_at = time.monotonic()
+            index = _index
+    elif time.monotonic() - _polled_at >= settings.FACILITY_CHANGES_POLL_SECONDS and _index_lock.acquire(blocking=False):
+        try:
+            _polled_at = time.monotonic()
+            if _index is not None:
+                _index = sync_facility_index(_index)
+                index = _index
+        finally:
+            _index_lock.release()
+    return index
+
+
+def sync_facility_index(index):
+    """
+    Bring ``index`` up to date with facility_changes.
+
+    Returns:
+        FacilityIndex: ``index`` itself when nothing changed, a partially
+        rebuilt index for small change sets, a full rebuild for large ones
+        or after a full reload of the table
+    """
+    limit = settings.FACILITY_CHANGES_MAX_APPLY
+    changes = list(
+        FacilityChange.objects
+        .filter(id__gt=index.change_cursor)
+        .order_by("id")
+        .values_list("id", "facility_id", "operation")[:limit + 1]
+    )
+    if not changes:
+        return index
+    if len(changes) > limit or any(operation == FacilityChange.RELOAD for _, _, operation in changes):
+        return FacilityIndex.build()
+    return index.apply_changes({facility_id for _, facility_id, _ in changes}, changes[-1][0])
+
+
+def rebuild_facility_index():
+    """Eagerly rebuild the index from the database and swap it in."""
+    global _index, _polled_at
+    index = FacilityIndex.build()
+    with _index_lock:
+        _index = index
+        _polled_at = time.monotonic()
+    return index
+
+
+def invalidate_facility_index():
+    """Drop the index; the next lookup rebuilds it from the database."""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+@receiver(post_save, sender=HealthFacility)
+@receiver(post_delete, sender=HealthFacility)
+def _poll_on_change(sender, **kwargs):
+    # The write is logged in facility_changes (see models._sync_lookup) for every
+    # process; this one applies it on its next lookup instead of waiting for the
+    # poll interval
+    global _polled_at
+    _polled_at = 0.0
@@ -0,0 +1,140 @@
+"""
+Columnar snapshot file for the facility index.
+
+``manage.py export_facility_snapshot`` writes the index's hot columns to
+one file, already in partition/cell order. Workers map it read-only with
+np.memmap (FACILITY_SNAPSHOT_PATH) instead of querying health_facilities
+at boot, so startup is a file open and every worker on a node shares the
+same page cache.
+
+Layout: MAGIC, a little-endian uint32 format version and uint32 header
+length, a JSON header (metadata plus the dtype, shape and offset of every
+column), then each column's raw bytes at a 64-byte aligned offset. String
+columns are stored as UTF-8 bytes plus int64 offsets and a null mask, and
+are decoded one value at a time on access.
+"""
+import json
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+MAGIC = b"FLSNAP\x00\x00"
+FORMAT_VERSION = 1
+
+_PREAMBLE = struct.Struct("<8sII")
+_ALIGN = 64
+
+
+class SnapshotError(Exception):
+    pass
+
+
+class StringColumn:
+    """Read-only sequence of ``str | None`` backed by (mapped) arrays."""
+
+    def __init__(self, offsets, data, nulls):
+        self.offsets = offsets
+        self.data = data
+        self.nulls = nulls
+
+    @classmethod
+    def encode(cls, values):
+        encoded = [b"" if value is None else value.encode() for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        nulls = np.array([value is None for value in values], dtype=bool)
+        return cls(offsets, data, nulls)
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def __getitem__(self, position):
+        if self.nulls[position]:
+            return None
+        return self.data[self.offsets[position]:self.offsets[position + 1]].tobytes().decode()
+
+    def __iter__(self):
+        return (self[position] for position in range(len(self)))
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+def write_snapshot(path, meta, columns):
+    """
+    Write ``columns`` (name -> np.ndarray or StringColumn) to ``path``.
+
+    The file is written next to ``path`` and renamed over it, so workers
+    that still map the previous snapshot keep reading a complete file.
+    """
+    arrays = {}
+    for name, column in columns.items():
+        if isinstance(column, StringColumn):
+            for part in ("offsets", "data", "nulls"):
+                arrays[f"{name}.{part}"] = getattr(column, part)
+        else:
+            arrays[name] = np.ascontiguousarray(column)
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _aligned(offset + array.nbytes)
+    strings = [name for name, column in columns.items() if isinstance(column, StringColumn)]
+    header = json.dumps({"meta": meta, "columns": layout, "strings": strings}).encode()
+    start = _aligned(_PREAMBLE.size + len(header))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    handle, temporary = tempfile.mkstemp(dir=directory, prefix=".facility-snapshot-")
+    try:
+        with os.fdopen(handle, "wb") as file:
+            file.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+            file.write(header)
+            for name, array in arrays.items():
+                file.seek(start + layout[name]["offset"])
+                file.write(array.tobytes())
+            file.truncate(start + offset)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def read_snapshot(path):
+    """
+    Map a snapshot read-only.
+
+    Returns:
+        tuple: (meta, columns); columns are views into the mapping
+
+    Raises:
+        SnapshotError: When the file is not a snapshot of this format version
+    """
+    raw = np.memmap(path, dtype=np.uint8, mode="r")
+    if len(raw) < _PREAMBLE.size:
+        raise SnapshotError(f"{path} is too short to be a facility snapshot")
+    magic, version, header_length = _PREAMBLE.unpack(raw[:_PREAMBLE.size].tobytes())
+    if magic != MAGIC:
+        raise SnapshotError(f"{path} is not a facility snapshot")
+    if version != FORMAT_VERSION:
+        raise SnapshotError(f"{path} has snapshot format {version}, expected {FORMAT_VERSION}")
+    header = json.loads(raw[_PREAMBLE.size:_PREAMBLE.size + header_length].tobytes())
+    start = _aligned(_PREAMBLE.size + header_length)
+
+    arrays = {}
+    for name, spec in header["columns"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        offset = start + spec["offset"]
+        arrays[name] = raw[offset:offset + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+
+    columns = {}
+    for name in header["strings"]:
+        columns[name] = StringColumn(*(arrays.pop(f"{name}.{part}") for part in ("offsets", "data", "nulls")))
+    columns.update(arrays)
+    return header["meta"], columns
@@ -0,0 +1,222 @@
+"""
+Local OpenAI-compatible stand-in for OpenRouter, for offline benchmarks.
+
+Answers ``POST .../chat/completions``, plain or streamed, with a canned
+reply picked by a marker in the prompt (one CannedReply per agent), after
+a delay of ``latency`` +/- ``jitter`` seconds. Streamed replies are sent
+word by word, ``token_delay`` seconds apart. Point OPENROUTER_BASE_URL
+at ``base_url`` (or let ``manage.py bench_chat_flow`` do it), or run it
+on its own:
+
+    python -m frontline.fake_openrouter --port 8765 --latency 0.3 --jitter 0.1
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class CannedReply:
+    """
+    Reply for the agent whose prompt contains ``marker``; ``latency`` and
+    ``jitter`` override the server's for this agent.
+    """
+
+    def __init__(self, name, marker, reply, latency=None, jitter=None):
+        self.name = name
+        self.marker = marker
+        self.reply = reply
+        self.latency = latency
+        self.jitter = jitter
+
+
+# Markers are taken from the prompts in frontline.helpers; the last one matches anything
+DEFAULT_REPLIES = (
+    CannedReply("classify", "classify it based on the department",
+                json.dumps({"department": "Hospital", "emergency_level": 2})),
+    CannedReply("summary", "You are a summarizing assistant",
+                json.dumps({"updated_summary": "The user is looking for nearby medical help.",
+                            "appointment_active": False})),
+    CannedReply("appointment", "You are an assistant that schedules appointments",
+                json.dumps({"answer": "Could you tell me your first name?", "first_name": None, "last_name": None,
+                            "email": None, "chosen_department_id": None, "all_fields_collected": False})),
+    CannedReply("triage", "You are an emergency triage assistant",
+                json.dumps({"department": "Hospital", "emergency_level": 2,
+                            "answer": "I'm sorry you're dealing with this. The closest hospitals are listed below, "
+                                      "and if it gets worse please call Rescue 1122 right away."})),
+    CannedReply("reply", "",
+                "I'm sorry you're dealing with this. The closest places that can help are listed below, "
+                "and if it gets worse please call Rescue 1122 right away."),
+)
+
+
+def load_replies(path):
+    """
+    DEFAULT_REPLIES with overrides from a JSON file of
+    ``{"<name>": {"reply": ..., "marker": ..., "latency": ..., "jitter": ...}}``;
+    a reply that is not a string is sent as JSON.
+    """
+    with open(path) as file:
+        overrides = json.load(file)
+    replies = []
+    for default in DEFAULT_REPLIES:
+        override = overrides.get(default.name, {})
+        reply = override.get("reply", default.reply)
+        replies.append(CannedReply(
+            default.name,
+            override.get("marker", default.marker),
+            reply if isinstance(reply, str) else json.dumps(reply),
+            override.get("latency", default.latency),
+            override.get("jitter", default.jitter),
+        ))
+    return replies
+
+
+class FakeOpenRouter:
+    def __init__(self, latency=0.3, jitter=0.1, token_delay=0.0, replies=DEFAULT_REPLIES, seed=None,
+                 host="127.0.0.1", port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.replies = list(replies)
+        self.calls = {reply.name: 0 for reply in self.replies}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        """Serve on a daemon thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-openrouter", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def match(self, prompt):
+        reply = next((reply for reply in self.replies if reply.marker in prompt), self.replies[-1])
+        with self._lock:
+            self.calls[reply.name] += 1
+            latency = self.latency if reply.latency is None else reply.latency
+            jitter = self.jitter if reply.jitter is None else reply.jitter
+            delay = max(0.0, latency + self._random.uniform(-jitter, jitter))
+        return reply, delay
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are separate writes; with Nagle on, each reply waits for a delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self.send_error(404)
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+                reply, delay = fake.match(prompt)
+                time.sleep(delay)
+                if body.get("stream"):
+                    self._stream(reply.reply, body.get("model", "fake"))
+                else:
+                    self._json(_completion(reply.reply, body.get("model", "fake")))
+
+            def _json(self, payload):
+                data = json.dumps(payload).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, text, model):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for number, word in enumerate(text.split(" ")):
+                    if number and fake.token_delay:
+                        time.sleep(fake.token_delay)
+                    self._chunk(_delta(model, {"role": "assistant", "content": (" " if number else "") + word}))
+                self._chunk(_delta(model, {}, finish_reason="stop"))
+                self._write(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def _chunk(self, payload):
+                self._write(b"data: " + json.dumps(payload).encode() + b"\n\n")
+
+            def _write(self, data):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+_USAGE = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+
+def _completion(text, model):
+    return {
+        "id": "fake", "object": "chat.completion", "created": int(time.time()), "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+        "usage": _USAGE,
+    }
+
+
+def _delta(model, delta, finish_reason=None):
+    chunk = {
+        "id": "fake", "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    if finish_reason:
+        chunk["usage"] = _USAGE
+    return chunk
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve canned OpenAI-compatible chat completions.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3, help="Seconds before each reply starts")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Latency varies uniformly by +/- this much")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between streamed words")
+    parser.add_argument("--replies", help="JSON file overriding the canned replies (see load_replies)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    replies = load_replies(args.replies) if args.replies else DEFAULT_REPLIES
+    server = FakeOpenRouter(args.latency, args.jitter, args.token_delay, replies, args.seed, args.host, args.port)
+    print(f"Serving fake OpenRouter at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Great-circle distance helpers used to rank facilities.
+
+Coordinates are plain degrees; all functions accept NumPy arrays for the
+facility side so a whole candidate set is ranked in one vectorized pass.
+"""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distance in km from (lat, lon) to every point of (lats, lons)."""
+    lat1 = math.radians(lat)
+    lat2 = np.radians(lats)
+    dlat = lat2 - lat1
+    dlon = np.radians(lons) - math.radians(lon)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def bounding_box(lat, lon, radius_km):
+    """
+    Smallest lat/lon box containing every point within ``radius_km`` of (lat, lon).
+
+    Returns:
+        tuple: (min_lat, max_lat, min_lon, max_lon) in degrees
+    """
+    angular = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angular)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90 or angular >= math.pi / 2:
+        # The circle reaches a pole, so every longitude is inside
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+    dlon = math.degrees(math.asin(math.sin(angular) / math.cos(math.radians(lat))))
+    return min_lat, max_lat, lon - dlon, lon + dlon
+
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_cell(lat, lon, precision):
+    """
+    Geohash of (lat, lon) with ``precision`` characters, and the cell's bounds.
+
+    Returns:
+        tuple: (geohash, (min_lat, max_lat, min_lon, max_lon))
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        bounds, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_ALPHABET[value])
+            bits = value = 0
+    return "".join(chars), (lat_range[0], lat_range[1], lon_range[0], lon_range[1])
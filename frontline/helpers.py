@@ -1,70 +1,76 @@
-from django.db.models import F, FloatField, ExpressionWrapper, Q
-from django.db.models.functions import Power
-from .models import WantAppointment, HealthFacility, Summary
+from .models import WantAppointment, Summary
+from .facility_index import get_facility_index
+from .nearest_cache import nearest_cache
+from .classification_cache import classification_cache
+from .triage import classify_locally
+from .departments import DEPARTMENTS, GENERAL, normalize_department
+from .session_state import session_states
+from .opening_hours import week_slot
+from .metrics import JSON_FALLBACKS, record_llm_call, timed
+from django.conf import settings
 from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+from zoneinfo import ZoneInfo
+import logging
 
+logger = logging.getLogger(__name__)
 
-def wants_appointment(session_id: str) -> bool | None:
-    print(f"[wants_appointment] Checking if session_id={session_id} wants an appointment...")
 
+@timed
+def wants_appointment(session_id: str) -> bool | None:
     try:
         record = WantAppointment.objects.get(session_id=session_id)
-        print(f"[wants_appointment] Found record: {record.session_id}, wants_appointment={record.wants_appointment}")
+        logger.debug("Session %s wants_appointment=%s", session_id, record.wants_appointment)
         return record.wants_appointment
     except ObjectDoesNotExist:
-        print(f"[wants_appointment] No record found for session_id={session_id}")
+        logger.debug("No appointment record for session %s", session_id)
         return None
 
 
-def get_closest_matching_department(coordinates: tuple[float, float], department: str):
-    x, y = coordinates
-    print(f"[get_closest_matching_department] Looking for department='{department}' near coordinates=({x}, {y})")
-
-    # distance = (x - facility.x)^2 + (y - facility.y)^2
-    distance_expr = ExpressionWrapper(
-        Power(F("x") - x, 2) + Power(F("y") - y, 2),
-        output_field=FloatField()
-    )
+@timed
+def get_closest_matching_department(coordinates: tuple[float, float], department: str, emergency_level=None):
+    """
+    The 3 closest facilities for the department, open ones first.
 
-    facilities = (
-        HealthFacility.objects
-        .filter(
-            Q(amenity__icontains=department)
+    Urgent users (emergency level 1 or 2) need a facility that is open now;
+    for the rest one opening within OPENING_SOON_MINUTES is as good.
+    """
+    if not coordinates:
+        logger.info("No coordinates given for department %r", department)
+        return []
+
+    latitude, longitude = coordinates
+
+    index = get_facility_index()
+    open_at = week_slot(timezone.localtime(timezone=ZoneInfo(settings.OPENING_HOURS_TIME_ZONE)))
+    open_within = 0 if emergency_level in (1, 2, "1", "2") else settings.OPENING_SOON_MINUTES
+    positions, distances = nearest_cache.nearest(index, department, float(latitude), float(longitude), k=3,
+                                                 open_at=open_at, open_within=open_within,
+                                                 candidates=settings.OPEN_NOW_CANDIDATES)
+
+    results = [index.row(position, distance, open_at) for position, distance in zip(positions, distances)]
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "%d facilities for department %r near (%s, %s)", len(results), department, latitude, longitude,
+            extra={"facilities": [(result["id"], result["distance_km"], result["open_now"]) for result in results]},
         )
-        .annotate(distance=distance_expr)
-        .order_by("distance")[:3]
-    )
-
-    print(f"[get_closest_matching_department] Returning {len(facilities)} facilities (limited to 3)")
-
-    results = []
-    for f in facilities:
-        print(f"[get_closest_matching_department] Found facility: id={f.id}, "
-              f"name={f.name}, dept={f.health_amenity_type}, distance={f.distance}, "
-              f"working_hours={f.opening_hours}")
-
-        results.append({
-            "id": f.id,
-            "department_name": f.health_amenity_type,
-            "location_name": f.name,
-            "working_hours": f.opening_hours,
-        })
-
-    print(f"[get_closest_matching_department] Final results: {results}")
     return results
 
 import os
 import json
+import time
+import asyncio
+import threading
 from dotenv import load_dotenv, find_dotenv
-from agents import Agent, Runner, AsyncOpenAI, OpenAIChatCompletionsModel
+from agents import Agent, Runner, AsyncOpenAI, OpenAIChatCompletionsModel, set_tracing_disabled
 from agents.run import RunConfig
+from openai.types.responses import ResponseTextDeltaEvent
 
 # Load environment variables from .env file
 load_dotenv(find_dotenv())
 
 # Get the API key from environment variables
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY')
-print("openrouter api key", OPENROUTER_API_KEY)
 
 # Check if the API key is present; if not, raise an error
 if not OPENROUTER_API_KEY:
@@ -83,9 +89,11 @@ if not OPENROUTER_API_KEY:
 # """
 
 
+OPENROUTER_BASE_URL = os.getenv('OPENROUTER_BASE_URL', "https://openrouter.ai/api/v1")
+
 external_client = AsyncOpenAI(
     api_key=OPENROUTER_API_KEY,
-    base_url="https://openrouter.ai/api/v1",
+    base_url=OPENROUTER_BASE_URL,
 )
 
 model = OpenAIChatCompletionsModel(
@@ -98,26 +106,145 @@ run_config = RunConfig(
     model_provider=external_client,
     tracing_disabled=True
 )
+# run_config is not passed to the runs, so disable tracing globally instead of exporting a trace per call
+set_tracing_disabled(True)
 
 # Format the context with the data
 # formatted_context = context.format(data=json.dumps(university_data, indent=2))
 # agent: Agent = Agent(name="Iqra University Assistant", model=model)
 
 
-def classify_emergency_agent(latency, message):
+# Agents are stateless apart from their model, so one instance of each is shared by all requests
+emergency_classifier = Agent(name="Emergency Classifier", model=model)
+user_facing_assistant = Agent(name="User Facing Assistant", model=model)
+conversation_summarizer = Agent(name="Conversation Summarizer", model=model)
+appointment_scheduler = Agent(name="Appointment Agent", model=model)
+emergency_triager = Agent(name="Emergency Triage", model=model)
+
+
+class LLMLoop:
     """
-    LLM agent which returns in json: department, emergency_level
-    
-    Args:
-        latency: Response time requirement
-        message: Emergency message to classify
-    
-    Returns:
-        dict: JSON with department and emergency_level keys
+    Long-lived event loop on a daemon thread that runs every agent call.
+
+    external_client keeps its HTTP connection pool on the loop that first used
+    it; running all calls on this one loop keeps keep-alive TLS connections to
+    OpenRouter warm instead of opening a new loop (and pool) per Runner.run_sync.
     """
-    emergency_agent = Agent(name="Emergency Classifier", model=model)
-    
-    prompt = f"""
+
+    def __init__(self):
+        self._loop = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    threading.Thread(target=loop.run_forever, name="llm-loop", daemon=True).start()
+                    self._loop = loop
+        return self._loop
+
+    def submit(self, coro):
+        """Schedule a coroutine on the loop; returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+llm_loop = LLMLoop()
+
+
+def run_agent(agent, prompt, timeout=None):
+    """
+    Run an agent from synchronous code on the shared LLM loop.
+
+    Raises TimeoutError, and cancels the run, when it takes longer than ``timeout`` seconds.
+    """
+    started = time.perf_counter()
+    future = llm_loop.submit(Runner.run(agent, prompt))
+    try:
+        result = future.result(timeout)
+    except TimeoutError:
+        future.cancel()
+        record_llm_call(agent.name, time.perf_counter() - started, "timeout")
+        raise
+    except Exception:
+        record_llm_call(agent.name, time.perf_counter() - started, "error")
+        raise
+    record_llm_call(agent.name, time.perf_counter() - started, "ok", result)
+    return result
+
+
+async def arun_agent(agent, prompt, timeout=None):
+    """Run an agent from another event loop (e.g. an async view) on the shared LLM loop."""
+    started = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(asyncio.wrap_future(llm_loop.submit(Runner.run(agent, prompt))), timeout)
+    except asyncio.TimeoutError:
+        record_llm_call(agent.name, time.perf_counter() - started, "timeout")
+        raise
+    except Exception:
+        record_llm_call(agent.name, time.perf_counter() - started, "error")
+        raise
+    record_llm_call(agent.name, time.perf_counter() - started, "ok", result)
+    return result
+
+
+async def astream_agent(agent, prompt):
+    """
+    Yield the agent's output text as the model produces it.
+
+    The run happens on the shared LLM loop; deltas are handed over to the
+    caller's loop through a queue. Closing the generator cancels the run.
+    """
+    caller_loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    finished = object()
+
+    async def produce():
+        started = time.perf_counter()
+        result = None
+        try:
+            result = Runner.run_streamed(agent, prompt)
+            async for event in result.stream_events():
+                if event.type == "raw_response_event" and isinstance(event.data, ResponseTextDeltaEvent):
+                    caller_loop.call_soon_threadsafe(queue.put_nowait, event.data.delta)
+            record_llm_call(agent.name, time.perf_counter() - started, "ok", result)
+        except asyncio.CancelledError:
+            record_llm_call(agent.name, time.perf_counter() - started, "cancelled", result)
+            raise
+        except Exception as e:
+            record_llm_call(agent.name, time.perf_counter() - started, "error")
+            caller_loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            caller_loop.call_soon_threadsafe(queue.put_nowait, finished)
+
+    future = llm_loop.submit(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        future.cancel()
+
+
+def clean_response(raw_response):
+    """Remove markdown code blocks the model sometimes wraps around its answer."""
+    raw_response = raw_response.strip()
+    if raw_response.startswith('```json'):
+        raw_response = raw_response[7:]  # Remove ```json
+    if raw_response.startswith('```'):
+        raw_response = raw_response[3:]   # Remove ```
+    if raw_response.endswith('```'):
+        raw_response = raw_response[:-3]  # Remove trailing ```
+    return raw_response.strip()
+
+
+def _classification_prompt(latency, message):
+    return f"""
     Analyze this emergency message and classify it based on the department and emergency level.
     
     Message: {message}
@@ -131,30 +258,127 @@ def classify_emergency_agent(latency, message):
     
     Only return the JSON object, no additional text.
     """
-    
-    result = Runner.run_sync(emergency_agent, prompt)
-    
-    # Clean the response - remove markdown code blocks if present
-    raw_response = result.final_output.strip()
-    if raw_response.startswith('```json'):
-        raw_response = raw_response[7:]  # Remove ```json
-    if raw_response.startswith('```'):
-        raw_response = raw_response[3:]   # Remove ```
-    if raw_response.endswith('```'):
-        raw_response = raw_response[:-3]  # Remove trailing ```
-    
-    raw_response = raw_response.strip()
-    
+
+
+def _valid_classification(response_json):
+    """
+    The department and emergency level of a classifier answer, with the
+    department in its canonical spelling.
+
+    Returns:
+        dict | None: None unless the department is one of DEPARTMENTS and
+        the level an int from 1 to 5
+    """
+    if not isinstance(response_json, dict):
+        return None
+    department = normalize_department(response_json.get("department"))
+    level = response_json.get("emergency_level")
+    if department == GENERAL or isinstance(level, bool) or not isinstance(level, int) or not 1 <= level <= 5:
+        return None
+    return {"department": department, "emergency_level": level}
+
+
+def _parse_classification(message, raw_response):
     try:
         # Parse the JSON response
-        response_json = json.loads(raw_response)
-        return response_json
+        response_json = json.loads(clean_response(raw_response))
     except json.JSONDecodeError:
-        # If JSON parsing fails, return a default response
+        response_json = None
+    classification = _valid_classification(response_json)
+    if classification is None:
+        # Unparseable or off-list answers get a default response
+        JSON_FALLBACKS.inc(emergency_classifier.name)
         return {
             "department": "General",
             "emergency_level": 3
         }
+    # Only real answers are cached, never the fallback
+    classification_cache.set(message, classification)
+    return classification
+
+
+@timed
+def classify_emergency_agent(latency, message, timeout=None):
+    """
+    LLM agent which returns in json: department, emergency_level
+    
+    Args:
+        latency: Response time requirement
+        message: Emergency message to classify
+        timeout: Seconds to wait for the LLM before raising TimeoutError
+    
+    Returns:
+        dict: JSON with department and emergency_level keys
+    """
+    cached = classification_cache.get(message)
+    if cached is not None:
+        return cached
+
+    result = run_agent(emergency_classifier, _classification_prompt(latency, message), timeout)
+    return _parse_classification(message, result.final_output)
+
+
+@timed
+async def aclassify_emergency_agent(latency, message, timeout=None):
+    """Async variant of classify_emergency_agent."""
+    cached = classification_cache.get(message)
+    if cached is not None:
+        return cached
+
+    result = await arun_agent(emergency_classifier, _classification_prompt(latency, message), timeout)
+    return _parse_classification(message, result.final_output)
+
+
+@timed
+def classify_emergency(latency, message, timeout=None):
+    """
+    Classify with the local triage tiers, falling back to classify_emergency_agent
+    when they are not confident enough.
+
+    Returns:
+        dict: JSON with department and emergency_level keys, plus the source of the answer
+    """
+    result = classify_locally(message)
+    if result is not None:
+        return result
+    return dict(classify_emergency_agent(latency, message, timeout), source="llm")
+
+
+@timed
+async def aclassify_emergency(latency, message, timeout=None):
+    """Async variant of classify_emergency."""
+    result = classify_locally(message)
+    if result is not None:
+        return result
+    return dict(await aclassify_emergency_agent(latency, message, timeout), source="llm")
+
+
+@timed
+def classify_without_llm(message):
+    """
+    classify_emergency's answer when it needs no LLM call: the local triage
+    tiers' or a cached classification. None when the LLM would be asked.
+    """
+    result = classify_locally(message)
+    if result is not None:
+        return result
+    cached = classification_cache.get(message)
+    if cached is not None:
+        return dict(cached, source="llm")
+    return None
+
+
+def fallback_classification(message):
+    """
+    Classification used when the LLM classifier ran out of time: the local
+    tiers' best guess at any confidence, or General.
+    """
+    result = classify_locally(message, threshold=0.0)
+    if result is not None:
+        return result
+    return {"department": "General", "emergency_level": 3, "source": "fallback"}
+
+
 #####################################################
 # def secondary_agent(latency, message):
 #     """
@@ -214,24 +438,8 @@ def classify_emergency_agent(latency, message):
 # print(json.dumps(emergency_result, indent=2))
 
 
-def user_facing_agent(latency, message, summary, messages, departments, emergency_level):
-    """
-    LLM agent that provides a conversational response to the user based on their message and context.
-
-    Args:
-        latency: Response time requirement
-        message: Emergency message to classify
-        summary: Conversation summary so far
-        messages: Last 3 messages in this chat
-        departments: Relevant departments for this user
-        emergency_level: Current emergency level
-
-    Returns:
-        str: A conversational response to the user
-    """
-    emergency_agent = Agent(name="Emergency Classifier", model=model)
-
-    prompt = f"""
+def _user_facing_prompt(latency, message, summary, messages, departments, emergency_level):
+    return f"""
         You are a helpful assistant that provides users with clear and supportive responses.
         Conversation summary so far:
         {summary}
@@ -241,7 +449,8 @@ def user_facing_agent(latency, message, summary, messages, departments, emergenc
         {departments}
         Emergency level is {emergency_level}.
         The departments are given in the format:
-        id, department_name, location_name, working_hours
+        id, department_name, location_name, working_hours, open_now, distance_km
+        open_now is true or false when the working hours are known, otherwise null.
         The user’s latest message:
         "{message}"
         Your tasks:
@@ -250,46 +459,188 @@ def user_facing_agent(latency, message, summary, messages, departments, emergenc
         3. Present the relevant departments in a **clear, user-friendly message**, including:
            - Department name
            - Location name
-           - Working hours
+           - Working hours, and whether it is open right now
+           - Distance in km
         4. If the emergency_level is 1 or 2, prioritize suggesting immediate help options (e.g., emergency services) in your response.
         5. If the emergency_level is 3, 4, or 5, ask the user if they would like an appointment.
         6. Keep the response conversational, short, and easy to understand.
     """
 
-    result = Runner.run_sync(emergency_agent, prompt)
 
-    # Clean the response - remove markdown code blocks if present
-    raw_response = result.final_output.strip()
-    if raw_response.startswith('```json'):
-        raw_response = raw_response[7:]  # Remove ```json
-    if raw_response.startswith('```'):
-        raw_response = raw_response[3:]   # Remove ```
-    if raw_response.endswith('```'):
-        raw_response = raw_response[:-3]  # Remove trailing ```
+@timed
+def user_facing_agent(latency, message, summary, messages, departments, emergency_level, timeout=None):
+    """
+    LLM agent that provides a conversational response to the user based on their message and context.
 
-    raw_response = raw_response.strip()
+    Args:
+        latency: Response time requirement
+        message: Emergency message to classify
+        summary: Conversation summary so far
+        messages: Last 3 messages in this chat
+        departments: Relevant departments for this user
+        emergency_level: Current emergency level
+        timeout: Seconds to wait for the LLM before raising TimeoutError
 
-    return raw_response
+    Returns:
+        str: A conversational response to the user
+    """
+    prompt = _user_facing_prompt(latency, message, summary, messages, departments, emergency_level)
+    result = run_agent(user_facing_assistant, prompt, timeout)
+    return clean_response(result.final_output)
 
-    
 
-import json
+@timed
+async def auser_facing_agent(latency, message, summary, messages, departments, emergency_level, timeout=None):
+    """Async variant of user_facing_agent."""
+    prompt = _user_facing_prompt(latency, message, summary, messages, departments, emergency_level)
+    result = await arun_agent(user_facing_assistant, prompt, timeout)
+    return clean_response(result.final_output)
 
-def summarizing_agent(latency, message, summary, session_id):
+
+def astream_user_facing_agent(latency, message, summary, messages, departments, emergency_level):
+    """Streaming variant of user_facing_agent; an async iterator of text deltas."""
+    prompt = _user_facing_prompt(latency, message, summary, messages, departments, emergency_level)
+    return astream_agent(user_facing_assistant, prompt)
+
+
+def fallback_reply(departments, emergency_level):
     """
-    LLM agent which returns a structured summary of the conversation so far and updates/creates the Summary model.
+    Templated reply used when user_facing_agent ran out of time.
+
+    Returns:
+        str: The nearby facilities, with emergency numbers first for levels 1 and 2
+    """
+    lines = []
+    if emergency_level in (1, 2, "1", "2"):
+        lines.append("If this is life-threatening, call Rescue 1122 or Police 15 right away.")
+    if departments:
+        lines.append("These are the closest places that can help:")
+        for department in departments:
+            name = department["location_name"] or department["department_name"] or "Unnamed facility"
+            if department["department_name"] and department["department_name"] != name:
+                name = f"{name} ({department['department_name']})"
+            hours = department["working_hours"] or "not listed"
+            if department.get("open_now") is not None:
+                hours = f"{hours} ({'open now' if department['open_now'] else 'closed now'})"
+            lines.append(f"- {name}, {department['distance_km']} km away, hours: {hours}")
+    else:
+        lines.append("Share your location and I can list the closest places that can help.")
+    return "\n".join(lines)
+
+
+@timed
+def prefetch_facilities(coordinates):
+    """
+    get_closest_matching_department for every department, for the single-call
+    triage where the department is only known once the LLM has answered.
+
+    The emergency level is not known yet either, so facilities are ranked as
+    for an urgent case: open right now first.
+
+    Returns:
+        dict: department -> its closest facilities
+    """
+    return {department: get_closest_matching_department(coordinates, department, 1) for department in DEPARTMENTS}
+
+
+def facilities_for(prefetched, department):
+    """The prefetched facilities of ``department``; GENERAL gets the 3 closest of any department, open ones first."""
+    department = normalize_department(department)
+    if department != GENERAL:
+        return prefetched.get(department, [])
+    facilities = [facility for found in prefetched.values() for facility in found]
+    open_rank = {True: 0, None: 1, False: 2}
+    return sorted(facilities, key=lambda facility: (open_rank[facility["open_now"]], facility["distance_km"]))[:3]
+
+
+def _triage_prompt(latency, message, summary, messages, facilities):
+    departments = "\n".join(f"        {department}: {found}" for department, found in facilities.items())
+    return f"""
+        You are an emergency triage assistant: classify the user's message and reply to the user in one answer.
+        Conversation summary so far:
+        {summary}
+        Last 3 messages in this chat:
+        {messages}
+        The closest facilities of each department:
+{departments}
+        The facilities are given in the format:
+        id, department_name, location_name, working_hours, open_now, distance_km
+        open_now is true or false when the working hours are known, otherwise null.
+        The user’s latest message:
+        "{message}"
+        Response time requirement: {latency} seconds
+        Your tasks:
+        1. Choose the department that can help the user. It MUST be exactly one of: "Police post", "Police Station", "Hospital", "Clinic", "Pharmacy", "Doctors", "Dentist"
+        2. Choose the emergency level (1-5, where 1 is critical/life-threatening, 5 is low priority).
+        3. Write the reply to the user, using only the facilities of the department you chose:
+           - If the user is in distress or asking for help, start with a calm and supportive message.
+           - Present the facilities in a clear, user-friendly way: department name, location name, working hours and whether it is open right now, and distance in km.
+           - If the emergency level is 1 or 2, prioritize immediate help options (e.g., emergency services).
+           - If the emergency level is 3, 4, or 5, ask the user if they would like an appointment.
+           - Keep it conversational, short, and easy to understand.
+        Respond with a JSON object containing:
+        - department: The department you chose
+        - emergency_level: The emergency level you chose
+        - answer: Your reply to the user
+        Only return the JSON object, no additional text.
+    """
+
+
+def _parse_triage(message, raw_response, facilities):
+    try:
+        response_json = json.loads(clean_response(raw_response))
+    except json.JSONDecodeError:
+        response_json = None
+    if not isinstance(response_json, dict) or not response_json.get("answer"):
+        # The reply is the part the user sees, so fall back to the templated one
+        JSON_FALLBACKS.inc(emergency_triager.name)
+        result = fallback_classification(message)
+        return dict(result, answer=fallback_reply(facilities_for(facilities, result["department"]),
+                                                  result["emergency_level"]))
+    classification = _valid_classification(response_json)
+    if classification is None:
+        # Off-list department or level: keep the reply, classify locally and cache nothing
+        JSON_FALLBACKS.inc(emergency_triager.name)
+        return dict(fallback_classification(message), answer=clean_response(response_json["answer"]))
+    # Later turns with the same message classify from the cache
+    classification_cache.set(message, classification)
+    return dict(classification, answer=clean_response(response_json["answer"]), source="llm")
+
+
+@timed
+def triage_agent(latency, message, summary, messages, facilities, timeout=None):
+    """
+    LLM agent that classifies the message and writes the reply in one call (TRIAGE_MODE "single_call").
 
     Args:
         latency: Response time requirement
-        message: Latest user message
-        summary: Previous summary
-        session_id: Unique session identifier
+        message: The user's latest message
+        summary: Conversation summary so far
+        messages: Last 3 messages in this chat
+        facilities: prefetch_facilities result, department -> closest facilities
+        timeout: Seconds to wait for the LLM before raising TimeoutError
 
     Returns:
-        dict: JSON with conversation summary and extracted key info
+        dict: department, emergency_level, answer and the source of the classification
     """
-    summarizer_agent = Agent(name="Conversation Summarizer", model=model)
-    prompt = f"""
+    result = run_agent(emergency_triager, _triage_prompt(latency, message, summary, messages, facilities), timeout)
+    return _parse_triage(message, result.final_output, facilities)
+
+
+@timed
+async def atriage_agent(latency, message, summary, messages, facilities, timeout=None):
+    """Async variant of triage_agent."""
+    prompt = _triage_prompt(latency, message, summary, messages, facilities)
+    result = await arun_agent(emergency_triager, prompt, timeout)
+    return _parse_triage(message, result.final_output, facilities)
+
+
+# Shown instead of the appointment agent's next question when it ran out of time
+APPOINTMENT_TIMEOUT_REPLY = "Sorry, this is taking longer than expected. Could you send that again?"
+
+
+def _summary_prompt(message, summary):
+    return f"""
         You are a summarizing assistant.
         Current conversation summary:
         {summary}
@@ -303,54 +654,55 @@ def summarizing_agent(latency, message, summary, session_id):
            - updated_summary: Concise but complete summary of the conversation so far
            - appointment_active: Boolean indicating if appointment booking is in progress
     """
-    result = Runner.run_sync(summarizer_agent, prompt)
-    # Clean response
-    raw_response = result.final_output.strip()
-    if raw_response.startswith('```json'):
-        raw_response = raw_response[7:]
-    if raw_response.startswith('```'):
-        raw_response = raw_response[3:]
-    if raw_response.endswith('```'):
-        raw_response = raw_response[:-3]
-    raw_response = raw_response.strip()
 
+
+def _parse_summary(raw_response, message, summary):
     try:
-        response_json = json.loads(raw_response)
+        return json.loads(clean_response(raw_response))
     except json.JSONDecodeError:
-        response_json = {
+        JSON_FALLBACKS.inc(conversation_summarizer.name)
+        return {
             "updated_summary": f"User said: {message}. Previous summary: {summary}",
             "appointment_active": False
         }
 
-    # Update or create the Summary record
-    Summary.objects.update_or_create(
-        session_id=session_id,
-        defaults={
-            'summary_text': response_json['updated_summary'],
-            'wants_appointment': response_json['appointment_active'],
-        }
-    )
-
-    return response_json
-
 
+@timed
+def summarizing_agent(latency, message, summary, session_id):
+    """
+    LLM agent which returns a structured summary of the conversation so far and updates/creates the Summary model.
 
+    Args:
+        latency: Response time requirement
+        message: Latest user message
+        summary: Previous summary
+        session_id: Unique session identifier
 
-def appointment_agent(latency, message, summary, messages, departments):
-    """
-    LLM agent which collects appointment details step by step:
-    - first_name
-    - last_name
-    - email
-    - chosen_department_id
-    
     Returns:
-        dict: JSON with collected fields and the agent’s next question
+        dict: JSON with conversation summary and extracted key info
     """
+    result = run_agent(conversation_summarizer, _summary_prompt(message, summary))
+    response_json = _parse_summary(result.final_output, message, summary)
+
+    # Upsert the Summary record: one INSERT ... ON CONFLICT (session_id) DO UPDATE
+    record = Summary(
+        session_id=session_id,
+        summary_text=response_json['updated_summary'],
+        wants_appointment=response_json['appointment_active'],
+    )
+    Summary.objects.bulk_create(
+        [record],
+        update_conflicts=True,
+        unique_fields=['session_id'],
+        update_fields=['summary_text', 'wants_appointment'],
+    )
+    session_states.record_summary(session_id, record)
+
+    return response_json
 
-    agent = Agent(name="Appointment Agent", model=model)
 
-    prompt = f"""
+def _appointment_prompt(message, summary, messages, departments):
+    return f"""
         You are an assistant that schedules appointments.
 
         Conversation summary so far:
@@ -387,22 +739,12 @@ def appointment_agent(latency, message, summary, messages, departments):
         - all_fields_collected: boolean (true only when all fields are filled)
     """
 
-    result = Runner.run_sync(agent, prompt)
-
-    # Clean response
-    raw_response = result.final_output.strip()
-    if raw_response.startswith('```json'):
-        raw_response = raw_response[7:]
-    if raw_response.startswith('```'):
-        raw_response = raw_response[3:]
-    if raw_response.endswith('```'):
-        raw_response = raw_response[:-3]
-    raw_response = raw_response.strip()
 
+def _parse_appointment(raw_response):
     try:
-        response_json = json.loads(raw_response)
-        return response_json
+        return json.loads(clean_response(raw_response))
     except json.JSONDecodeError:
+        JSON_FALLBACKS.inc(appointment_scheduler.name)
         return {
             "answer": "Sorry, I couldn’t process your details. Could you repeat?",
             "first_name": None,
@@ -415,10 +757,34 @@ def appointment_agent(latency, message, summary, messages, departments):
         }
 
 
+@timed
+def appointment_agent(latency, message, summary, messages, departments, timeout=None):
+    """
+    LLM agent which collects appointment details step by step:
+    - first_name
+    - last_name
+    - email
+    - chosen_department_id
+    
+    Returns:
+        dict: JSON with collected fields and the agent’s next question
+    """
+    result = run_agent(appointment_scheduler, _appointment_prompt(message, summary, messages, departments), timeout)
+    return _parse_appointment(result.final_output)
+
+
+@timed
+async def aappointment_agent(latency, message, summary, messages, departments, timeout=None):
+    """Async variant of appointment_agent."""
+    result = await arun_agent(appointment_scheduler, _appointment_prompt(message, summary, messages, departments), timeout)
+    return _parse_appointment(result.final_output)
+
+
 from datetime import datetime
 from django.utils.timezone import make_aware
 from .models import Appointment
 
+@timed
 def create_appointment(session_id, first_name, last_name, email, chosen_department_id, date_str, time_str, phone=None):
     """
     Creates an Appointment record from collected details.
@@ -456,13 +822,26 @@ def create_appointment(session_id, first_name, last_name, email, chosen_departme
         phone=phone
     )
 
+    # Booking is done, so the next turn is a normal conversation again
+    WantAppointment.objects.update_or_create(session_id=session_id, defaults={"wants_appointment": False})
+    session_states.record_wants_appointment(session_id, False)
+
     return appointment
 
 
 
-from django.utils import timezone
-from models import Chat
+from django.db import transaction
+from .models import Chat
+
+def chat_rows(session_id, user_message, agent_response, topic=None, sender_user="user", sender_agent="agent"):
+    """Unsaved Chat instances for one turn, user message first."""
+    return [
+        Chat(message=user_message, sender=sender_user, topic=topic, session_id=session_id),
+        Chat(message=agent_response, sender=sender_agent, topic=topic, session_id=session_id),
+    ]
+
 
+@timed
 def save_chat_messages(session_id, user_message, agent_response, topic=None, sender_user="user", sender_agent="agent"):
     """
     Save both user and agent messages to the Chat model.
@@ -475,23 +854,32 @@ def save_chat_messages(session_id, user_message, agent_response, topic=None, sen
         sender_user (str, optional): Sender label for the user message
         sender_agent (str, optional): Sender label for the agent message
     """
-    # Save user message
-    Chat.objects.create(
-        message=user_message,
-        sender=sender_user,
-        topic=topic,
-        session_id=session_id,
-    )
+    commit_turn(session_id, user_message, agent_response, topic=topic, sender_user=sender_user, sender_agent=sender_agent)
 
-    # Save agent response
-    Chat.objects.create(
-        message=agent_response,
-        sender=sender_agent,
-        topic=topic,
-        session_id=session_id,
-    )
+
+@timed
+def commit_turn(session_id, user_message, agent_response, appointment=None, topic=None, sender_user="user",
+                sender_agent="agent"):
+    """
+    Write everything a chat turn changes in one transaction: both Chat rows
+    (one bulk INSERT) and, when the turn completed a booking, the appointment.
+
+    Args:
+        appointment (dict, optional): Keyword arguments for create_appointment
+
+    Returns:
+        list: The saved Chat rows, user message first
+    """
+    chats = chat_rows(session_id, user_message, agent_response, topic, sender_user, sender_agent)
+    with transaction.atomic():
+        Chat.objects.bulk_create(chats)
+        if appointment:
+            create_appointment(session_id=session_id, **appointment)
+    session_states.record_messages(session_id, chats)
+    return chats
 
 
+@timed
 def get_last_five_messages(session_id):
     """
     Retrieve the last 5 messages for a given session_id, ordered by creation time.
@@ -0,0 +1,105 @@
+"""
+Logging pieces wired up by LOGGING in frontline_worker/settings.py.
+
+Records are written as one JSON object per line (JsonFormatter), with
+anything passed through ``extra=`` as additional keys. BackgroundHandler
+only puts records on a queue; a listener thread formats and writes them,
+so a slow stdout never holds up a request. SampleFilter keeps a fraction
+of DEBUG records, for the per-turn events that would otherwise flood the
+output when debug logging is turned on in production.
+
+Loggers are named after their module (``logging.getLogger(__name__)``)
+and take %-style arguments, so nothing is formatted for records below the
+configured level.
+"""
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Attributes every LogRecord has; anything else on a record came from extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        if record.stack_info:
+            entry["stack_info"] = record.stack_info
+        return json.dumps(entry, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """
+    Keeps a ``rate`` fraction of the records at or below ``level``; records
+    above it always pass.
+    """
+
+    def __init__(self, rate=1.0, level=logging.DEBUG):
+        super().__init__()
+        self.rate = float(rate)
+        self.level = logging._checkLevel(level)
+
+    def filter(self, record):
+        return record.levelno > self.level or self.rate >= 1 or random.random() < self.rate
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Queues records for a listener thread that writes them to ``stream``
+    (stdout by default). When ``max_queue`` records are already waiting,
+    new ones are dropped and counted in ``dropped`` rather than blocking
+    the caller.
+    """
+
+    def __init__(self, stream=None, max_queue=10000):
+        super().__init__(queue.Queue(max_queue))
+        self.target = logging.StreamHandler(stream or sys.stdout)
+        self.dropped = 0
+        self.listener = QueueListener(self.queue, self.target)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        # Resolve the message and traceback now, while the arguments are
+        # still what they were at the call; the JSON is built by the listener
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+            self.target.close()
+        super().close()
@@ -0,0 +1,99 @@
+"""Shared pieces of the benchmark commands: a throwaway database, a seeded facility fixture and latency summaries."""
+import contextlib
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from frontline.departments import DEPARTMENTS
+from frontline.models import FacilityLookup, HealthFacility
+from frontline.opening_hours import compile_opening_hours
+
+# (name, latitude, longitude)
+CITIES = (
+    ("Karachi", 24.86, 67.01),
+    ("Lahore", 31.52, 74.36),
+    ("Islamabad", 33.69, 73.05),
+    ("Peshawar", 34.01, 71.58),
+    ("Quetta", 30.18, 66.99),
+)
+
+HOURS = ("24/7", "Mo-Sa 09:00-21:00", "Mo-Su 08:00-17:00", "Sa-Th 10:00-17:00; Fr 09:00-18:00",
+         "Mo-Fr 17:00-21:00", None)
+
+
+@contextlib.contextmanager
+def benchmark_database():
+    """Run against a freshly migrated test database (test_<NAME>), destroyed afterwards."""
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield connection.settings_dict["NAME"]
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def seed_facilities(count, seed=0, spread=0.15):
+    """
+    Insert ``count`` facilities scattered around CITIES, with their facility_lookup rows.
+
+    The same seed always produces the same facilities.
+    """
+    rng = np.random.default_rng(seed)
+    cities = rng.integers(len(CITIES), size=count)
+    offsets = rng.normal(0, spread, size=(count, 2))
+    departments = rng.integers(len(DEPARTMENTS), size=count)
+    hours = rng.integers(len(HOURS), size=count)
+
+    facilities = []
+    for number in range(count):
+        _, lat, lon = CITIES[cities[number]]
+        department = DEPARTMENTS[departments[number]]
+        opening_hours = HOURS[hours[number]]
+        facilities.append(HealthFacility(
+            x=lon + offsets[number, 1],
+            y=lat + offsets[number, 0],
+            department=department,
+            health_amenity_type=department.lower(),
+            name=f"{department} {number}",
+            opening_hours=opening_hours,
+            opening_hours_bitmap=compile_opening_hours(opening_hours),
+        ))
+    # bulk_create skips the signals that keep facility_lookup in sync
+    facilities = HealthFacility.objects.bulk_create(facilities, batch_size=1000)
+    FacilityLookup.objects.bulk_create(
+        [FacilityLookup.from_facility(facility) for facility in facilities],
+        batch_size=1000,
+    )
+    return facilities
+
+
+def summarize(samples_ms):
+    """Count, mean and tail percentiles of a list of millisecond timings."""
+    samples = np.asarray(samples_ms, dtype=np.float64)
+    if not len(samples):
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {
+        "count": len(samples),
+        "mean_ms": round(float(samples.mean()), 2),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "max_ms": round(float(samples.max()), 2),
+    }
+
+
+def run_metadata():
+    """Where and when a benchmark ran, so result files from different commits can be told apart."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=settings.BASE_DIR, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "git_commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "database": connection.vendor,
+    }
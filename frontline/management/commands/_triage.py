@@ -0,0 +1,37 @@
+"""Shared data loading for the triage model commands."""
+from concurrent.futures import ThreadPoolExecutor
+
+from frontline.departments import DEPARTMENTS
+from frontline.helpers import classify_emergency_agent
+from frontline.models import Chat
+from frontline.triage import EMERGENCY_LEVELS, is_holdout
+
+
+def logged_messages(limit, holdout):
+    """Distinct logged user messages, newest first, from the training or the holdout split."""
+    messages = []
+    seen = set()
+    rows = Chat.objects.filter(sender="user").order_by("-created_at").values_list("message", flat=True)
+    for message in rows.iterator():
+        if message in seen or is_holdout(message) != holdout:
+            continue
+        seen.add(message)
+        messages.append(message)
+        if len(messages) >= limit:
+            break
+    return messages
+
+
+def llm_labels(messages, workers):
+    """
+    Label messages with classify_emergency_agent.
+
+    Returns:
+        list: (message, label) pairs; messages the LLM could not classify are dropped
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        labels = list(pool.map(lambda message: classify_emergency_agent(None, message), messages))
+    return [
+        (message, label) for message, label in zip(messages, labels)
+        if label.get("department") in DEPARTMENTS and label.get("emergency_level") in EMERGENCY_LEVELS
+    ]
@@ -0,0 +1,183 @@
+import json
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from frontline.fake_openrouter import DEFAULT_REPLIES, FakeOpenRouter, load_replies
+
+from ._bench import CITIES, benchmark_database, run_metadata, seed_facilities, summarize
+
+# (name, starts in the appointment flow, user messages)
+SCRIPTS = (
+    ("pharmacy", False, ("where is the nearest pharmacy", "is it open right now", "thank you")),
+    ("chest_pain", False, ("my father has chest pain and is sweating a lot", "which hospital is closest",
+                           "we are leaving now")),
+    ("toothache", False, ("I have had a bad toothache since yesterday", "can you find me a dentist", "ok thanks")),
+    ("theft", False, ("someone stole my phone near the market", "where is the nearest police station", "thanks")),
+    ("appointment", True, ("I would like to book an appointment with a doctor", "Ayesha", "Khan",
+                           "ayesha.khan@example.com")),
+)
+
+# Stages reported by chat_flow in its Server-Timing header (frontline.metrics.stage)
+STAGES = ("session_state", "classify", "facilities", "triage", "reply", "appointment", "persist")
+
+
+def parse_server_timing(header):
+    """{name: milliseconds} from a Server-Timing header value."""
+    timings = {}
+    for entry in filter(None, (part.strip() for part in header.split(","))):
+        name, *params = (param.strip() for param in entry.split(";"))
+        for param in params:
+            key, _, value = param.partition("=")
+            if key == "dur":
+                timings[name] = float(value)
+    return timings
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark chat_flow offline: scripted multi-turn sessions against a seeded test database, with "
+        "every LLM call answered by a local fake OpenRouter server. Reports p50/p95/p99 per stage and "
+        "end to end, and writes them to JSON for comparison between commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sessions", type=int, default=50, help="Scripted sessions to run (cycling through the scripts)")
+        parser.add_argument("--warmup", type=int, default=2, help="Sessions run first and left out of the results")
+        parser.add_argument("--facilities", type=int, default=5000, help="Facilities in the seeded fixture")
+        parser.add_argument("--seed", type=int, default=0, help="Seed for the fixture, locations and LLM jitter")
+        parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds the fake LLM takes per call")
+        parser.add_argument("--llm-jitter", type=float, default=0.1, help="Uniform +/- variation of --llm-latency")
+        parser.add_argument("--replies", help="JSON file overriding the fake LLM's canned replies")
+        parser.add_argument("--latency", type=float, default=None, help="latency budget sent with every turn")
+        parser.add_argument("--triage-mode", choices=("two_call", "single_call"),
+                            help="TRIAGE_MODE to run with (default: the configured one)")
+        parser.add_argument("--output", default="bench_chat_flow.json", help="Where the results are written")
+        parser.add_argument("--compare", help="Earlier results file to print the differences against")
+
+    def handle(self, *args, **options):
+        # frontline.helpers refuses to import without a key; the fake server ignores it
+        os.environ.setdefault("OPENROUTER_API_KEY", "offline-benchmark")
+        replies = load_replies(options["replies"]) if options["replies"] else DEFAULT_REPLIES
+        baseline = None
+        if options["compare"]:
+            try:
+                with open(options["compare"]) as file:
+                    baseline = json.load(file)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Cannot read {options['compare']}: {e}")
+
+        fake = FakeOpenRouter(options["llm_latency"], options["llm_jitter"], replies=replies, seed=options["seed"])
+        triage_mode = options["triage_mode"] or settings.TRIAGE_MODE
+        with fake, benchmark_database(), override_settings(TRIAGE_MODE=triage_mode):
+            from frontline import helpers
+
+            helpers.external_client.base_url = fake.base_url
+            results = self._run(options, fake)
+
+        with open(options["output"], "w") as file:
+            json.dump(results, file, indent=2)
+        self._report(results, baseline)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def _run(self, options, fake):
+        from frontline.classification_cache import classification_cache
+        from frontline.facility_index import rebuild_facility_index
+        from frontline.models import WantAppointment
+        from frontline.nearest_cache import nearest_cache
+        from frontline.session_state import session_states
+        from frontline.summary_queue import summary_queue
+        from frontline.turn_buffer import turn_buffer
+
+        seed_facilities(options["facilities"], options["seed"])
+        rebuild_facility_index()
+        for cache in (classification_cache, nearest_cache, session_states):
+            cache.clear()
+
+        rng = np.random.default_rng(options["seed"])
+        timings = {stage: [] for stage in STAGES}
+        timings["end_to_end"] = []
+        skipped = {}
+        errors = 0
+
+        setup_test_environment()
+        try:
+            client = Client(raise_request_exception=False)
+            total = options["warmup"] + options["sessions"]
+            for number in range(total):
+                recorded = number >= options["warmup"]
+                name, wants_appointment, messages = SCRIPTS[number % len(SCRIPTS)]
+                session_id = f"bench-{number}-{name}"
+                if wants_appointment:
+                    WantAppointment.objects.create(session_id=session_id, wants_appointment=True)
+                _, lat, lon = CITIES[number % len(CITIES)]
+                lat, lon = lat + rng.normal(0, 0.05), lon + rng.normal(0, 0.05)
+
+                for message in messages:
+                    payload = {"message": message, "session_id": session_id, "latitude": lat, "longitude": lon}
+                    if options["latency"] is not None:
+                        payload["latency"] = options["latency"]
+                    started = time.perf_counter()
+                    response = client.post("/api/v1/chat/", payload, content_type="application/json")
+                    elapsed = (time.perf_counter() - started) * 1000
+                    if not recorded:
+                        continue
+                    if response.status_code != 200:
+                        errors += 1
+                        continue
+                    timings["end_to_end"].append(elapsed)
+                    for stage, value in parse_server_timing(response.get("Server-Timing", "")).items():
+                        if stage in timings and stage != "end_to_end":
+                            timings[stage].append(value)
+                    for stage in response.json().get("skipped_stages", []):
+                        skipped[stage] = skipped.get(stage, 0) + 1
+        finally:
+            teardown_test_environment()
+            # Background writers must finish before the test database is dropped
+            summary_queue.drain(60)
+            turn_buffer.drain(60)
+
+        return {
+            **run_metadata(),
+            "options": {key: options[key] for key in (
+                "sessions", "warmup", "facilities", "seed", "llm_latency", "llm_jitter", "latency",
+            )},
+            "triage_mode": settings.TRIAGE_MODE,
+            "turns": len(timings["end_to_end"]),
+            "errors": errors,
+            "llm_calls": dict(fake.calls),
+            "skipped_stages": skipped,
+            "stages": {stage: summarize(samples) for stage, samples in timings.items() if stage != "end_to_end"},
+            "end_to_end": summarize(timings["end_to_end"]),
+        }
+
+    def _report(self, results, baseline=None):
+        self.stdout.write(
+            f"{results['turns']} turns on {results['database']} ({results['errors']} errors, "
+            f"{results.get('triage_mode', 'two_call')}), "
+            f"LLM calls: {results['llm_calls']}"
+        )
+        header = f"{'stage':<15}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        if baseline:
+            header += f"{'p50 diff':>11}{'p95 diff':>11}"
+        self.stdout.write(header)
+        rows = dict(results["stages"], end_to_end=results["end_to_end"])
+        for stage, stats in rows.items():
+            if not stats["count"]:
+                continue
+            line = f"{stage:<15}{stats['count']:>7}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+            if baseline:
+                before = baseline["end_to_end"] if stage == "end_to_end" else baseline.get("stages", {}).get(stage, {})
+                line += "".join(self._diff(stats, before, key) for key in ("p50_ms", "p95_ms"))
+            self.stdout.write(line)
+
+    @staticmethod
+    def _diff(stats, before, key):
+        if not before.get(key):
+            return f"{'n/a':>11}"
+        return f"{(stats[key] - before[key]) / before[key]:>+11.0%}"
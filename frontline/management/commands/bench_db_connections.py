@@ -0,0 +1,150 @@
+import importlib.util
+import json
+import threading
+import time
+
+from django.core import signals
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from frontline.session_state import fetch_session_state
+from frontline_worker.database import POOL_MODES, django_database
+
+from ._bench import run_metadata, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the per-request cost of getting and releasing a database connection under each DB_POOL "
+        "mode, with 1, 16 and 64 request threads. Every simulated request goes through Django's "
+        "request_started/request_finished handling and runs the session state query, read-only, against "
+        "the configured database; run it against PostgreSQL for meaningful numbers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=50, help="Timed requests per thread")
+        parser.add_argument("--warmup", type=int, default=1, help="Untimed requests per thread first")
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64], help="Thread counts to run")
+        parser.add_argument("--modes", nargs="+", choices=POOL_MODES, help="DB_POOL modes (default: all available)")
+        parser.add_argument("--output", default="bench_db_connections.json", help="Where the results are written")
+
+    def handle(self, *args, **options):
+        available = self._available_modes()
+        modes = options["modes"] or available
+        missing = sorted(set(modes) - set(available))
+        if missing:
+            raise CommandError(f"Not available with the {connection.vendor} backend here: {', '.join(missing)}")
+
+        settings_dict = connection.settings_dict
+        original = {key: settings_dict[key] for key in ("CONN_MAX_AGE", "CONN_HEALTH_CHECKS", "OPTIONS")}
+        results = {**run_metadata(), "options": {key: options[key] for key in ("requests", "warmup", "concurrency")},
+                   "runs": []}
+        try:
+            for mode in modes:
+                self._configure(settings_dict, mode)
+                for concurrency in options["concurrency"]:
+                    run = self._run(concurrency, options["requests"], options["warmup"])
+                    results["runs"].append({"mode": mode, "concurrency": concurrency, **run})
+                if settings_dict["OPTIONS"].get("pool"):
+                    connection.close_pool()
+        finally:
+            connections.close_all()
+            settings_dict.update(original)
+
+        with open(options["output"], "w") as file:
+            json.dump(results, file, indent=2)
+        self._report(results)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    @staticmethod
+    def _available_modes():
+        if connection.vendor != "postgresql":
+            return ["persistent", "none"]
+        from django.db.backends.postgresql.psycopg_any import is_psycopg3
+
+        pool = is_psycopg3 and importlib.util.find_spec("psycopg_pool") is not None
+        return [mode for mode in POOL_MODES if mode != "pool" or pool]
+
+    @staticmethod
+    def _configure(settings_dict, mode):
+        # Threads started afterwards build their connections from the updated settings
+        connections.close_all()
+        configured = django_database(mode)
+        options = {key: value for key, value in settings_dict["OPTIONS"].items() if key != "pool"}
+        if "pool" in configured["OPTIONS"]:
+            options["pool"] = configured["OPTIONS"]["pool"]
+        settings_dict.update(
+            CONN_MAX_AGE=configured["CONN_MAX_AGE"],
+            CONN_HEALTH_CHECKS=configured["CONN_HEALTH_CHECKS"],
+            OPTIONS=options,
+        )
+
+    def _run(self, concurrency, requests, warmup):
+        overhead, totals, errors = [], [], []
+        lock = threading.Lock()
+        barrier = threading.Barrier(concurrency)
+
+        def worker():
+            samples = []
+            try:
+                barrier.wait()
+                for number in range(warmup + requests):
+                    sample = self._request()
+                    if number >= warmup:
+                        samples.append(sample)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+            finally:
+                connections.close_all()
+                with lock:
+                    overhead.extend(acquire + release for acquire, release, _ in samples)
+                    totals.extend(total for _, _, total in samples)
+
+        threads = [threading.Thread(target=worker, name=f"bench-db-{number}") for number in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        return {
+            "requests_per_second": round(len(totals) / elapsed, 1) if elapsed else None,
+            "errors": len(errors),
+            "first_error": errors[0] if errors else None,
+            "connection": summarize(overhead),
+            "request": summarize(totals),
+        }
+
+    @staticmethod
+    def _request():
+        """(acquire ms, release ms, total ms) of one request that runs the session state query."""
+        started = time.perf_counter()
+        signals.request_started.send(sender=None)
+        # What the first cursor of a request does: health check, then connect or check out
+        connection.close_if_health_check_failed()
+        connection.ensure_connection()
+        acquired = time.perf_counter()
+        fetch_session_state("bench-db-connections")
+        queried = time.perf_counter()
+        signals.request_finished.send(sender=None)
+        finished = time.perf_counter()
+        return (acquired - started) * 1000, (finished - queried) * 1000, (finished - started) * 1000
+
+    def _report(self, results):
+        self.stdout.write(f"{results['database']}, {results['options']['requests']} requests per thread")
+        self.stdout.write(
+            f"{'mode':<12}{'threads':>8}{'req/s':>10}{'conn p50':>10}{'conn p95':>10}{'req p50':>10}{'req p95':>10}"
+            f"{'errors':>8}"
+        )
+        for run in results["runs"]:
+            conn, request = run["connection"], run["request"]
+            if not request["count"]:
+                self.stdout.write(f"{run['mode']:<12}{run['concurrency']:>8}  no samples: {run['first_error']}")
+                continue
+            self.stdout.write(
+                f"{run['mode']:<12}{run['concurrency']:>8}{run['requests_per_second']:>10.1f}"
+                f"{conn['p50_ms']:>10.2f}{conn['p95_ms']:>10.2f}{request['p50_ms']:>10.2f}{request['p95_ms']:>10.2f}"
+                f"{run['errors']:>8}"
+            )
+        self.stdout.write("conn = getting and releasing the connection; req = the whole request, query included (ms)")
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from agents import Agent, AsyncOpenAI, OpenAIChatCompletionsModel, Runner
+
+from frontline import helpers
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare per-call overhead of a cold LLM call (new client, agent and event loop per call, "
+        "as Runner.run_sync did) with a warm call on the shared LLM loop. Calls go to "
+        "OPENROUTER_BASE_URL, so point it at a local stub to measure overhead alone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--calls", type=int, default=10, help="Calls per mode")
+        parser.add_argument("--prompt", default='Reply with the JSON object {"ok": true} and nothing else.')
+
+    def handle(self, *args, **options):
+        calls, prompt = options["calls"], options["prompt"]
+
+        async def cold_run():
+            client = AsyncOpenAI(api_key=helpers.OPENROUTER_API_KEY, base_url=helpers.OPENROUTER_BASE_URL)
+            model = OpenAIChatCompletionsModel(model=helpers.model.model, openai_client=client)
+            try:
+                await Runner.run(Agent(name="Benchmark", model=model), prompt)
+            finally:
+                await client.close()
+
+        def cold_call():
+            asyncio.run(cold_run())
+
+        def warm_call():
+            helpers.run_agent(helpers.emergency_classifier, prompt)
+
+        # One untimed warm call opens the pooled connection
+        warm_call()
+        results = {"cold": self._time(cold_call, calls), "warm": self._time(warm_call, calls)}
+
+        self.stdout.write(f"{'mode':<6}{'calls':>7}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for mode, samples in results.items():
+            self.stdout.write(
+                f"{mode:<6}{len(samples):>7}{samples.mean():>10.1f}"
+                f"{np.percentile(samples, 50):>10.1f}{np.percentile(samples, 95):>10.1f}"
+            )
+        saved = results["cold"].mean() - results["warm"].mean()
+        self.stdout.write(self.style.SUCCESS(f"Warm calls save {saved:.1f} ms per call on average"))
+
+    @staticmethod
+    def _time(call, calls):
+        samples = []
+        for _ in range(calls):
+            start = time.perf_counter()
+            call()
+            samples.append((time.perf_counter() - start) * 1000)
+        return np.array(samples)
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from frontline.triage import classify_locally
+
+from ._triage import llm_labels, logged_messages
+
+
+class Command(BaseCommand):
+    help = "Report how often the local triage tiers answer, and how often they agree with the LLM classifier."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=1000, help="Maximum number of holdout messages")
+        parser.add_argument("--threshold", type=float, default=settings.LOCAL_TRIAGE_THRESHOLD)
+        parser.add_argument("--workers", type=int, default=8, help="Concurrent LLM labelling calls")
+
+    def handle(self, *args, **options):
+        labelled = llm_labels(logged_messages(options["limit"], holdout=True), options["workers"])
+        if not labelled:
+            raise CommandError("No holdout messages to evaluate on.")
+
+        counts = {}
+        for message, label in labelled:
+            result = classify_locally(message, options["threshold"])
+            source = result["source"] if result else "llm"
+            stats = counts.setdefault(source, {"total": 0, "department": 0, "both": 0})
+            stats["total"] += 1
+            if result is None:
+                continue
+            if result["department"] == label["department"]:
+                stats["department"] += 1
+                if result["emergency_level"] == int(label["emergency_level"]):
+                    stats["both"] += 1
+
+        total = len(labelled)
+        answered = sum(s["total"] for source, s in counts.items() if source != "llm")
+        self.stdout.write(f"Messages: {total}, threshold: {options['threshold']}")
+        self.stdout.write(f"Answered locally: {answered} ({answered / total:.1%}), sent to LLM: {total - answered}")
+        for source in ("rules", "model"):
+            stats = counts.get(source)
+            if not stats:
+                continue
+            self.stdout.write(
+                f"  {source:<6} {stats['total']:>6} answered, department agreement "
+                f"{stats['department'] / stats['total']:.1%}, department+level agreement "
+                f"{stats['both'] / stats['total']:.1%}"
+            )
@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from frontline.triage import HashedNgramModel
+
+from ._triage import llm_labels, logged_messages
+
+
+class Command(BaseCommand):
+    help = (
+        "Train the local triage model on logged user messages labelled by the LLM classifier. "
+        "The evaluation split (see evaluate_triage_model) is left out."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=5000, help="Maximum number of messages to train on")
+        parser.add_argument("--epochs", type=int, default=20)
+        parser.add_argument("--features", type=int, default=1 << 15, help="Number of hashed feature buckets")
+        parser.add_argument("--workers", type=int, default=8, help="Concurrent LLM labelling calls")
+        parser.add_argument("--output", default=settings.LOCAL_TRIAGE_MODEL_PATH)
+
+    def handle(self, *args, **options):
+        messages = logged_messages(options["limit"], holdout=False)
+        self.stdout.write(f"Labelling {len(messages)} messages with the LLM classifier...")
+        labelled = llm_labels(messages, options["workers"])
+        if not labelled:
+            raise CommandError("No labelled messages to train on.")
+
+        model = HashedNgramModel(options["features"])
+        model.fit([m for m, _ in labelled], [l for _, l in labelled], epochs=options["epochs"])
+        model.save(options["output"])
+        self.stdout.write(self.style.SUCCESS(f"Trained on {len(labelled)} messages, saved to {options['output']}"))
@@ -0,0 +1,241 @@
+"""
+In-process timers, counters and histograms, rendered as Prometheus text.
+
+``stage(name)`` times a step of a chat turn: it feeds the
+frontline_stage_seconds histogram and the request's Server-Timing header
+(ServerTimingMiddleware). ``timed`` does the same for a helper function
+into frontline_helper_seconds, for sync and async functions alike.
+``record_llm_call`` counts LLM calls, their latency and token usage.
+
+Values live in the worker process; with several gunicorn workers each
+one reports its own numbers, so scrape them per process or sum them.
+"""
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f"{self.name}{_labels(self.label_names, labels)} {value}" for labels, value in values)
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[position] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def count(self, *labels):
+        entry = self._values.get(labels)
+        return entry[-1] if entry else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((labels, list(entry)) for labels, entry in self._values.items())
+        names = self.label_names + ("le",)
+        for labels, entry in values:
+            for bound, count in zip(self.buckets, entry):
+                lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {count}")
+            lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {entry[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {entry[-2]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {entry[-1]}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("frontline_stage_seconds", "Time spent in each stage of a chat turn.", ["stage"])
+HELPER_SECONDS = Histogram("frontline_helper_seconds", "Time spent in each frontline helper.", ["helper"])
+REQUEST_SECONDS = Histogram("frontline_request_seconds", "Time to produce a response, per route.", ["route"])
+LLM_SECONDS = Histogram("frontline_llm_seconds", "LLM call latency.", ["agent"])
+LLM_CALLS = Counter("frontline_llm_calls_total", "LLM calls by outcome (ok, timeout, error).", ["agent", "outcome"])
+LLM_TOKENS = Counter("frontline_llm_tokens_total", "LLM tokens used.", ["agent", "kind"])
+JSON_FALLBACKS = Counter(
+    "frontline_json_fallbacks_total", "LLM replies that were not valid JSON and got a default.", ["agent"]
+)
+STAGES_SKIPPED = Counter(
+    "frontline_stages_skipped_total", "Stages answered with a fallback because the latency budget ran out.", ["stage"]
+)
+
+_METRICS = [STAGE_SECONDS, HELPER_SECONDS, REQUEST_SECONDS, LLM_SECONDS, LLM_CALLS, LLM_TOKENS, JSON_FALLBACKS,
+            STAGES_SKIPPED]
+
+# name -> object with stats() returning hits, misses and size (frontline.cache.LRUCache and friends)
+_caches = {}
+
+# Stage timings of the current request, for its Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def register_cache(name, cache):
+    """Export the cache's stats() as frontline_cache_* metrics."""
+    _caches[name] = cache
+
+
+@contextmanager
+def stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def timed(function):
+    """Decorator recording every call of a helper in frontline_helper_seconds."""
+    name = function.__name__
+
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                HELPER_SECONDS.observe(time.perf_counter() - started, name)
+    else:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                HELPER_SECONDS.observe(time.perf_counter() - started, name)
+    return wrapper
+
+
+def record_llm_call(agent, elapsed, outcome, result=None):
+    """Count one LLM call; token usage is read from the run result when there is one."""
+    LLM_CALLS.inc(agent, outcome)
+    LLM_SECONDS.observe(elapsed, agent)
+    usage = getattr(getattr(result, "context_wrapper", None), "usage", None)
+    if usage is not None:
+        LLM_TOKENS.inc(agent, "input", amount=usage.input_tokens or 0)
+        LLM_TOKENS.inc(agent, "output", amount=usage.output_tokens or 0)
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    cache_stats = {name: cache.stats() for name, cache in _caches.items()}
+    for field, kind, help in (("hits", "counter", "Cache hits."), ("misses", "counter", "Cache misses."),
+                              ("size", "gauge", "Entries in the cache.")):
+        name = f"frontline_cache_{field}" + ("_total" if kind == "counter" else "")
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(f'{name}{{cache="{cache}"}} {stats.get(field, 0)}' for cache, stats in sorted(cache_stats.items()))
+    return "\n".join(lines) + "\n"
+
+
+def server_timing(timings, total=None):
+    """Server-Timing header value for (stage, seconds) pairs; repeated stages are added up."""
+    durations = {}
+    for name, elapsed in timings:
+        durations[name] = durations.get(name, 0.0) + elapsed
+    if total is not None:
+        durations["total"] = total
+    return ", ".join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in durations.items())
+
+
+class ServerTimingMiddleware:
+    """
+    Adds a Server-Timing header with the request's stage timings and
+    records its duration per route. Streaming responses only carry what
+    was timed before the first byte.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+        timings, token, started = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self._finish(request, response, timings, started)
+
+    async def _acall(self, request):
+        timings, token, started = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_timings.reset(token)
+        return self._finish(request, response, timings, started)
+
+    @staticmethod
+    def _start():
+        timings = []
+        return timings, _request_timings.set(timings), time.perf_counter()
+
+    @staticmethod
+    def _finish(request, response, timings, started):
+        elapsed = time.perf_counter() - started
+        match = getattr(request, "resolver_match", None)
+        REQUEST_SECONDS.observe(elapsed, match.route if match else "unmatched")
+        response["Server-Timing"] = server_timing(timings, elapsed)
+        return response
@@ -0,0 +1,112 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+
+def create_health_facilities(apps, schema_editor):
+    # Deployments that predate these migrations already have the table,
+    # created by db_utils/create_db.py; keep it and its rows
+    model = apps.get_model('frontline', 'HealthFacility')
+    if model._meta.db_table not in schema_editor.connection.introspection.table_names():
+        schema_editor.create_model(model)
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Appointment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(db_index=True, max_length=255)),
+                ('department', models.CharField(max_length=255, null=True)),
+                ('time', models.DateTimeField()),
+                ('first_name', models.CharField(max_length=100, null=True)),
+                ('last_name', models.CharField(max_length=100, null=True)),
+                ('email', models.EmailField(max_length=254, null=True)),
+                ('phone', models.CharField(max_length=20, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Chat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message', models.TextField()),
+                ('sender', models.CharField(max_length=255, null=True)),
+                ('topic', models.CharField(blank=True, max_length=255, null=True)),
+                ('session_id', models.CharField(db_index=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='HealthFacility',
+                    fields=[
+                        ('id', models.AutoField(primary_key=True, serialize=False)),
+                        ('x', models.FloatField(blank=True, null=True)),
+                        ('y', models.FloatField(blank=True, null=True)),
+                        ('osm_id', models.BigIntegerField(blank=True, null=True)),
+                        ('osm_type', models.CharField(blank=True, max_length=50, null=True)),
+                        ('completeness', models.IntegerField(blank=True, null=True)),
+                        ('is_in_health_zone', models.CharField(blank=True, max_length=50, null=True)),
+                        ('amenity', models.CharField(blank=True, max_length=100, null=True)),
+                        ('speciality', models.CharField(blank=True, max_length=255, null=True)),
+                        ('addr_full', models.TextField(blank=True, null=True)),
+                        ('operator', models.CharField(blank=True, max_length=255, null=True)),
+                        ('water_source', models.CharField(blank=True, max_length=255, null=True)),
+                        ('changeset_id', models.BigIntegerField(blank=True, null=True)),
+                        ('insurance', models.CharField(blank=True, max_length=255, null=True)),
+                        ('staff_doctors', models.CharField(blank=True, max_length=50, null=True)),
+                        ('contact_number', models.CharField(blank=True, max_length=100, null=True)),
+                        ('uuid', models.CharField(blank=True, max_length=100, null=True)),
+                        ('electricity', models.CharField(blank=True, max_length=50, null=True)),
+                        ('opening_hours', models.CharField(blank=True, max_length=255, null=True)),
+                        ('operational_status', models.CharField(blank=True, max_length=50, null=True)),
+                        ('source', models.CharField(blank=True, max_length=255, null=True)),
+                        ('is_in_health_area', models.CharField(blank=True, max_length=50, null=True)),
+                        ('health_amenity_type', models.CharField(blank=True, max_length=255, null=True)),
+                        ('changeset_version', models.IntegerField(blank=True, null=True)),
+                        ('emergency', models.CharField(blank=True, max_length=50, null=True)),
+                        ('changeset_timestamp', models.DateTimeField(blank=True, null=True)),
+                        ('name', models.CharField(blank=True, max_length=255, null=True)),
+                        ('staff_nurses', models.CharField(blank=True, max_length=50, null=True)),
+                        ('changeset_user', models.CharField(blank=True, max_length=255, null=True)),
+                        ('wheelchair', models.CharField(blank=True, max_length=50, null=True)),
+                        ('beds', models.CharField(blank=True, max_length=50, null=True)),
+                        ('url', models.TextField(blank=True, null=True)),
+                        ('dispensing', models.CharField(blank=True, max_length=50, null=True)),
+                        ('healthcare', models.CharField(blank=True, max_length=100, null=True)),
+                        ('operator_type', models.CharField(blank=True, max_length=100, null=True)),
+                    ],
+                    options={
+                        'db_table': 'health_facilities',
+                    },
+                ),
+            ],
+        ),
+        migrations.RunPython(create_health_facilities, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='Summary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('summary_text', models.TextField()),
+                ('session_id', models.CharField(db_index=True, max_length=255)),
+                ('wants_appointment', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WantAppointment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(db_index=True, max_length=255, unique=True)),
+                ('wants_appointment', models.BooleanField(default=False)),
+            ],
+        ),
+    ]
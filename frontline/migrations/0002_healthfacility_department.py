@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:25
+
+from django.db import migrations, models
+
+from frontline.departments import AMENITY_DEPARTMENTS, HEALTHCARE_DEPARTMENTS
+
+
+def fill_departments(apps, schema_editor):
+    HealthFacility = apps.get_model('frontline', 'HealthFacility')
+    for amenity, department in AMENITY_DEPARTMENTS.items():
+        HealthFacility.objects.filter(amenity__iexact=amenity).update(department=department)
+    for healthcare, department in HEALTHCARE_DEPARTMENTS.items():
+        HealthFacility.objects.filter(department__isnull=True, healthcare__iexact=healthcare).update(department=department)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('frontline', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='healthfacility',
+            name='department',
+            field=models.CharField(blank=True, db_index=True, max_length=50, null=True),
+        ),
+        migrations.RunPython(fill_departments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('frontline', '0002_healthfacility_department'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='healthfacility',
+            name='opening_hours_imputed',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('frontline', '0003_opening_hours_imputed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacilityChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('facility_id', models.IntegerField(null=True)),
+                ('operation', models.CharField(max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'facility_changes',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='healthfacility',
+            index=models.Index(fields=['osm_type', 'osm_id'], name='health_facilities_osm_idx'),
+        ),
+    ]
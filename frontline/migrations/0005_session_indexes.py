@@ -0,0 +1,46 @@
+# Generated by Django 5.2.6 on 2026-10-18 09:44
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def keep_latest_summary(apps, schema_editor):
+    # update_or_create could race into several rows per session; keep the newest one
+    Summary = apps.get_model('frontline', 'Summary')
+    duplicated = list(
+        Summary.objects.values('session_id').annotate(rows=Count('id')).filter(rows__gt=1).values_list('session_id', flat=True)
+    )
+    for session_id in duplicated:
+        latest = Summary.objects.filter(session_id=session_id).order_by('-created_at', '-id').values_list('id', flat=True).first()
+        Summary.objects.filter(session_id=session_id).exclude(id=latest).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('frontline', '0004_facility_changes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chat',
+            index=models.Index(fields=['session_id', '-created_at', '-id'], name='chat_session_recent_idx'),
+        ),
+        # The composite index leads with session_id, so the single-column one is redundant
+        migrations.AlterField(
+            model_name='chat',
+            name='session_id',
+            field=models.CharField(max_length=255, null=True),
+        ),
+        migrations.RunPython(keep_latest_summary, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='summary',
+            constraint=models.UniqueConstraint(fields=('session_id',), name='summary_session_unique'),
+        ),
+        # Replaced by the unique constraint's index
+        migrations.AlterField(
+            model_name='summary',
+            name='session_id',
+            field=models.CharField(max_length=255),
+        ),
+    ]
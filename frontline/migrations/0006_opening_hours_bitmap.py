@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+from frontline.opening_hours import compile_opening_hours
+
+
+def compile_existing(apps, schema_editor):
+    # A few dozen distinct strings cover the whole table, so update per value.
+    # Imputed hours keep a NULL bitmap (unknown), as in HealthFacility.save().
+    HealthFacility = apps.get_model('frontline', 'HealthFacility')
+    facilities = HealthFacility.objects.exclude(opening_hours=None).filter(opening_hours_imputed=False)
+    for value in list(facilities.values_list('opening_hours', flat=True).distinct()):
+        bitmap = compile_opening_hours(value)
+        if bitmap is not None:
+            facilities.filter(opening_hours=value).update(opening_hours_bitmap=bitmap)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('frontline', '0005_session_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='healthfacility',
+            name='opening_hours_bitmap',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.RunPython(compile_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+LOOKUP_COLUMNS = "id, x, y, department, name, health_amenity_type, opening_hours, opening_hours_bitmap"
+# Imputed opening hours are not copied (see create_db.LOOKUP_SELECT)
+LOOKUP_SELECT = (
+    "id, x, y, department, name, health_amenity_type, "
+    "CASE WHEN opening_hours_imputed THEN NULL ELSE opening_hours END, "
+    "CASE WHEN opening_hours_imputed THEN NULL ELSE opening_hours_bitmap END"
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('frontline', '0006_opening_hours_bitmap'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacilityLookup',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('x', models.FloatField()),
+                ('y', models.FloatField()),
+                ('department', models.CharField(blank=True, db_index=True, max_length=50, null=True)),
+                ('name', models.CharField(blank=True, max_length=255, null=True)),
+                ('health_amenity_type', models.CharField(blank=True, max_length=255, null=True)),
+                ('opening_hours', models.CharField(blank=True, max_length=255, null=True)),
+                ('opening_hours_bitmap', models.BinaryField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'facility_lookup',
+            },
+        ),
+        migrations.RunSQL(
+            f"INSERT INTO facility_lookup ({LOOKUP_COLUMNS}) SELECT {LOOKUP_SELECT} FROM health_facilities "
+            f"WHERE x IS NOT NULL AND y IS NOT NULL",
+            migrations.RunSQL.noop,
+        ),
+    ]
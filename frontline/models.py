@@ -1,4 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .opening_hours import compile_opening_hours
 
 # Create your models here.
 
@@ -22,6 +26,9 @@ class HealthFacility(models.Model):
     uuid = models.CharField(max_length=100, null=True, blank=True)
     electricity = models.CharField(max_length=50, null=True, blank=True)
     opening_hours = models.CharField(max_length=255, null=True, blank=True)
+    opening_hours_bitmap = models.BinaryField(null=True, blank=True)  # compiled opening_hours, see opening_hours.py
+    # opening_hours was missing from the dump and filled in by db_utils/ingest.py; never shown or ranked on
+    opening_hours_imputed = models.BooleanField(default=False)
     operational_status = models.CharField(max_length=50, null=True, blank=True)
     source = models.CharField(max_length=255, null=True, blank=True)
     is_in_health_area = models.CharField(max_length=50, null=True, blank=True)
@@ -38,30 +45,131 @@ class HealthFacility(models.Model):
     dispensing = models.CharField(max_length=50, null=True, blank=True)
     healthcare = models.CharField(max_length=100, null=True, blank=True)
     operator_type = models.CharField(max_length=100, null=True, blank=True)
+    department = models.CharField(max_length=50, null=True, blank=True, db_index=True)  # see departments.department_for
 
     class Meta:
         db_table = "health_facilities"  # Match your manual table
+        indexes = [
+            # OSM identity used by db_utils/sync.py to diff a new dump against the table
+            models.Index(fields=["osm_type", "osm_id"], name="health_facilities_osm_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.opening_hours_bitmap = None if self.opening_hours_imputed else compile_opening_hours(self.opening_hours)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name or f"Facility {self.id}"
+
+
+class FacilityLookup(models.Model):
+    """
+    Narrow copy of the HealthFacility columns the facility index reads, one
+    row per facility with coordinates. The db_utils loaders refresh it in the
+    same pass as health_facilities (create_db.refresh_lookup) and ORM writes
+    through the signals below, which also log the change in facility_changes
+    so every process's facility index picks it up on its next poll.
+    """
+    FIELDS = ("id", "x", "y", "department", "name", "health_amenity_type", "opening_hours", "opening_hours_bitmap")
+
+    id = models.IntegerField(primary_key=True)  # HealthFacility.id
+    x = models.FloatField()
+    y = models.FloatField()
+    department = models.CharField(max_length=50, null=True, blank=True, db_index=True)
+    name = models.CharField(max_length=255, null=True, blank=True)
+    health_amenity_type = models.CharField(max_length=255, null=True, blank=True)
+    opening_hours = models.CharField(max_length=255, null=True, blank=True)
+    opening_hours_bitmap = models.BinaryField(null=True, blank=True)
+
+    class Meta:
+        db_table = "facility_lookup"
+
+    @classmethod
+    def from_facility(cls, facility):
+        """The lookup row of a HealthFacility; imputed opening hours count as unknown."""
+        lookup = cls(**{field: getattr(facility, field) for field in cls.FIELDS})
+        if facility.opening_hours_imputed:
+            lookup.opening_hours = lookup.opening_hours_bitmap = None
+        return lookup
 
     def __str__(self):
         return self.name or f"Facility {self.id}"
+
+
+@receiver(post_save, sender=HealthFacility)
+def _sync_lookup(sender, instance, created=False, **kwargs):
+    with transaction.atomic():
+        if instance.x is None or instance.y is None:
+            FacilityLookup.objects.filter(id=instance.id).delete()
+        else:
+            FacilityLookup.from_facility(instance).save()
+        FacilityChange.objects.create(
+            facility_id=instance.id, operation=FacilityChange.INSERT if created else FacilityChange.UPDATE,
+        )
+
+
+@receiver(post_delete, sender=HealthFacility)
+def _delete_lookup(sender, instance, **kwargs):
+    with transaction.atomic():
+        FacilityLookup.objects.filter(id=instance.id).delete()
+        FacilityChange.objects.create(facility_id=instance.id, operation=FacilityChange.DELETE)
+
+
+class FacilityChange(models.Model):
+    """
+    Row of the change set written by db_utils/sync.py for every facility it
+    inserts, updates or deletes; facility indexes poll it to refresh only the
+    partitions that changed. ORM writes to HealthFacility log one row each
+    (see _sync_lookup), and a full facility_lookup rebuild
+    (create_db.refresh_lookup) logs one RELOAD row without a facility id,
+    which makes indexes rebuild completely.
+    """
+    INSERT = "insert"
+    UPDATE = "update"
+    DELETE = "delete"
+    RELOAD = "reload"
+
+    id = models.BigAutoField(primary_key=True)
+    facility_id = models.IntegerField(null=True)
+    operation = models.CharField(max_length=10)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "facility_changes"
+
+    def __str__(self):
+        return f"{self.operation} facility {self.facility_id}"
+
     
 class Chat(models.Model):
     message = models.TextField()
     sender = models.CharField(max_length=255, null=True)   # renamed "from" → "sender" (since "from" is reserved in Python/SQL)
     topic = models.CharField(max_length=255, blank=True, null=True)
-    session_id = models.CharField(max_length=255, db_index=True, null=True)
+    session_id = models.CharField(max_length=255, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Every read is "this session's newest messages"; id breaks ties between same-instant rows
+            models.Index(fields=["session_id", "-created_at", "-id"], name="chat_session_recent_idx"),
+        ]
+
     def __str__(self):
         return f"[{self.session_id}] {self.sender}: {self.message[:30]}"
 
 
 class Summary(models.Model):
     summary_text = models.TextField()
-    session_id = models.CharField(max_length=255, db_index=True)
+    session_id = models.CharField(max_length=255)
     wants_appointment = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        constraints = [
+            # One rolling summary per session; summarizing_agent upserts on it
+            models.UniqueConstraint(fields=["session_id"], name="summary_session_unique"),
+        ]
+
     def __str__(self):
         return f"Summary for {self.session_id}"
 
@@ -0,0 +1,104 @@
+"""
+Cache of nearest-facility candidates keyed by (department, geohash cell).
+
+Users in the same neighbourhood asking for the same department share one
+entry. An entry holds every facility that can be among the m nearest
+for *any* point of the cell: with R the distance from the cell centre to
+its m-th nearest facility and d the distance from the centre to a
+corner, a point in the cell has m facilities within R + d, so none of its
+m nearest is further than R + 2d from the centre. Each request then
+ranks only those candidates exactly, so answers match an uncached
+FacilityIndex.nearest.
+
+Entries hold positions in one index instance, so the index version is
+part of the key, and the cache is emptied as soon as a newer index is
+seen (reload, snapshot, applied facility_changes).
+"""
+import math
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from .cache import LRUCache
+from .departments import normalize_department
+from .geo import geohash_cell, haversine_km
+from .metrics import register_cache
+
+
+class NearestCache:
+    """
+    Args:
+        max_size: Cells kept before the least recently used one is evicted
+        precision: Geohash length of a cell (6 is about 1.2 x 0.6 km)
+    """
+
+    def __init__(self, max_size, precision):
+        self.precision = precision
+        self._cells = LRUCache(max_size)
+        self._version = 0
+        self._lock = threading.Lock()
+        self.invalidations = 0
+        self.bypassed = 0
+
+    def _check_version(self, index):
+        # Requests still holding the previous index keep using their own keys
+        with self._lock:
+            if index.version > self._version:
+                if self._version:
+                    self.invalidations += 1
+                self._cells.clear()
+                self._version = index.version
+
+    def _candidates(self, index, department, bounds, count):
+        min_lat, max_lat, min_lon, max_lon = bounds
+        lat = (min_lat + max_lat) / 2
+        lon = (min_lon + max_lon) / 2
+        # Corners are furthest from the centre; the one nearer the equator is the widest
+        corner_lat = min_lat if abs(min_lat) < abs(max_lat) else max_lat
+        half_diagonal = float(haversine_km(lat, lon, corner_lat, max_lon))
+        _, dist = index.nearest(department, lat, lon, k=count)
+        if len(dist) < count:
+            # Fewer facilities than asked for: all of them are candidates
+            return index.within(department, lat, lon, math.inf)[0]
+        return index.within(department, lat, lon, float(dist[-1]) + 2 * half_diagonal)[0]
+
+    def nearest(self, index, department, lat, lon, k=3, open_at=None, open_within=0, candidates=None):
+        """Same arguments and result as FacilityIndex.nearest."""
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            self.bypassed += 1
+            return index.nearest(department, lat, lon, k, open_at, open_within, candidates)
+        self._check_version(index)
+
+        department = normalize_department(department)
+        count = k if open_at is None else max(k, candidates or k)
+        cell, bounds = geohash_cell(lat, lon, self.precision)
+        key = (index.version, department, cell, count)
+        positions = self._cells.get(key)
+        if positions is None:
+            positions = self._candidates(index, department, bounds, count)
+            self._cells.set(key, positions)
+
+        dist = haversine_km(lat, lon, index.lat[positions], index.lon[positions])
+        order = np.argsort(dist, kind="stable")[:count]
+        positions, dist = positions[order], dist[order]
+        if open_at is not None:
+            order = np.lexsort((dist, index.open_rank(positions, open_at, open_within)))
+            positions, dist = positions[order], dist[order]
+        return positions[:k], dist[:k]
+
+    def clear(self):
+        self._cells.clear()
+
+    def stats(self):
+        stats = self._cells.stats()
+        stats["invalidations"] = self.invalidations
+        stats["bypassed"] = self.bypassed
+        return stats
+
+
+nearest_cache = NearestCache(
+    max_size=settings.NEAREST_CACHE_SIZE,
+    precision=settings.NEAREST_CACHE_PRECISION,
+)
+register_cache("nearest_facility", nearest_cache)
@@ -0,0 +1,171 @@
+"""
+Compiled OSM ``opening_hours`` values.
+
+Each string is parsed once into a weekly bitmap of quarter-hour slots
+(7 days x 96 slots, Monday first), packed into BITMAP_BYTES bytes. The
+loaders store it next to the raw string, and the facility index ranks
+candidates with a vectorized "open now / opens soon" mask instead of
+leaving the LLM to read the strings.
+
+The common subset of the syntax is supported: ``24/7``, weekday ranges
+and lists (``Mo-Fr``, ``Sa-Th``, ``Mo, We``), time spans with or without a
+colon (``09:00-17:00``, ``0700-2000``), spans past midnight
+(``18:00-01:00``), ``off``/``closed`` and several rules separated by ``;``
+or ``,``. Anything else (months, dates, comments, ``yes``) compiles to
+None, which the index treats as unknown hours. Like departments.py this
+module has no Django imports so db_utils can use it.
+"""
+import re
+from functools import lru_cache
+
+import numpy as np
+
+DAYS = ("Mo", "Tu", "We", "Th", "Fr", "Sa", "Su")
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+WEEK_SLOTS = len(DAYS) * SLOTS_PER_DAY
+BITMAP_BYTES = WEEK_SLOTS // 8
+
+_DAY = "|".join(DAYS)
+_TOKEN = re.compile(rf"""
+    \s*(?:
+        (?P<days>(?P<first>{_DAY}|PH|SH)(?:\s*-\s*(?P<last>{_DAY}))?)
+      | (?P<span>(?P<start_h>\d{{1,2}}):?(?P<start_m>\d{{2}})\s*-\s*(?P<end_h>\d{{1,2}}):?(?P<end_m>\d{{2}}))
+      | (?P<off>(?i:off|closed))
+      | (?P<comma>,)
+    )\s*""", re.X)
+
+
+def _day_range(first, last):
+    start = DAYS.index(first)
+    end = DAYS.index(last or first)
+    return [(start + offset) % len(DAYS) for offset in range((end - start) % len(DAYS) + 1)]
+
+
+def _minutes(hours, minutes):
+    hours, minutes = int(hours), int(minutes)
+    if minutes >= 60 or hours > 48:
+        raise ValueError(f"invalid time {hours}:{minutes:02d}")
+    return hours * 60 + minutes
+
+
+def _groups(rule):
+    """
+    Split one ``;`` rule into (days, spans, off) groups; a weekday after a
+    time span starts a new, additional group ("Mo-Fr 09:00-17:00, Sa 10:00-14:00").
+    days is None when the group names no weekday.
+    """
+    groups = []
+    days, spans, off = None, [], False
+    position = 0
+    while position < len(rule):
+        match = _TOKEN.match(rule, position)
+        if match is None or match.end() == position:
+            raise ValueError(f"unsupported opening_hours syntax: {rule[position:]!r}")
+        position = match.end()
+        if match["days"]:
+            if spans or off:
+                groups.append((days, spans, off))
+                days, spans, off = None, [], False
+            days = days if days is not None else []
+            if match["first"] not in ("PH", "SH"):
+                # Public and school holidays are not known here
+                days.extend(_day_range(match["first"], match["last"]))
+        elif match["span"]:
+            start = _minutes(match["start_h"], match["start_m"])
+            end = _minutes(match["end_h"], match["end_m"])
+            if start >= 24 * 60:
+                raise ValueError(f"span starts after midnight: {match['span']!r}")
+            if end <= start:
+                # 18:00-01:00 and 10:00-00:00 run past midnight
+                end += 24 * 60
+            spans.append((start, end))
+        elif match["off"]:
+            off = True
+    groups.append((days, spans, off))
+    return groups
+
+
+def parse_opening_hours(text):
+    """
+    Parse an opening_hours string into a weekly bitmap.
+
+    Slots only partly inside a span are left closed, so the bitmap never
+    claims a facility is open when it is not.
+
+    Returns:
+        np.ndarray: (7, SLOTS_PER_DAY) bool array, Monday first
+
+    Raises:
+        ValueError: For syntax outside the supported subset
+    """
+    text = text.strip()
+    if text == "24/7":
+        return np.ones((len(DAYS), SLOTS_PER_DAY), dtype=bool)
+    if not text:
+        raise ValueError("empty opening_hours")
+
+    # Slots opened by each day's spans; overriding a day keeps the previous
+    # day's hours that run past midnight into it
+    by_day = np.zeros((len(DAYS), WEEK_SLOTS), dtype=bool)
+
+    for rule in re.split(r";|\|\|", text):
+        if not rule.strip():
+            continue
+        for number, (days, spans, off) in enumerate(_groups(rule)):
+            if days is not None and not days:
+                # Holiday-only group
+                continue
+            days = range(len(DAYS)) if days is None else days
+            if number == 0:
+                # A later rule replaces earlier ones for the days it names
+                by_day[list(days)] = False
+            if off:
+                continue
+            for day in days:
+                for start, end in spans or [(0, 24 * 60)]:
+                    first = day * SLOTS_PER_DAY + -(-start // SLOT_MINUTES)
+                    last = day * SLOTS_PER_DAY + end // SLOT_MINUTES
+                    by_day[day, np.arange(first, last) % WEEK_SLOTS] = True
+    return by_day.any(axis=0).reshape(len(DAYS), SLOTS_PER_DAY)
+
+
+@lru_cache(maxsize=4096)
+def compile_opening_hours(text):
+    """
+    Packed bitmap for an opening_hours string.
+
+    Returns:
+        bytes | None: BITMAP_BYTES bytes, or None when the string is missing
+        or not understood
+    """
+    if not isinstance(text, str):
+        return None
+    try:
+        week = parse_opening_hours(text)
+    except ValueError:
+        return None
+    return np.packbits(week.ravel()).tobytes()
+
+
+def week_slot(when):
+    """Slot of a (local) datetime within the week."""
+    return when.weekday() * SLOTS_PER_DAY + (when.hour * 60 + when.minute) // SLOT_MINUTES
+
+
+def open_mask(bitmaps, slot, within_minutes=0):
+    """
+    Which facilities are open at ``slot`` or open within ``within_minutes`` after it.
+
+    Args:
+        bitmaps: (n, BITMAP_BYTES) uint8 array of packed bitmaps
+        slot: week_slot of the moment to check
+        within_minutes: How far ahead an opening still counts
+
+    Returns:
+        np.ndarray: (n,) bool mask
+    """
+    bits = np.unpackbits(np.asarray(bitmaps, dtype=np.uint8).reshape(-1, BITMAP_BYTES), axis=1)
+    window = (slot + np.arange(within_minutes // SLOT_MINUTES + 1)) % WEEK_SLOTS
+    return bits[:, window].any(axis=1)
@@ -0,0 +1,148 @@
+"""
+Per-session conversation state for one chat turn.
+
+The appointment flag, the latest summary and the last five messages are
+read with a single UNION ALL query instead of three round trips, and can
+be kept in a short-lived per-process cache. The write paths
+(save_chat_messages, summarizing_agent, create_appointment) update a cached
+entry in place, so the next turn of an active session usually needs no
+query at all.
+
+The cache is off by default (SESSION_STATE_CACHE_TTL = 0): a worker never
+sees writes other workers make to a session it has cached, so turns of one
+session that land on different workers would be answered from stale state.
+Only enable it when the load balancer pins each session to one worker
+(sticky sessions).
+"""
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .cache import LRUCache
+from .metrics import register_cache
+from .models import Chat, Summary, WantAppointment
+
+HISTORY_LENGTH = 5
+
+
+class SessionState:
+    """
+    Args:
+        wants_appointment: WantAppointment flag, or None when the session has no record
+        summary: Latest Summary, or None
+        messages: Last HISTORY_LENGTH Chat messages, newest first
+    """
+
+    def __init__(self, session_id, wants_appointment=None, summary=None, messages=()):
+        self.session_id = session_id
+        self.wants_appointment = wants_appointment
+        self.summary = summary
+        self.messages = list(messages)
+
+    def __repr__(self):
+        return f"<SessionState {self.session_id}: {len(self.messages)} messages, wants_appointment={self.wants_appointment}>"
+
+
+def _state_query():
+    chat = Chat._meta.db_table
+    summary = Summary._meta.db_table
+    want = WantAppointment._meta.db_table
+    # Columns: kind, id, text, sender, topic, created_at, flag. The NULL flag is cast because
+    # PostgreSQL types an untyped NULL in a subquery as text, which cannot union with boolean.
+    return f"""
+        SELECT * FROM (
+            SELECT 'chat' AS kind, id, message AS text, sender, topic, created_at, CAST(NULL AS BOOLEAN) AS flag
+            FROM {chat} WHERE session_id = %s ORDER BY created_at DESC, id DESC LIMIT {HISTORY_LENGTH}
+        ) AS recent_chat
+        UNION ALL
+        SELECT 'summary', id, summary_text, NULL, NULL, created_at, wants_appointment
+        FROM {summary} WHERE session_id = %s
+        UNION ALL
+        SELECT 'want_appointment', id, NULL, NULL, NULL, NULL, wants_appointment
+        FROM {want} WHERE session_id = %s
+    """
+
+
+def _datetime(value):
+    # Column types are lost through the UNION on some backends (SQLite returns text)
+    value = Chat._meta.get_field("created_at").to_python(value)
+    if value is not None and settings.USE_TZ and timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return value
+
+
+def fetch_session_state(session_id):
+    """Read the session's state from the database in one query."""
+    with connection.cursor() as cursor:
+        cursor.execute(_state_query(), [session_id] * 3)
+        rows = cursor.fetchall()
+
+    state = SessionState(session_id)
+    for kind, pk, text, sender, topic, created_at, flag in rows:
+        if kind == "chat":
+            state.messages.append(Chat(id=pk, message=text, sender=sender, topic=topic,
+                                       session_id=session_id, created_at=_datetime(created_at)))
+        elif kind == "summary":
+            state.summary = Summary(id=pk, summary_text=text, session_id=session_id,
+                                    wants_appointment=bool(flag), created_at=_datetime(created_at))
+        else:
+            state.wants_appointment = bool(flag)
+    return state
+
+
+class SessionStateCache:
+    """
+    Args:
+        max_size: Sessions kept before the least recently used one is evicted
+        ttl: Seconds a state stays cached; 0 disables the cache
+    """
+
+    def __init__(self, max_size, ttl):
+        self.ttl = ttl
+        self._states = LRUCache(max_size, ttl)
+
+    def load(self, session_id):
+        """Cached state for the session, reading it from the database on a miss."""
+        if not session_id or not self.ttl:
+            # Anonymous turns share no history, so there is nothing worth caching
+            return fetch_session_state(session_id)
+        state = self._states.get(session_id)
+        if state is None:
+            state = fetch_session_state(session_id)
+            self._states.set(session_id, state)
+        return state
+
+    def record_messages(self, session_id, chats):
+        """Add newly saved Chat rows (oldest first) to a cached state."""
+        state = self._states.get(session_id) if session_id else None
+        if state is not None:
+            state.messages = (list(reversed(chats)) + state.messages)[:HISTORY_LENGTH]
+
+    def record_summary(self, session_id, summary):
+        state = self._states.get(session_id) if session_id else None
+        if state is not None:
+            state.summary = summary
+
+    def record_wants_appointment(self, session_id, wants_appointment):
+        state = self._states.get(session_id) if session_id else None
+        if state is not None:
+            state.wants_appointment = wants_appointment
+
+    def clear(self):
+        self._states.clear()
+
+    def stats(self):
+        return self._states.stats()
+
+
+session_states = SessionStateCache(
+    max_size=settings.SESSION_STATE_CACHE_SIZE,
+    ttl=settings.SESSION_STATE_CACHE_TTL,
+)
+register_cache("session_state", session_states)
+
+
+def load_session_state(session_id):
+    return session_states.load(session_id)
@@ -0,0 +1,86 @@
+"""
+Background summarization off the request path.
+
+Views call ``enqueue_summary`` after the reply is ready and return
+immediately. A small pool of worker threads drains the queue; messages
+that arrive for a session while it is waiting (or being summarized) are
+coalesced into a single summarizer call, and a session is never handled
+by two workers at once, so its Summary row is updated in order.
+"""
+import logging
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .helpers import summarizing_agent
+from .models import Summary
+
+logger = logging.getLogger(__name__)
+
+
+class SummaryQueue:
+    def __init__(self, workers):
+        self.workers = workers
+        self._cond = threading.Condition()
+        self._pending = {}  # session_id -> [(latency, message), ...]
+        self._ready = deque()  # sessions with pending messages and no worker on them
+        self._in_flight = set()
+        self._threads = []
+
+    def submit(self, session_id, latency, message):
+        with self._cond:
+            self._start()
+            queued = session_id in self._pending
+            self._pending.setdefault(session_id, []).append((latency, message))
+            if not queued and session_id not in self._in_flight:
+                self._ready.append(session_id)
+                self._cond.notify()
+
+    def drain(self, timeout=None):
+        """Block until every submitted message has been summarized."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._in_flight, timeout)
+
+    def _start(self):
+        if self._threads:
+            return
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"summary-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._ready)
+                session_id = self._ready.popleft()
+                batch = self._pending.pop(session_id)
+                self._in_flight.add(session_id)
+            try:
+                self._summarize(session_id, batch)
+            except Exception:
+                logger.exception("Summary for session %s failed", session_id)
+            finally:
+                close_old_connections()
+                with self._cond:
+                    self._in_flight.discard(session_id)
+                    if session_id in self._pending:
+                        self._ready.append(session_id)
+                    self._cond.notify_all()
+
+    def _summarize(self, session_id, batch):
+        latency = batch[-1][0]
+        message = "\n".join(message for _, message in batch)
+        # Read the summary here rather than in the request, so it includes the previous batch
+        summary = Summary.objects.filter(session_id=session_id).first()
+        summarizing_agent(latency, message, summary, session_id)
+
+
+summary_queue = SummaryQueue(workers=settings.SUMMARY_WORKERS)
+
+
+def enqueue_summary(session_id, latency, message):
+    """Schedule a summary update for the session and return immediately."""
+    summary_queue.submit(session_id, latency, message)
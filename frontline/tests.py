@@ -1,3 +1,990 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from asgiref.sync import iscoroutinefunction
+from psycopg2 import Error as DatabaseError
+
+from frontline_worker.database import django_database, pool_mode
+
+from .departments import GENERAL
+from .facility_index import FacilityIndex, _initial_index, rebuild_facility_index, sync_facility_index
+from .geo import EARTH_RADIUS_KM, bounding_box, haversine_km
+from .helpers import _parse_classification, _parse_triage, fallback_reply, get_last_five_messages, save_chat_messages
+from .classification_cache import ClassificationCache, classification_cache, normalize_message
+from .deadline import Deadline
+from .log import BackgroundHandler, JsonFormatter, SampleFilter
+from .metrics import ServerTimingMiddleware, server_timing
+from .models import Chat, FacilityChange, FacilityLookup, HealthFacility, Summary, WantAppointment
+from .nearest_cache import NearestCache
+from .opening_hours import DAYS, SLOTS_PER_DAY, compile_opening_hours, parse_opening_hours, week_slot
+from .session_state import SessionStateCache, _state_query, load_session_state, session_states
+from .summary_queue import SummaryQueue
+from .triage import classify_by_rules, classify_locally
+
+
+def db_utils(module):
+    """Import a db_utils script; they import each other by module name."""
+    path = str(settings.BASE_DIR / "db_utils")
+    if path not in sys.path:
+        sys.path.insert(0, path)
+    return importlib.import_module(module)
+
+
+def enable_session_state_cache(test):
+    """Swap in a session state cache with a TTL (the default, 0, turns it off) for the test."""
+    states = SessionStateCache(max_size=100, ttl=30)
+    for target in ("frontline.session_state.session_states", "frontline.helpers.session_states"):
+        patch = mock.patch(target, states)
+        patch.start()
+        test.addCleanup(patch.stop)
+    return states
+
+
+class SessionStateTests(TestCase):
+    def setUp(self):
+        for number in range(7):
+            Chat.objects.create(session_id="s1", sender="user", message=f"m{number}")
+        Summary.objects.create(session_id="s1", summary_text="needs a pharmacy")
+        WantAppointment.objects.create(session_id="s1", wants_appointment=True)
+
+    def test_loads_flag_summary_and_history_in_one_query(self):
+        with self.assertNumQueries(1):
+            state = load_session_state("s1")
+        self.assertTrue(state.wants_appointment)
+        self.assertEqual(state.summary.summary_text, "needs a pharmacy")
+        self.assertEqual([chat.message for chat in state.messages], ["m6", "m5", "m4", "m3", "m2"])
+
+    def test_unknown_session(self):
+        state = load_session_state("nobody")
+        self.assertIsNone(state.wants_appointment)
+        self.assertIsNone(state.summary)
+        self.assertEqual(state.messages, [])
+
+    def test_not_cached_by_default(self):
+        load_session_state("s1")
+        # Another worker's write is seen on the next load
+        Chat.objects.create(session_id="s1", sender="user", message="m7")
+        with self.assertNumQueries(1):
+            state = load_session_state("s1")
+        self.assertEqual(state.messages[0].message, "m7")
+        self.assertEqual(session_states.stats()["size"], 0)
+
+    def test_writes_update_the_cached_state(self):
+        states = enable_session_state_cache(self)
+        load_session_state("s1")
+        save_chat_messages("s1", "hi", "hello")
+        with self.assertNumQueries(0):
+            state = load_session_state("s1")
+        self.assertEqual([chat.message for chat in state.messages], ["hello", "hi", "m6", "m5", "m4"])
+
+        states.clear()
+        self.assertEqual([chat.id for chat in load_session_state("s1").messages], [chat.id for chat in state.messages])
+
+
+class TriageRuleTests(SimpleTestCase):
+    def assertNotLocal(self, message):
+        result = classify_by_rules(message)
+        self.assertTrue(result is None or result["confidence"] < settings.LOCAL_TRIAGE_THRESHOLD, result)
+        with mock.patch("frontline.triage.get_triage_model", return_value=None):
+            self.assertIsNone(classify_locally(message))
+
+    def test_police_post_wins_over_police_station(self):
+        self.assertEqual(classify_by_rules("where is the nearest police post")["department"], "Police post")
+        self.assertEqual(classify_by_rules("is there a police chowki nearby")["department"], "Police post")
+        self.assertEqual(classify_by_rules("nearest police station please")["department"], "Police Station")
+
+    def test_inflected_emergencies_go_to_the_llm(self):
+        self.assertNotLocal("I overdosed on pills, need medicine")
+        self.assertNotLocal("my father collapsed, need a doctor")
+        self.assertEqual(classify_by_rules("she fainted in the street")["emergency_level"], 1)
+
+    def test_urgency_word_keeps_low_levels_from_answering(self):
+        self.assertNotLocal("it's urgent, where is the nearest pharmacy")
+        # Negation is not understood, so a negated emergency goes to the LLM
+        self.assertNotLocal("no chest pain, just need my prescription refilled")
+        self.assertEqual(classify_by_rules("where is the nearest pharmacy")["confidence"], 0.9)
+
+
+class ClassificationCacheTests(SimpleTestCase):
+    def setUp(self):
+        classification_cache.clear()
+        self.addCleanup(classification_cache.clear)
+
+    def test_messages_are_normalized(self):
+        cache = ClassificationCache(max_size=10, ttl=None)
+        cache.set("I need a Pharmacy ", {"department": "Pharmacy", "emergency_level": 4})
+        self.assertEqual(cache.get("i  need a pharmacy"), {"department": "Pharmacy", "emergency_level": 4})
+        self.assertEqual(normalize_message("Call me on +92 300 1234567 or ali@example.com, room 12"),
+                         "call me on <phone> or <email>, room <num>")
+
+    def test_entries_expire(self):
+        cache = ClassificationCache(max_size=10, ttl=60)
+        with mock.patch("frontline.cache.time.monotonic", return_value=1000.0):
+            cache.set("my tooth hurts", {"department": "Dentist", "emergency_level": 4})
+        with mock.patch("frontline.cache.time.monotonic", return_value=1059.0):
+            self.assertIsNotNone(cache.get("my tooth hurts"))
+        with mock.patch("frontline.cache.time.monotonic", return_value=1061.0):
+            self.assertIsNone(cache.get("my tooth hurts"))
+
+    def test_only_valid_answers_are_cached(self):
+        self.assertEqual(_parse_classification("valid answer", '{"department": "hospital", "emergency_level": 2}'),
+                         {"department": "Hospital", "emergency_level": 2})
+        self.assertEqual(classification_cache.get("valid answer"), {"department": "Hospital", "emergency_level": 2})
+
+        fallback = {"department": "General", "emergency_level": 3}
+        for message, answer in zip(["off list", "level too high", "level string", "level bool", "list", "text"], [
+            '{"department": "Fire Brigade", "emergency_level": 1}',
+            '{"department": "Hospital", "emergency_level": 7}',
+            '{"department": "Hospital", "emergency_level": "2"}',
+            '{"department": "Hospital", "emergency_level": true}',
+            '["Hospital", 2]',
+            'not json',
+        ]):
+            with self.subTest(answer=answer):
+                self.assertEqual(_parse_classification(message, answer), fallback)
+                self.assertIsNone(classification_cache.get(message))
+
+
+class SummaryQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.queue = SummaryQueue(workers=2)
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.batches = []
+
+        def summarize(session_id, batch):
+            self.batches.append((session_id, [message for _, message in batch]))
+            self.started.set()
+            self.assertTrue(self.release.wait(5))
+
+        patch = mock.patch.object(self.queue, "_summarize", side_effect=summarize)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_messages_arriving_mid_summary_are_coalesced(self):
+        self.queue.submit("s1", 5, "first")
+        self.assertTrue(self.started.wait(5))
+        self.queue.submit("s1", 5, "second")
+        self.queue.submit("s1", 5, "third")
+        self.release.set()
+        self.assertTrue(self.queue.drain(5))
+        self.assertEqual(self.batches, [("s1", ["first"]), ("s1", ["second", "third"])])
+
+    def test_a_failed_summary_does_not_stop_the_workers(self):
+        self.release.set()
+        self.queue._summarize.side_effect = [RuntimeError("LLM down"), None]
+        with self.assertLogs("frontline.summary_queue", "ERROR") as logs:
+            self.queue.submit("s1", 5, "first")
+            self.assertTrue(self.queue.drain(5))
+        self.assertEqual(str(logs.records[0].exc_info[1]), "LLM down")
+        self.queue.submit("s1", 5, "second")
+        self.assertTrue(self.queue.drain(5))
+        self.assertEqual(self.queue._summarize.call_count, 2)
+
+
+class BulkLoadTests(SimpleTestCase):
+    """db_utils/create_db.py, with the COPY itself patched out."""
+
+    CSV = (
+        "X,Y,osm_id,osm_type,completeness,is_in_health_zone,amenity,speciality,addr_full,operator,water_source,"
+        "changeset_id,insurance,staff_doctors,contact_number,uuid,electricity,opening_hours,operational_status,"
+        "source,is_in_health_area,health_amenity_type,changeset_version,emergency,changeset_timestamp,name,"
+        "staff_nurses,changeset_user,wheelchair,beds,url,dispensing,healthcare,operator_type\n"
+        ",,721520722,way,13,,hospital,,,,,74023681.0,,,,3a6f,,Mo-Su 09:00-12:00,,,,,1.0,,2019/09/03 07:11:25,"
+        "ISM Hospital,,RLakhani,,,,,hospital,\n"
+        "67.02,24.86,4792035067,node,10,,,,,,,74374628.0,,,,5fb5,,,,,,,3.0,,2019/09/11 23:44:15,"
+        "Corner Pharmacy,,RLakhani,,,,,pharmacy,\n"
+    )
+
+    def setUp(self):
+        self.create_db = db_utils("create_db")
+
+    def test_prepare(self):
+        df = self.create_db.prepare(pd.read_csv(io.StringIO(self.CSV)))
+        self.assertEqual(list(df.columns), self.create_db.COLUMNS)
+        self.assertEqual(df["changeset_id"].tolist(), [74023681, 74374628])
+        self.assertEqual(str(df["changeset_id"].dtype), "Int64")
+        self.assertEqual(df["changeset_timestamp"].iloc[1], pd.Timestamp("2019-09-11 23:44:15"))
+        self.assertEqual(df["department"].tolist(), ["Hospital", "Pharmacy"])
+        self.assertEqual(df["opening_hours_imputed"].tolist(), [False, False])
+        self.assertEqual(df["opening_hours_bitmap"].tolist(), ["\\x" + compile_opening_hours("Mo-Su 09:00-12:00").hex(), None])
+
+    def test_imputed_opening_hours_are_flagged(self):
+        ingest = db_utils("ingest")
+        chunk = pd.read_csv(io.StringIO(self.CSV), dtype=str)
+        df = self.create_db.prepare(ingest.OpeningHoursPool(seed=0)(ingest.CoordinateFill()(chunk)))
+        self.assertEqual(df["opening_hours"].tolist(), ["Mo-Su 09:00-12:00", "Mo-Su 09:00-12:00"])
+        self.assertEqual(df["opening_hours_imputed"].tolist(), [False, True])
+        # Made-up hours are not compiled, so they rank as unknown
+        self.assertIsNotNone(df["opening_hours_bitmap"].iloc[0])
+        self.assertIsNone(df["opening_hours_bitmap"].iloc[1])
+
+    def test_rejected_rows_are_isolated(self):
+        frame = pd.DataFrame({"name": [f"Facility {n}" for n in range(10)]})
+        frame.loc[[3, 7], "name"] = "bad"
+        copied, failed = [], []
+
+        def copy_rows(cur, batch, table):
+            if (batch["name"] == "bad").any():
+                failed.append(len(batch))
+                raise DatabaseError("value too long for type character varying(255)\nCONTEXT: COPY")
+            copied.extend(batch.index)
+
+        conn = mock.MagicMock()
+        rejects = []
+        with mock.patch.object(self.create_db, "copy_rows", copy_rows):
+            loaded = self.create_db.copy_batch(conn, frame, rejects)
+
+        self.assertEqual(loaded, 8)
+        self.assertEqual(sorted(copied), [0, 1, 2, 4, 5, 6, 8, 9])
+        self.assertEqual([row.index[0] for row, _ in rejects], [3, 7])
+        self.assertEqual(rejects[0][1], "value too long for type character varying(255)")
+        # Every failed COPY is rolled back before its halves are retried
+        self.assertEqual(conn.rollback.call_count, len(failed))
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    def test_pool_mode_defaults(self):
+        with mock.patch.dict(os.environ, {"SERVER_INTERFACE": ""}):
+            os.environ.pop("DB_POOL", None)
+            self.assertEqual(pool_mode(), "persistent")
+            os.environ["SERVER_INTERFACE"] = "asgi"
+            self.assertEqual(pool_mode(), "none")
+            self.assertEqual(django_database()["CONN_MAX_AGE"], 0)
+            os.environ["DB_POOL"] = "persistent"
+            self.assertEqual(pool_mode(), "persistent")
+            os.environ["DB_POOL"] = "pgbouncer"
+            with self.assertRaises(ValueError):
+                pool_mode()
+
+    def test_pool_needs_psycopg3(self):
+        with mock.patch("importlib.util.find_spec", return_value=None), \
+                self.assertRaisesRegex(ValueError, r"psycopg\[binary,pool\]"):
+            django_database("pool")
+
+
+class LoggingTests(SimpleTestCase):
+    def record(self, level=logging.INFO, msg="turn %s done", args=("s1",), **extra):
+        record = logging.LogRecord("frontline.views", level, __file__, 1, msg, args, None)
+        record.__dict__.update(extra)
+        return record
+
+    def test_json_formatter(self):
+        entry = json.loads(JsonFormatter().format(self.record(session_id="s1", elapsed_ms=12.5)))
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["logger"], "frontline.views")
+        self.assertEqual(entry["message"], "turn s1 done")
+        self.assertEqual((entry["session_id"], entry["elapsed_ms"]), ("s1", 12.5))
+        self.assertNotIn("args", entry)
+
+    def test_json_formatter_with_traceback(self):
+        try:
+            raise ValueError("bad answer")
+        except ValueError:
+            record = logging.LogRecord("frontline.views", logging.ERROR, __file__, 1, "failed", None, sys.exc_info())
+        self.assertIn("ValueError: bad answer", json.loads(JsonFormatter().format(record))["exc_info"])
+
+    def test_sample_filter(self):
+        sample = SampleFilter(rate=0.0)
+        self.assertFalse(sample.filter(self.record(logging.DEBUG)))
+        self.assertTrue(sample.filter(self.record(logging.INFO)))
+        self.assertTrue(SampleFilter(rate=1.0).filter(self.record(logging.DEBUG)))
+
+    def test_background_handler_writes_and_drops(self):
+        stream = io.StringIO()
+        handler = BackgroundHandler(stream, max_queue=10)
+        handler.setFormatter(JsonFormatter())
+        args = ["s1"]
+        handler.handle(self.record(args=(args,)))
+        # The message is resolved when the record is queued, not when it is written
+        args.append("s2")
+        handler.close()
+        self.assertEqual(json.loads(stream.getvalue())["message"], "turn ['s1'] done")
+
+        full = BackgroundHandler(io.StringIO(), max_queue=1)
+        full.listener.stop()
+        for _ in range(3):
+            full.handle(self.record())
+        self.assertEqual(full.dropped, 2)
+        full.listener = None
+        full.close()
+
+
+class OpeningHoursParserTests(SimpleTestCase):
+    def hours(self, text):
+        """{day: [(first slot, last slot), ...]} of the open quarter hours."""
+        week = parse_opening_hours(text)
+        spans = {}
+        for day, slots in zip(DAYS, week):
+            open_slots = list(slots.nonzero()[0])
+            runs = []
+            for slot in open_slots:
+                if runs and slot == runs[-1][1] + 1:
+                    runs[-1] = (runs[-1][0], slot)
+                else:
+                    runs.append((slot, slot))
+            if runs:
+                spans[day] = runs
+        return spans
+
+    def test_always_open(self):
+        self.assertEqual(self.hours("24/7"), {day: [(0, SLOTS_PER_DAY - 1)] for day in DAYS})
+
+    def test_day_ranges(self):
+        self.assertEqual(self.hours("Mo-Fr 09:00-17:00"), {day: [(36, 67)] for day in DAYS[:5]})
+        # A range may wrap around the end of the week
+        self.assertEqual(set(self.hours("Fr-Mo 10:00-12:00")), {"Fr", "Sa", "Su", "Mo"})
+        self.assertEqual(self.hours("Mo, We 0800-1000"), {"Mo": [(32, 39)], "We": [(32, 39)]})
+
+    def test_span_past_midnight(self):
+        self.assertEqual(self.hours("Fr 22:00-02:00"), {"Fr": [(88, 95)], "Sa": [(0, 7)]})
+        # A later rule for Saturday keeps the hours Friday's span carries into it
+        self.assertEqual(self.hours("Fr 22:00-02:00; Sa 10:00-12:00"),
+                         {"Fr": [(88, 95)], "Sa": [(0, 7), (40, 47)]})
+
+    def test_off(self):
+        hours = self.hours("Mo-Su 08:00-20:00; Fr off")
+        self.assertNotIn("Fr", hours)
+        self.assertEqual(hours["Sa"], [(32, 79)])
+
+    def test_unsupported_syntax_is_unknown(self):
+        with self.assertRaises(ValueError):
+            parse_opening_hours("yes")
+        self.assertIsNone(compile_opening_hours("yes"))
+        self.assertIsNone(compile_opening_hours(None))
+        self.assertEqual(len(compile_opening_hours("24/7")), 84)
+
+
+class ChatTurnQueryCountTests(TestCase):
+    """Pins the database work of one chat_flow turn (LLM and summary queue patched out)."""
+
+    def setUp(self):
+        HealthFacility.objects.create(x=67.02, y=24.86, department="Pharmacy", name="Corner Pharmacy")
+        rebuild_facility_index()
+        patches = [
+            mock.patch("frontline.views.user_facing_agent", return_value="Corner Pharmacy is 2 km away."),
+            mock.patch("frontline.views.enqueue_summary"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def turn(self):
+        """
+        Run one turn.
+
+        Returns:
+            tuple: (statements, transactions); transaction control is left out of
+            the statements since backends differ in whether it is captured
+        """
+        with CaptureQueriesContext(connection) as queries:
+            # Answered by the local triage rules, so classification needs no LLM call
+            response = self.client.post("/api/v1/chat/", {
+                "message": "where is the nearest pharmacy",
+                "session_id": "s1",
+                "latitude": 24.8,
+                "longitude": 67.0,
+            }, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        sql = [query["sql"] for query in queries.captured_queries]
+        statements = [s for s in sql if not s.startswith(("BEGIN", "COMMIT", "SAVEPOINT", "RELEASE SAVEPOINT"))]
+        # Inside the TestCase transaction every atomic() block is a savepoint
+        transactions = [s for s in sql if s.startswith("SAVEPOINT")]
+        return len(statements), len(transactions)
+
+    def test_queries_per_turn(self):
+        # Session state, then both chat rows in one INSERT and one commit
+        self.assertEqual(self.turn(), (2, 1))
+        self.assertEqual(self.turn(), (2, 1))
+        self.assertEqual(Chat.objects.filter(session_id="s1").count(), 4)
+
+    def test_cached_session_state(self):
+        enable_session_state_cache(self)
+        self.assertEqual(self.turn(), (2, 1))
+
+        # The session state is cached and kept current by the turn commit
+        self.assertEqual(self.turn(), (1, 1))
+
+
+class AsyncChatFlowTests(TestCase):
+    """chat_flow_async (LLM and summary queue patched out)."""
+
+    def setUp(self):
+        HealthFacility.objects.create(x=67.02, y=24.86, department="Hospital", name="City Hospital")
+        rebuild_facility_index()
+        self.enqueue = mock.patch("frontline.views.enqueue_summary").start()
+        mock.patch("frontline.views.auser_facing_agent", return_value="City Hospital is 7 km away.").start()
+        self.addCleanup(mock.patch.stopall)
+
+    async def test_session_read_and_classification_overlap(self):
+        classifying = threading.Event()
+
+        def load_state(session_id):
+            # Only returns in time if the classification started while the session was being read
+            self.assertTrue(classifying.wait(5), "classification waited for the session read")
+            return load_session_state(session_id)
+
+        async def classify(latency, message, timeout=None):
+            classifying.set()
+            return {"department": "Hospital", "emergency_level": 2, "source": "llm"}
+
+        with mock.patch("frontline.views.load_session_state", load_state), \
+                mock.patch("frontline.views.aclassify_emergency", classify):
+            response = await self.async_client.post("/api/v1/chat/async/", {
+                "message": "my father feels dizzy", "session_id": "s1", "latitude": 24.8, "longitude": 67.0,
+            }, content_type="application/json")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"agent_response": "City Hospital is 7 km away.", "skipped_stages": []})
+        self.assertEqual(await Chat.objects.filter(session_id="s1").acount(), 2)
+        self.enqueue.assert_called_once_with("s1", None, "my father feels dizzy")
+
+    async def test_bad_requests(self):
+        for body in ({"session_id": "s1"}, ["my father feels dizzy"], "my father feels dizzy"):
+            with self.subTest(body=body), self.assertLogs("django.request", "WARNING"):
+                response = await self.async_client.post("/api/v1/chat/async/", body,
+                                                        content_type="application/json")
+                self.assertEqual(response.status_code, 400)
+
+
+class MetricsTests(TestCase):
+    """Server-Timing headers and the metrics endpoint (LLM and summary queue patched out)."""
+
+    STAGES = ["session_state", "classify", "facilities", "reply", "persist", "total"]
+
+    def setUp(self):
+        HealthFacility.objects.create(x=67.02, y=24.86, department="Pharmacy", name="Corner Pharmacy")
+        rebuild_facility_index()
+        mock.patch("frontline.views.user_facing_agent", return_value="Corner Pharmacy is 2 km away.").start()
+        mock.patch("frontline.views.auser_facing_agent", return_value="Corner Pharmacy is 2 km away.").start()
+        mock.patch("frontline.views.enqueue_summary").start()
+        self.addCleanup(mock.patch.stopall)
+        self.turn = {"message": "where is the nearest pharmacy", "session_id": "s1", "latitude": 24.8,
+                     "longitude": 67.0}
+
+    def timed_stages(self, response):
+        return [entry.split(";")[0] for entry in response["Server-Timing"].split(", ")]
+
+    def test_server_timing(self):
+        response = self.client.post("/api/v1/chat/", self.turn, content_type="application/json")
+        self.assertEqual(self.timed_stages(response), self.STAGES)
+
+    async def test_server_timing_async(self):
+        # The middleware must stay a coroutine function for async views (broken on Python 3.11 once)
+        self.assertTrue(iscoroutinefunction(ServerTimingMiddleware(mock.AsyncMock())))
+        self.assertFalse(iscoroutinefunction(ServerTimingMiddleware(mock.Mock())))
+        response = await self.async_client.post("/api/v1/chat/async/", self.turn, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(self.timed_stages(response)), sorted(self.STAGES))
+
+    def test_repeated_stages_are_added_up(self):
+        self.assertEqual(server_timing([("classify", 0.01), ("classify", 0.02)], total=0.05),
+                         "classify;dur=30.0, total;dur=50.0")
+
+    def test_metrics_endpoint(self):
+        self.client.post("/api/v1/chat/", self.turn, content_type="application/json")
+        # The test client connects from 127.0.0.1, which is allowed by default
+        response = self.client.get("/api/v1/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        body = response.content.decode()
+        self.assertIn("# TYPE frontline_stage_seconds histogram", body)
+        self.assertRegex(body, r'frontline_stage_seconds_count\{stage="reply"\} [1-9]')
+        self.assertRegex(body, r'frontline_request_seconds_count\{route="api/v1/chat/"\} [1-9]')
+        self.assertIn('frontline_cache_hits_total{cache="nearest_facility"}', body)
+
+    @override_settings(METRICS_ALLOWED_IPS=["10.0.0.5"], METRICS_TOKEN="s3cret")
+    def test_metrics_endpoint_needs_allowed_ip_or_token(self):
+        with self.assertLogs("django.request", "WARNING"):
+            self.assertEqual(self.client.get("/api/v1/metrics").status_code, 403)
+            self.assertEqual(self.client.get("/api/v1/metrics", HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+        self.assertEqual(self.client.get("/api/v1/metrics", HTTP_AUTHORIZATION="Bearer s3cret").status_code, 200)
+        self.assertEqual(self.client.get("/api/v1/metrics", REMOTE_ADDR="10.0.0.5").status_code, 200)
+
+    @override_settings(METRICS_ALLOWED_IPS=[], METRICS_TOKEN=None)
+    def test_metrics_endpoint_without_token_is_closed(self):
+        with self.assertLogs("django.request", "WARNING"):
+            self.assertEqual(self.client.get("/api/v1/metrics", HTTP_AUTHORIZATION="Bearer ").status_code, 403)
+
+
+class ChatStreamTests(TestCase):
+    """chat_flow_stream's Server-Sent Events (LLM and summary queue patched out)."""
+
+    def setUp(self):
+        HealthFacility.objects.create(x=67.02, y=24.86, department="Pharmacy", name="Corner Pharmacy")
+        rebuild_facility_index()
+        mock.patch("frontline.views.enqueue_summary").start()
+        self.addCleanup(mock.patch.stopall)
+
+    async def events(self, latency=None):
+        """(event, data) pairs of one streamed turn; comments are left out."""
+        # Answered by the local triage rules, so classification needs no LLM call
+        response = await self.async_client.post("/api/v1/chat/stream/", {
+            "message": "where is the nearest pharmacy", "session_id": "s1",
+            "latitude": 24.8, "longitude": 67.0, "latency": latency,
+        }, content_type="application/json")
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        body = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        events = []
+        for block in body.split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+            if fields:
+                events.append((fields["event"], json.loads(fields["data"])))
+        return events
+
+    async def test_event_order(self):
+        async def reply(*args):
+            yield "Corner Pharmacy "
+            yield "is 2 km away.\n"
+
+        with mock.patch("frontline.views.astream_user_facing_agent", reply):
+            events = await self.events()
+
+        self.assertEqual([event for event, _ in events], ["facilities", "token", "token", "done"])
+        facilities = events[0][1]
+        self.assertEqual(facilities["department"], "Pharmacy")
+        self.assertEqual([f["location_name"] for f in facilities["departments"]], ["Corner Pharmacy"])
+        # The reply is stored exactly as it was streamed
+        self.assertEqual(events[-1][1], {"agent_response": "Corner Pharmacy is 2 km away.\n", "skipped_stages": []})
+        stored = await Chat.objects.filter(session_id="s1", sender="agent").values_list("message", flat=True).aget()
+        self.assertEqual(stored, "Corner Pharmacy is 2 km away.\n")
+
+    async def test_timeout_mid_reply_appends_the_fallback(self):
+        async def slow_reply(*args):
+            yield "Corner Pharmacy is "
+            await asyncio.sleep(10)
+            yield "never sent"
+
+        with mock.patch("frontline.views.astream_user_facing_agent", slow_reply):
+            events = await self.events(latency=0.5)
+
+        tokens = [data["text"] for event, data in events if event == "token"]
+        self.assertEqual(tokens[0], "Corner Pharmacy is ")
+        self.assertIn("These are the closest places that can help:", tokens[1])
+        done = events[-1][1]
+        self.assertEqual(done["agent_response"], "".join(tokens))
+        self.assertEqual(done["skipped_stages"], ["reply"])
+        stored = await Chat.objects.filter(session_id="s1", sender="agent").values_list("message", flat=True).aget()
+        self.assertEqual(stored, done["agent_response"])
+
+
+class DeadlineTests(TestCase):
+    """chat_flow with LLM calls that outlast the client's latency budget."""
+
+    def setUp(self):
+        classification_cache.clear()
+        HealthFacility.objects.create(x=67.02, y=24.86, department="Hospital", name="City Hospital")
+        rebuild_facility_index()
+        mock.patch("frontline.views.enqueue_summary").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_slow_llm_gets_the_fallback_reply(self):
+        async def never_answers(*args, **kwargs):
+            await asyncio.sleep(30)
+
+        # Not something the local triage tiers are sure about, so classification needs the LLM too
+        with mock.patch("frontline.helpers.Runner.run", never_answers):
+            response = self.client.post("/api/v1/chat/", {
+                "message": "something is not right with my uncle", "session_id": "s1",
+                "latitude": 24.8, "longitude": 67.0, "latency": 1,
+            }, content_type="application/json")
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["skipped_stages"], ["classify", "reply"])
+        self.assertTrue(body["agent_response"].startswith("These are the closest places that can help:"))
+        self.assertIn("City Hospital", body["agent_response"])
+
+    def test_stage_timeouts_come_out_of_what_is_left(self):
+        deadline = Deadline(2.0)
+        self.assertAlmostEqual(deadline.timeout_for("classify"), 0.8, places=2)
+        deadline.started -= 1.9
+        # 0.1 s left is below LATENCY_MIN_STAGE_SECONDS, so the stage is not worth starting
+        self.assertEqual(deadline.timeout_for("reply"), 0)
+        self.assertTrue(deadline.expired)
+        self.assertIsNone(Deadline(None).timeout_for("reply"))
+
+    def test_fallback_reply_puts_emergency_numbers_first(self):
+        reply = fallback_reply([], 1)
+        self.assertTrue(reply.startswith("If this is life-threatening, call Rescue 1122"))
+
+
+class FacilityIndexSyncTests(TestCase):
+    """FacilityIndex built from the database and kept in step with it."""
+
+    def setUp(self):
+        self.hospital = HealthFacility.objects.create(x=67.02, y=24.86, department="Hospital", name="City Hospital")
+        HealthFacility.objects.create(x=67.01, y=24.81, department="Pharmacy", name="Corner Pharmacy",
+                                      opening_hours="24/7", opening_hours_imputed=True)
+        self.index = FacilityIndex.build()
+
+    def names(self, index):
+        return sorted(index.names)
+
+    def test_imputed_hours_are_unknown(self):
+        self.assertEqual(self.names(self.index), ["City Hospital", "Corner Pharmacy"])
+        self.assertEqual(self.index.opening_hours, [None, None])
+        self.assertIsNone(HealthFacility.objects.get(name="Corner Pharmacy").opening_hours_bitmap)
+        self.assertIsNone(FacilityLookup.objects.get(name="Corner Pharmacy").opening_hours)
+        self.assertFalse(self.index.hours_known.any())
+
+    def test_open_facilities_rank_first(self):
+        self.hospital.opening_hours = "Mo-Su 08:00-20:00"
+        self.hospital.save()
+        HealthFacility.objects.create(x=67.2, y=24.9, department="Hospital", name="Night Hospital", opening_hours="24/7")
+        index = FacilityIndex.build()
+        # Monday 03:00: the nearer hospital is closed, the farther one is open all night
+        slot = week_slot(datetime(2024, 1, 1, 3, 0))
+        positions, _ = index.nearest("Hospital", 24.86, 67.02, k=2, open_at=slot, candidates=10)
+        rows = [index.row(position, open_at=slot) for position in positions]
+        self.assertEqual([(row["location_name"], row["open_now"]) for row in rows],
+                         [("Night Hospital", True), ("City Hospital", False)])
+
+    def test_changed_ids_reload_their_partition(self):
+        # A queryset update sends no signal, like a write from db_utils/sync.py
+        FacilityLookup.objects.filter(id=self.hospital.id).update(name="General Hospital")
+        change = FacilityChange.objects.create(facility_id=self.hospital.id, operation=FacilityChange.UPDATE)
+        index = sync_facility_index(self.index)
+        self.assertEqual(self.names(index), ["Corner Pharmacy", "General Hospital"])
+        self.assertEqual(index.change_cursor, change.id)
+
+    def test_orm_writes_are_logged(self):
+        self.hospital.name = "General Hospital"
+        self.hospital.save()
+        HealthFacility.objects.create(x=67.03, y=24.85, department="Hospital", name="Eye Hospital")
+        self.assertEqual(
+            list(FacilityChange.objects.order_by("id").values_list("operation", flat=True))[-2:],
+            [FacilityChange.UPDATE, FacilityChange.INSERT],
+        )
+        index = sync_facility_index(self.index)
+        self.assertEqual(self.names(index), ["Corner Pharmacy", "Eye Hospital", "General Hospital"])
+
+        self.hospital.delete()
+        self.assertEqual(self.names(sync_facility_index(index)), ["Corner Pharmacy", "Eye Hospital"])
+
+    def test_reload_row_rebuilds_everything(self):
+        # A full reload (create_db.refresh_lookup) logs one row without facility ids
+        FacilityLookup.objects.all().delete()
+        FacilityLookup.objects.create(id=99, x=67.0, y=24.9, department="Lab", name="Central Lab")
+        change = FacilityChange.objects.create(facility_id=None, operation=FacilityChange.RELOAD)
+        with mock.patch.object(FacilityIndex, "build", wraps=FacilityIndex.build) as build:
+            index = sync_facility_index(self.index)
+        build.assert_called_once()
+        self.assertEqual(self.names(index), ["Central Lab"])
+        self.assertEqual(index.change_cursor, change.id)
+
+    def test_snapshot_from_before_a_reload_is_rejected(self):
+        path = os.path.join(tempfile.mkdtemp(), "facilities.snap")
+        self.addCleanup(os.remove, path)
+        self.index.save_snapshot(path)
+        with override_settings(FACILITY_SNAPSHOT_PATH=path):
+            self.assertEqual(self.names(_initial_index()), ["City Hospital", "Corner Pharmacy"])
+
+            FacilityLookup.objects.exclude(id=self.hospital.id).delete()
+            FacilityChange.objects.create(facility_id=None, operation=FacilityChange.RELOAD)
+            # Even with the change log pruned, the reload id in the snapshot no longer matches
+            FacilityChange.objects.exclude(operation=FacilityChange.RELOAD).delete()
+            with mock.patch.object(FacilityIndex, "build", wraps=FacilityIndex.build) as build, \
+                    self.assertLogs("frontline.facility_index", "WARNING") as logs:
+                index = _initial_index()
+            build.assert_called_once()
+            self.assertIn("Ignoring snapshot", logs.output[0])
+            self.assertEqual(self.names(index), ["City Hospital"])
+
+
+def random_index(seed, size=2000):
+    """FacilityIndex over ``size`` random facilities around Karachi, in three departments."""
+    rng = np.random.default_rng(seed)
+    departments = rng.choice(["Hospital", "Pharmacy", "Clinic"], size).tolist()
+    return FacilityIndex(
+        np.arange(1, size + 1), rng.uniform(66.6, 67.6, size), rng.uniform(24.6, 25.4, size), departments,
+        [f"Facility {n}" for n in range(size)], departments, [None] * size, [None] * size,
+    )
+
+
+def brute_force_nearest(index, department, lat, lon, k):
+    """(ids, distances) of the k nearest facilities, ranking every one of them."""
+    ranges = [np.arange(*index.partitions[key]) for key in index.matching_partitions(department)]
+    positions = np.concatenate(ranges) if ranges else np.empty(0, dtype=np.int64)
+    dist = haversine_km(lat, lon, index.lat[positions], index.lon[positions])
+    order = np.argsort(dist, kind="stable")[:k]
+    return index.ids[positions[order]], dist[order]
+
+
+class FacilityIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = random_index(seed=1)
+
+    def test_nearest_matches_brute_force(self):
+        rng = np.random.default_rng(2)
+        # Points inside the data, at its edge and well outside it
+        points = zip(rng.uniform(24.0, 26.0, 60), rng.uniform(66.0, 68.2, 60))
+        for lat, lon in points:
+            for department in ("Hospital", "Clinic", GENERAL):
+                for k in (1, 3, 10):
+                    with self.subTest(lat=lat, lon=lon, department=department, k=k):
+                        positions, dist = self.index.nearest(department, lat, lon, k=k)
+                        expected_ids, expected_dist = brute_force_nearest(self.index, department, lat, lon, k)
+                        np.testing.assert_array_equal(self.index.ids[positions], expected_ids)
+                        np.testing.assert_allclose(dist, expected_dist)
+
+    def test_bounding_box_holds_the_circle(self):
+        bearings = np.radians(np.arange(0, 360, 5))
+        for lat, radius_km in ((24.9, 10), (60.0, 300), (-75.0, 800), (89.0, 200)):
+            with self.subTest(lat=lat, radius_km=radius_km):
+                min_lat, max_lat, min_lon, max_lon = bounding_box(lat, 67.0, radius_km)
+                # Destination points at radius_km in every direction
+                angular = radius_km / EARTH_RADIUS_KM
+                lat1, lon1 = np.radians(lat), np.radians(67.0)
+                lats = np.arcsin(np.sin(lat1) * np.cos(angular) + np.cos(lat1) * np.sin(angular) * np.cos(bearings))
+                lons = lon1 + np.arctan2(np.sin(bearings) * np.sin(angular) * np.cos(lat1),
+                                         np.cos(angular) - np.sin(lat1) * np.sin(lats))
+                lats, lons = np.degrees(lats), (np.degrees(lons) + 180) % 360 - 180
+                np.testing.assert_allclose(haversine_km(lat, 67.0, lats, lons), radius_km, rtol=1e-6)
+                self.assertTrue(np.all((lats >= min_lat - 1e-9) & (lats <= max_lat + 1e-9)))
+                self.assertTrue(np.all((lons >= min_lon - 1e-9) & (lons <= max_lon + 1e-9)))
+
+    def test_more_than_the_partition_holds(self):
+        partition = self.index.matching_partitions("Clinic")[0]
+        start, end = self.index.partitions[partition]
+        positions, _ = self.index.nearest("Clinic", 24.9, 67.0, k=end - start + 5)
+        self.assertEqual(len(positions), end - start)
+
+    def test_unknown_department_searches_everything(self):
+        positions, _ = self.index.nearest("Fire Brigade", 24.9, 67.0, k=5)
+        np.testing.assert_array_equal(self.index.ids[positions],
+                                      brute_force_nearest(self.index, GENERAL, 24.9, 67.0, 5)[0])
+
+    def test_within_matches_brute_force(self):
+        for department in ("Pharmacy", GENERAL):
+            with self.subTest(department=department):
+                positions, dist = self.index.within(department, 24.9, 67.1, 8.0)
+                expected_ids, expected_dist = brute_force_nearest(self.index, department, 24.9, 67.1, len(self.index))
+                inside = expected_dist <= 8.0
+                self.assertGreater(inside.sum(), 0)
+                order = np.argsort(dist, kind="stable")
+                np.testing.assert_array_equal(self.index.ids[positions[order]], expected_ids[inside])
+                np.testing.assert_allclose(dist[order], expected_dist[inside])
+
+
+class NearestCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.index = random_index(seed=19)
+        self.cache = NearestCache(max_size=100, precision=6)
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(7)
+        for lat, lon in zip(rng.uniform(24.5, 25.5, 100), rng.uniform(66.5, 67.7, 100)):
+            for department in ("Hospital", GENERAL):
+                expected_ids, expected_dist = brute_force_nearest(self.index, department, lat, lon, 5)
+                positions, dist = self.cache.nearest(self.index, department, lat, lon, k=5)
+                np.testing.assert_array_equal(self.index.ids[positions], expected_ids)
+                np.testing.assert_allclose(dist, expected_dist)
+                # A second point of the same cell is served from the cached candidates
+                positions, _ = self.cache.nearest(self.index, department, lat + 1e-5, lon, k=5)
+                np.testing.assert_array_equal(
+                    self.index.ids[positions], brute_force_nearest(self.index, department, lat + 1e-5, lon, 5)[0],
+                )
+        self.assertGreater(self.cache.stats()["hits"], 0)
+
+    def test_reload_evicts_cached_cells(self):
+        self.cache.nearest(self.index, "Hospital", 24.86, 67.0)
+        self.assertEqual(self.cache.stats()["size"], 1)
+
+        # Same facilities, moved: positions cached for the old index must not be reused
+        reloaded = random_index(seed=20)
+        positions, _ = self.cache.nearest(reloaded, "Hospital", 24.86, 67.0)
+        np.testing.assert_array_equal(
+            reloaded.ids[positions], brute_force_nearest(reloaded, "Hospital", 24.86, 67.0, 3)[0],
+        )
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+        self.assertEqual(self.cache.stats()["size"], 1)
+
+        # A request still holding the old index does not wipe the newer entries
+        self.cache.nearest(self.index, "Hospital", 24.86, 67.0)
+        self.assertEqual(self.cache.stats()["invalidations"], 1)
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "db_utils/sync.py runs against PostgreSQL")
+class SyncTests(TestCase):
+    """db_utils/sync.apply against a hand-filled staging table."""
+
+    def setUp(self):
+        self.sync = db_utils("sync")
+        for osm_id in range(10):
+            HealthFacility.objects.create(x=67.0, y=24.8, osm_type="node", osm_id=osm_id, changeset_version=1,
+                                          department="Clinic", name=f"Clinic {osm_id}")
+        connection.ensure_connection()
+        # sync.apply commits; keep the test transaction open
+        self.conn = mock.Mock(wraps=connection.connection)
+        self.conn.commit = mock.Mock()
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE TEMP TABLE {self.sync.STAGING_TABLE} (LIKE health_facilities)")
+            cursor.execute(f"ALTER TABLE {self.sync.STAGING_TABLE} DROP COLUMN id")
+
+    def stage(self, osm_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {self.sync.STAGING_TABLE} (osm_type, osm_id, changeset_version, department, name, "
+                f"opening_hours_imputed) VALUES ('node', %s, 1, 'Clinic', %s, false)",
+                [[osm_id, f"Clinic {osm_id}"] for osm_id in osm_ids],
+            )
+
+    def test_refuses_to_delete_most_facilities(self):
+        self.stage([0, 1])
+        with self.assertRaisesMessage(ValueError, "sync would delete 8 of 10 facilities"):
+            self.sync.apply(self.conn)
+        self.assertEqual(HealthFacility.objects.count(), 10)
+        self.assertFalse(FacilityChange.objects.filter(operation=FacilityChange.DELETE).exists())
+
+    def test_small_deletions_are_applied_and_logged(self):
+        self.stage(range(9))
+        self.assertEqual(self.sync.apply(self.conn), {"insert": 0, "update": 0, "delete": 1})
+        gone = FacilityChange.objects.filter(operation=FacilityChange.DELETE).values_list("facility_id", flat=True)
+        self.assertEqual(len(gone), 1)
+        self.assertFalse(FacilityLookup.objects.filter(id__in=gone).exists())
+
+    def test_no_delete_skips_the_guard(self):
+        self.stage([0])
+        self.assertEqual(self.sync.apply(self.conn, delete=False), {"insert": 0, "update": 0, "delete": 0})
+        self.assertEqual(HealthFacility.objects.count(), 10)
+
+
+@override_settings(TRIAGE_MODE="single_call")
+class SingleCallTriageTests(TestCase):
+    """chat_flow with TRIAGE_MODE = "single_call" (LLM and summary queue patched out)."""
+
+    def setUp(self):
+        classification_cache.clear()
+        HealthFacility.objects.create(x=67.02, y=24.86, department="Hospital", name="City Hospital")
+        HealthFacility.objects.create(x=67.01, y=24.81, department="Pharmacy", name="Corner Pharmacy")
+        rebuild_facility_index()
+        self.triage = mock.patch("frontline.views.triage_agent", return_value={
+            "department": "Hospital", "emergency_level": 2, "answer": "City Hospital is 7 km away.", "source": "llm",
+        }).start()
+        self.reply = mock.patch("frontline.views.user_facing_agent", return_value="Corner Pharmacy is 1 km away.").start()
+        mock.patch("frontline.views.enqueue_summary").start()
+        self.addCleanup(mock.patch.stopall)
+
+    def turn(self, message):
+        response = self.client.post("/api/v1/chat/", {
+            "message": message, "session_id": "s1", "latitude": 24.8, "longitude": 67.0,
+        }, content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["agent_response"]
+
+    def test_one_llm_call_classifies_and_replies(self):
+        self.assertEqual(self.turn("my chest feels strange since this morning"), "City Hospital is 7 km away.")
+        self.reply.assert_not_called()
+        facilities = self.triage.call_args.args[4]
+        self.assertEqual([f["location_name"] for f in facilities["Hospital"]], ["City Hospital"])
+        self.assertEqual([f["location_name"] for f in facilities["Pharmacy"]], ["Corner Pharmacy"])
+
+    def test_known_department_keeps_the_reply_call(self):
+        # Answered by the local triage rules, so the reply is the only LLM call either way
+        self.assertEqual(self.turn("where is the nearest pharmacy"), "Corner Pharmacy is 1 km away.")
+        self.triage.assert_not_called()
+
+    def test_off_list_classification_keeps_the_reply(self):
+        answer = '{"department": "Fire Brigade", "emergency_level": 1, "answer": "Call 1122 now."}'
+        result = _parse_triage("my kitchen is on fire", answer, {})
+        self.assertEqual(result["answer"], "Call 1122 now.")
+        self.assertEqual(result["source"], "fallback")
+        self.assertIsNone(classification_cache.get("my kitchen is on fire"))
+
+
+@unittest.skipUnless(connection.vendor == "postgresql", "query plans are checked against PostgreSQL")
+class QueryPlanTests(TestCase):
+    """
+    EXPLAIN the per-turn queries against seeded session tables and fail when
+    one of them reads a whole table or sorts instead of walking an index.
+
+    QUERY_PLAN_ROWS sets how many chat rows are seeded (10 per session).
+    """
+
+    ROWS = int(os.getenv("QUERY_PLAN_ROWS", "200000"))
+    TABLES = {Chat._meta.db_table, Summary._meta.db_table, WantAppointment._meta.db_table,
+              FacilityChange._meta.db_table}
+
+    @classmethod
+    def setUpTestData(cls):
+        sessions = max(cls.ROWS // 10, 1)
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {Chat._meta.db_table} (message, sender, topic, session_id, created_at)
+                SELECT 'message ' || n, CASE WHEN n % 2 = 0 THEN 'user' ELSE 'agent' END, NULL,
+                       'session-' || (n % {sessions}), now() - n * interval '1 second'
+                FROM generate_series(1, {cls.ROWS}) AS n
+            """)
+            cursor.execute(f"""
+                INSERT INTO {Summary._meta.db_table} (summary_text, session_id, wants_appointment, created_at)
+                SELECT 'summary ' || n, 'session-' || n, n % 7 = 0, now()
+                FROM generate_series(0, {sessions - 1}) AS n
+            """)
+            cursor.execute(f"""
+                INSERT INTO {WantAppointment._meta.db_table} (session_id, wants_appointment)
+                SELECT 'session-' || n, n % 3 = 0 FROM generate_series(0, {sessions - 1}) AS n
+            """)
+            cursor.execute(f"""
+                INSERT INTO {FacilityChange._meta.db_table} (facility_id, operation, created_at)
+                SELECT n, 'update', now() FROM generate_series(1, {sessions}) AS n
+            """)
+            for table in cls.TABLES:
+                cursor.execute(f"ANALYZE {table}")
+
+    def assertIndexedPlan(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        nodes = [plan[0]["Plan"]]
+        while nodes:
+            node = nodes.pop()
+            nodes.extend(node.get("Plans", []))
+            self.assertFalse(
+                node["Node Type"] == "Seq Scan" and node.get("Relation Name") in self.TABLES,
+                f"sequential scan on {node.get('Relation Name')}:\n{json.dumps(plan, indent=2)}",
+            )
+            self.assertNotIn(node["Node Type"], ("Sort", "Incremental Sort"), json.dumps(plan, indent=2))
+
+    def test_session_state(self):
+        self.assertIndexedPlan(_state_query(), ["session-42"] * 3)
+
+    def test_last_five_messages(self):
+        self.assertIndexedPlan(*get_last_five_messages("session-42").query.sql_with_params())
+
+    def test_summary_lookup(self):
+        self.assertIndexedPlan(*Summary.objects.filter(session_id="session-42")[:1].query.sql_with_params())
+
+    def test_summary_upsert(self):
+        table = Summary._meta.db_table
+        self.assertIndexedPlan(
+            f"INSERT INTO {table} (summary_text, session_id, wants_appointment, created_at) "
+            f"VALUES (%s, %s, false, now()) ON CONFLICT (session_id) DO UPDATE "
+            f"SET summary_text = EXCLUDED.summary_text, wants_appointment = EXCLUDED.wants_appointment",
+            ["updated", "session-42"],
+        )
+
+    def test_facility_change_poll(self):
+        # A process that is a few changes behind
+        cursor = FacilityChange.objects.order_by("-id").values_list("id", flat=True)[50]
+        query = FacilityChange.objects.filter(id__gt=cursor).order_by("id").values_list("id", "facility_id", "operation")[:5001]
+        self.assertIndexedPlan(*query.query.sql_with_params())
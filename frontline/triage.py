@@ -0,0 +1,221 @@
+"""
+Local emergency classifier that runs before classify_emergency_agent.
+
+Two tiers answer without a network round trip:
+
+1. A keyword/regex rule table for unambiguous requests ("nearest police
+   station", "need a pharmacy").
+2. A linear model over hashed word and character n-grams, trained offline
+   on logged user messages labelled by the LLM (manage.py train_triage_model)
+   and stored as a NumPy .npz file.
+
+Each tier returns a confidence; below LOCAL_TRIAGE_THRESHOLD the caller falls
+back to the LLM. manage.py evaluate_triage_model reports agreement with it.
+"""
+import re
+import threading
+import zlib
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .departments import DEPARTMENTS
+
+EMERGENCY_LEVELS = (1, 2, 3, 4, 5)
+
+# Signs of a life-threatening emergency, in any inflection ("collapsed", "overdosed")
+CRITICAL_TERMS = (
+    r"not breathing|can'?t breathe|unconscious|unresponsive|heart attack|chest pain|stroke|seizure\w*|"
+    r"bleed\w*|overdos\w*|poison\w*|severe burn\w*|accident|collaps\w*|faint\w*|suicid\w*"
+)
+# Any of these in a message keeps the level 4-5 rules from answering it locally
+_URGENT = re.compile(rf"\b({CRITICAL_TERMS}|urgent\w*|emergenc\w*|severe\w*|dying|burn\w*|blood)\b")
+
+# (pattern, department, emergency_level, confidence)
+RULES = [
+    (r"\b(police (post|chowki)|chowki)\b", "Police post", 3, 0.95),
+    (r"\b(police(?! (post|chowki))|thana|robbery|robbed|theft|stolen|snatch\w*|mugged|kidnap\w*|harass\w*)\b",
+     "Police Station", 2, 0.9),
+    (rf"\b({CRITICAL_TERMS})\b", "Hospital", 1, 0.9),
+    (r"\b(hospital|emergency room|ambulance)\b", "Hospital", 2, 0.85),
+    (r"\b(pharmacy|pharmacies|chemist|medical store|medicine|medicines|prescription)\b", "Pharmacy", 4, 0.9),
+    (r"\b(dentist|dental|tooth|teeth|toothache|gums?)\b", "Dentist", 4, 0.9),
+    (r"\b(clinic|vaccination|vaccine|dressing)\b", "Clinic", 4, 0.85),
+    (r"\b(doctor|doctors|gp|check ?up|consultation)\b", "Doctors", 4, 0.85),
+]
+_COMPILED_RULES = [(re.compile(pattern), department, level, confidence) for pattern, department, level, confidence in RULES]
+
+
+def classify_by_rules(message):
+    """
+    Rule-table classification.
+
+    Returns:
+        dict | None: department, emergency_level and confidence, or None when no rule
+        matches or matching rules disagree on the department. A level 4-5 answer
+        to a message with an urgency word anywhere in it ("not bleeding, just need
+        a pharmacy" included) gets confidence 0, so only a fallback uses it.
+    """
+    text = str(message).casefold()
+    matches = [(department, level, confidence) for pattern, department, level, confidence in _COMPILED_RULES
+               if pattern.search(text)]
+    if not matches or len({department for department, _, _ in matches}) > 1:
+        return None
+    level = min(level for _, level, _ in matches)
+    confidence = max(confidence for _, _, confidence in matches)
+    if level >= 4 and is_urgent(text):
+        confidence = 0.0
+    return {"department": matches[0][0], "emergency_level": level, "confidence": confidence}
+
+
+def is_urgent(message):
+    """True when the message contains a word that may signal an emergency."""
+    return _URGENT.search(str(message).casefold()) is not None
+
+
+_WORD = re.compile(r"\w+")
+
+
+def hashed_features(message, n_features):
+    """Bucket indices of the word unigrams/bigrams and character trigrams of the message."""
+    text = " ".join(_WORD.findall(str(message).casefold()))
+    words = text.split()
+    grams = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    padded = f" {text} "
+    grams += [f"#{padded[i:i + 3]}" for i in range(len(padded) - 2)]
+    if not grams:
+        return np.zeros(0, dtype=np.int64)
+    return np.array([zlib.crc32(gram.encode("utf-8")) % n_features for gram in grams], dtype=np.int64)
+
+
+def _softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    exp = np.exp(logits)
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class HashedNgramModel:
+    """Two softmax heads (department, emergency level) over shared hashed n-gram features."""
+
+    def __init__(self, n_features=1 << 15):
+        self.n_features = n_features
+        self.weights = {
+            "department": np.zeros((n_features, len(DEPARTMENTS))),
+            "emergency_level": np.zeros((n_features, len(EMERGENCY_LEVELS))),
+        }
+        self.biases = {head: np.zeros(w.shape[1]) for head, w in self.weights.items()}
+
+    def _logits(self, head, features):
+        weights = self.weights[head]
+        return weights[features].sum(axis=0) / max(len(features), 1) ** 0.5 + self.biases[head]
+
+    def predict(self, message):
+        features = hashed_features(message, self.n_features)
+        department = _softmax(self._logits("department", features))
+        level = _softmax(self._logits("emergency_level", features))
+        return {
+            "department": DEPARTMENTS[int(department.argmax())],
+            "emergency_level": EMERGENCY_LEVELS[int(level.argmax())],
+            "confidence": float(min(department.max(), level.max())),
+        }
+
+    def fit(self, messages, labels, epochs=20, learning_rate=0.5, l2=1e-5, batch_size=64, seed=0):
+        """
+        Mini-batch gradient descent on the cross-entropy of both heads.
+
+        Args:
+            messages: User messages
+            labels: One dict per message with department and emergency_level
+        """
+        samples = [hashed_features(m, self.n_features) for m in messages]
+        targets = {
+            "department": np.array([DEPARTMENTS.index(l["department"]) for l in labels]),
+            "emergency_level": np.array([EMERGENCY_LEVELS.index(int(l["emergency_level"])) for l in labels]),
+        }
+        rng = np.random.default_rng(seed)
+        for _ in range(epochs):
+            order = rng.permutation(len(samples))
+            for start in range(0, len(order), batch_size):
+                batch = order[start:start + batch_size]
+                features = [samples[i] for i in batch]
+                counts = np.array([len(f) for f in features])
+                flat = np.concatenate(features)
+                scale = np.repeat(1 / np.maximum(counts, 1) ** 0.5, counts)
+                offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+                for head, weights in self.weights.items():
+                    rows = np.zeros((len(batch), weights.shape[1]))
+                    nonempty = counts > 0
+                    rows[nonempty] = np.add.reduceat(weights[flat] * scale[:, None], offsets[nonempty], axis=0)
+                    probs = _softmax(rows + self.biases[head])
+                    probs[np.arange(len(batch)), targets[head][batch]] -= 1
+                    probs /= len(batch)
+                    gradient = np.zeros_like(weights)
+                    np.add.at(gradient, flat, np.repeat(probs, counts, axis=0) * scale[:, None])
+                    weights -= learning_rate * (gradient + l2 * weights)
+                    self.biases[head] -= learning_rate * probs.sum(axis=0)
+        return self
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            n_features=self.n_features,
+            department_weights=self.weights["department"],
+            department_bias=self.biases["department"],
+            level_weights=self.weights["emergency_level"],
+            level_bias=self.biases["emergency_level"],
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        model = cls(int(data["n_features"]))
+        model.weights = {"department": data["department_weights"], "emergency_level": data["level_weights"]}
+        model.biases = {"department": data["department_bias"], "emergency_level": data["level_bias"]}
+        return model
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_triage_model():
+    """The trained model from LOCAL_TRIAGE_MODEL_PATH, or None if it has not been trained yet."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            path = Path(settings.LOCAL_TRIAGE_MODEL_PATH)
+            if _model is None and path.exists():
+                _model = HashedNgramModel.load(path)
+    return _model
+
+
+def classify_locally(message, threshold=None):
+    """
+    Classify without calling the LLM.
+
+    Returns:
+        dict | None: department, emergency_level, confidence and source ("rules" or
+        "model"), or None when neither tier reaches the threshold
+    """
+    if threshold is None:
+        threshold = settings.LOCAL_TRIAGE_THRESHOLD
+
+    result = classify_by_rules(message)
+    if result and result["confidence"] >= threshold:
+        return dict(result, source="rules")
+
+    model = get_triage_model()
+    if model is not None:
+        result = model.predict(message)
+        if result["emergency_level"] >= 4 and is_urgent(message):
+            # Same rule as the table: a possible emergency is never played down locally
+            result = dict(result, confidence=0.0)
+        if result["confidence"] >= threshold:
+            return dict(result, source="model")
+    return None
+
+
+def is_holdout(message):
+    """Deterministic 20% split used to keep evaluation messages out of training."""
+    return zlib.crc32(str(message).encode("utf-8")) % 5 == 0
@@ -0,0 +1,90 @@
+"""
+Optional write-behind buffer for chat turns (CHAT_WRITE_BEHIND).
+
+With it enabled, views hand the turn's Chat rows to a flusher thread and
+return without touching the database. The flusher waits up to
+CHAT_WRITE_BEHIND_INTERVAL for more turns and writes everything it has
+with one bulk INSERT and one commit, so under load many turns share a
+commit while a lone turn is written after at most one interval. The
+session state cache is updated immediately, so with the cache on
+(SESSION_STATE_CACHE_TTL) the next turn of the same session still sees the
+messages; with it off, a turn that follows within one interval may be
+answered without the previous one in its history.
+
+Turns that book an appointment are always committed synchronously, so a
+bad date is still reported to the user.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .helpers import chat_rows, commit_turn
+from .models import Chat
+from .session_state import session_states
+
+logger = logging.getLogger(__name__)
+
+
+class TurnBuffer:
+    def __init__(self, batch_size, interval):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._rows = []
+        self._flushing = False
+        self._thread = None
+
+    def submit(self, chats):
+        with self._cond:
+            self._start()
+            self._rows.extend(chats)
+            self._cond.notify_all()
+
+    def drain(self, timeout=None):
+        """Block until every submitted row has been written."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._rows and not self._flushing, timeout)
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="turn-buffer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._rows)
+                # Let concurrent turns join the batch
+                deadline = time.monotonic() + self.interval
+                while len(self._rows) < self.batch_size and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+                batch, self._rows = self._rows[:self.batch_size], self._rows[self.batch_size:]
+                self._flushing = True
+            try:
+                with transaction.atomic():
+                    Chat.objects.bulk_create(batch)
+            except Exception:
+                logger.exception("Writing %d chat rows failed", len(batch))
+            finally:
+                close_old_connections()
+                with self._cond:
+                    self._flushing = False
+                    self._cond.notify_all()
+
+
+turn_buffer = TurnBuffer(settings.CHAT_WRITE_BEHIND_BATCH, settings.CHAT_WRITE_BEHIND_INTERVAL)
+atexit.register(turn_buffer.drain, 5)
+
+
+def record_turn(session_id, user_message, agent_response, appointment=None):
+    """Persist a chat turn, through the write-behind buffer when it is enabled."""
+    if not settings.CHAT_WRITE_BEHIND or appointment:
+        return commit_turn(session_id, user_message, agent_response, appointment)
+    chats = chat_rows(session_id, user_message, agent_response)
+    session_states.record_messages(session_id, chats)
+    turn_buffer.submit(chats)
+    return chats
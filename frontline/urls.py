@@ -2,5 +2,8 @@ from django.urls import path, include
 from . import views
 
 urlpatterns = [
-    path('temp/', views.temp),
-]
\ No newline at end of file
+    path('chat/', views.chat_flow),
+    path('chat/async/', views.chat_flow_async),
+    path('chat/stream/', views.chat_flow_stream),
+    path('metrics', views.metrics),
+]
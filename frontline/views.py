@@ -1,9 +1,27 @@
+import asyncio
+import hmac
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .models import Summary
-from django.db import transaction
-from .helpers import wants_appointment, get_closest_matching_department, classify_emergency_agent, user_facing_agent, appointment_agent, create_appointment, save_chat_messages, summarizing_agent, get_last_five_messages
+from .helpers import (
+    get_closest_matching_department, classify_emergency, user_facing_agent, appointment_agent,
+    aclassify_emergency, auser_facing_agent, aappointment_agent, astream_user_facing_agent, clean_response,
+    fallback_classification, fallback_reply, APPOINTMENT_TIMEOUT_REPLY, classify_without_llm, prefetch_facilities,
+    facilities_for, triage_agent, atriage_agent,
+)
+from .deadline import Deadline
+from .metrics import render as render_metrics, stage
+from .session_state import load_session_state
+from .summary_queue import enqueue_summary
+from .turn_buffer import record_turn
+
 
 # Create your views here.
 @api_view(["POST"])
@@ -12,52 +30,369 @@ def chat_flow(request):
     session_id = request.data.get("session_id")  # boolean flag
     latitude = request.data.get("latitude")  # assuming per-user tracking
     longitude = request.data.get("longitude")  # assuming per-user tracking
-    latency = request.data.get("latency")  # network latency in ms
+    latency = request.data.get("latency")  # seconds the client is willing to wait
     coordinates = (latitude, longitude) if latitude and longitude else None
-    
+
     if not user_message:
         return Response({"error": "message is required"}, status=400)
-    
-    # wants_appointment is a boolean flag
-    appointment = wants_appointment(session_id)
 
-    messages = get_last_five_messages(session_id)
-    summary = Summary.objects.filter(session_id=session_id).order_by('-created_at').first()
+    deadline = Deadline.from_latency(latency)
+
+    # Appointment flag, summary and last messages in one round trip (or none, when cached)
+    with stage("session_state"):
+        state = load_session_state(session_id)
+    appointment, messages, summary = state.wants_appointment, state.messages, state.summary
 
-    if appointment == False:
+    booking = None
+    if not appointment and settings.TRIAGE_MODE == "single_call":
+        response = _triage_turn(deadline, latency, user_message, summary, messages, coordinates)
+    else:
         #Classify department
-        emergency_result = classify_emergency_agent(latency, user_message)
+        with stage("classify"):
+            try:
+                emergency_result = classify_emergency(latency, user_message, deadline.timeout_for("classify"))
+            except TimeoutError:
+                deadline.skip("classify")
+                emergency_result = fallback_classification(user_message)
         # Get closest department
-        closest_departments = get_closest_matching_department(coordinates, emergency_result.get("department"))
-        
-        response = user_facing_agent(latency, user_message, summary, messages, closest_departments, emergency_result.get("emergency_level"))
-        
-    else:
-        # Step 5: Handle appointment booking flow
-        # appointment agent
-        info = appointment_agent(latency, user_message, summary, messages, closest_departments)
-        response = info.get("answer")
-        #
-        # check if all details present (placeholder)
-        if info.get("all_fields_collected"):
-            with transaction.atomic():
-                appointment = create_appointment(
-                    session_id=session_id,
-                    department_id=info.get("chosen_department_id"),
-                    date=info.get("appointment_date"),
-                    time=info.get("appointment_time"),
-                    first_name=info.get("first_name"),
-                    last_name=info.get("last_name"),
-                    email=info.get("email"),
-                )
-    
-    #  store the agent's response and user's message in chat table
-    save_chat_messages(session_id, user_message, response)
-    
+        with stage("facilities"):
+            closest_departments = get_closest_matching_department(coordinates, emergency_result.get("department"),
+                                                                  emergency_result.get("emergency_level"))
+
+        if not appointment:
+            response = _reply(deadline, latency, user_message, summary, messages, closest_departments,
+                              emergency_result.get("emergency_level"))
+
+        else:
+            # Step 5: Handle appointment booking flow
+            # appointment agent
+            with stage("appointment"):
+                try:
+                    info = appointment_agent(latency, user_message, summary, messages, closest_departments,
+                                             deadline.timeout_for("appointment"))
+                except TimeoutError:
+                    deadline.skip("appointment")
+                    info = {"answer": APPOINTMENT_TIMEOUT_REPLY, "all_fields_collected": False}
+            response = info.get("answer")
+            booking = _booking(info)
+
+    #  store the agent's response and user's message in chat table, with the appointment if one was booked
+    with stage("persist"):
+        record_turn(session_id, user_message, response, booking)
+
     # Store the summary of the conversation so far in summary table in background
-    summarizing_agent(latency, user_message, summary, session_id)
+    enqueue_summary(session_id, latency, user_message)
 
     # Step 6: Return agent response
     return Response({
-        "agent_response": response
-    })
\ No newline at end of file
+        "agent_response": response,
+        "skipped_stages": deadline.skipped,
+    })
+
+
+def _reply(deadline, latency, message, summary, messages, departments, emergency_level):
+    with stage("reply"):
+        try:
+            return user_facing_agent(latency, message, summary, messages, departments, emergency_level,
+                                     deadline.timeout_for("reply"))
+        except TimeoutError:
+            deadline.skip("reply")
+            return fallback_reply(departments, emergency_level)
+
+
+def _triage_turn(deadline, latency, message, summary, messages, coordinates):
+    """
+    Reply to a non-appointment turn with TRIAGE_MODE = "single_call".
+
+    Facilities are looked up for every department first, then one LLM call
+    classifies the message and writes the reply. When the local triage
+    tiers or the classification cache already know the department, the
+    reply is the only LLM call anyway, so the usual path is taken.
+    """
+    with stage("classify"):
+        emergency_result = classify_without_llm(message)
+    if emergency_result is not None:
+        with stage("facilities"):
+            departments = get_closest_matching_department(coordinates, emergency_result.get("department"),
+                                                          emergency_result.get("emergency_level"))
+        return _reply(deadline, latency, message, summary, messages, departments,
+                      emergency_result.get("emergency_level"))
+
+    with stage("facilities"):
+        facilities = prefetch_facilities(coordinates)
+    with stage("triage"):
+        try:
+            return triage_agent(latency, message, summary, messages, facilities,
+                                deadline.timeout_for("triage"))["answer"]
+        except TimeoutError:
+            deadline.skip("triage")
+            emergency_result = fallback_classification(message)
+            return fallback_reply(facilities_for(facilities, emergency_result["department"]),
+                                  emergency_result["emergency_level"])
+
+
+def _booking(info):
+    """create_appointment arguments once the appointment agent has collected every field, else None."""
+    if not info.get("all_fields_collected"):
+        return None
+    return {
+        "chosen_department_id": info.get("chosen_department_id"),
+        "date_str": info.get("appointment_date"),
+        "time_str": info.get("appointment_time"),
+        "first_name": info.get("first_name"),
+        "last_name": info.get("last_name"),
+        "email": info.get("email"),
+    }
+
+
+@csrf_exempt
+@require_POST
+async def chat_flow_async(request):
+    """
+    Async chat_flow for ASGI deployments (frontline_worker.asgi).
+
+    Session reads and the emergency classification do not depend on each
+    other, so they run concurrently; the summary is left to the background
+    summary queue. With TRIAGE_MODE = "single_call" the session is read
+    first, since a non-appointment turn then needs no separate classification.
+    """
+    data, error = _read_chat_request(request)
+    if error:
+        return error
+    user_message, session_id, latency = data["message"], data["session_id"], data["latency"]
+    deadline = Deadline.from_latency(latency)
+
+    state = await _aload_state(session_id) if settings.TRIAGE_MODE == "single_call" else None
+
+    booking = None
+    if state is not None and not state.wants_appointment:
+        response = await _atriage_turn(deadline, latency, user_message, state.summary, state.messages,
+                                       data["coordinates"])
+    else:
+        appointment, messages, summary, emergency_result, closest_departments = await _aload_turn(
+            data, deadline, state
+        )
+        if not appointment:
+            response = await _areply(deadline, latency, user_message, summary, messages, closest_departments,
+                                     emergency_result.get("emergency_level"))
+        else:
+            info = await _aappointment(deadline, latency, user_message, summary, messages, closest_departments)
+            response = info.get("answer")
+            booking = _booking(info)
+
+    with stage("persist"):
+        await sync_to_async(record_turn)(session_id, user_message, response, booking)
+
+    enqueue_summary(session_id, latency, user_message)
+
+    return JsonResponse({
+        "agent_response": response,
+        "skipped_stages": deadline.skipped,
+    })
+
+
+def _read_chat_request(request):
+    """
+    Parse the JSON body of an async chat request.
+
+    Returns:
+        tuple: (data, None) on success, (None, JsonResponse) on a bad request
+    """
+    try:
+        data = json.loads(request.body or b"{}")
+    except json.JSONDecodeError:
+        return None, JsonResponse({"error": "invalid JSON body"}, status=400)
+    if not isinstance(data, dict):
+        return None, JsonResponse({"error": "expected a JSON object"}, status=400)
+
+    if not data.get("message"):
+        return None, JsonResponse({"error": "message is required"}, status=400)
+
+    latitude = data.get("latitude")
+    longitude = data.get("longitude")
+    return {
+        "message": data.get("message"),
+        "session_id": data.get("session_id"),
+        "latency": data.get("latency"),
+        "coordinates": (latitude, longitude) if latitude and longitude else None,
+    }, None
+
+
+async def _aload_state(session_id):
+    with stage("session_state"):
+        return await sync_to_async(load_session_state)(session_id)
+
+
+async def _aclassify(deadline, latency, message):
+    with stage("classify"):
+        try:
+            return await aclassify_emergency(latency, message, deadline.timeout_for("classify"))
+        except TimeoutError:
+            deadline.skip("classify")
+            return fallback_classification(message)
+
+
+async def _areply(deadline, latency, message, summary, messages, departments, emergency_level):
+    with stage("reply"):
+        try:
+            return await auser_facing_agent(latency, message, summary, messages, departments, emergency_level,
+                                            deadline.timeout_for("reply"))
+        except TimeoutError:
+            deadline.skip("reply")
+            return fallback_reply(departments, emergency_level)
+
+
+async def _atriage_turn(deadline, latency, message, summary, messages, coordinates):
+    """Async variant of _triage_turn."""
+    with stage("classify"):
+        emergency_result = classify_without_llm(message)
+    if emergency_result is not None:
+        with stage("facilities"):
+            departments = await sync_to_async(get_closest_matching_department)(
+                coordinates, emergency_result.get("department"), emergency_result.get("emergency_level")
+            )
+        return await _areply(deadline, latency, message, summary, messages, departments,
+                             emergency_result.get("emergency_level"))
+
+    with stage("facilities"):
+        facilities = await sync_to_async(prefetch_facilities)(coordinates)
+    with stage("triage"):
+        try:
+            result = await atriage_agent(latency, message, summary, messages, facilities,
+                                         deadline.timeout_for("triage"))
+            return result["answer"]
+        except TimeoutError:
+            deadline.skip("triage")
+            emergency_result = fallback_classification(message)
+            return fallback_reply(facilities_for(facilities, emergency_result["department"]),
+                                  emergency_result["emergency_level"])
+
+
+async def _aappointment(deadline, latency, message, summary, messages, departments):
+    with stage("appointment"):
+        try:
+            return await aappointment_agent(latency, message, summary, messages, departments,
+                                            deadline.timeout_for("appointment"))
+        except TimeoutError:
+            deadline.skip("appointment")
+            return {"answer": APPOINTMENT_TIMEOUT_REPLY, "all_fields_collected": False}
+
+
+async def _aload_turn(data, deadline, state=None):
+    """
+    Load session state (unless already loaded) and classify the message concurrently, then find the
+    nearby facilities.
+
+    Returns:
+        tuple: (appointment, messages, summary, emergency_result, closest_departments)
+    """
+    if state is None:
+        state, emergency_result = await asyncio.gather(
+            _aload_state(data["session_id"]),
+            _aclassify(deadline, data["latency"], data["message"]),
+        )
+    else:
+        emergency_result = await _aclassify(deadline, data["latency"], data["message"])
+    appointment, messages, summary = state.wants_appointment, state.messages, state.summary
+    with stage("facilities"):
+        closest_departments = await sync_to_async(get_closest_matching_department)(
+            data["coordinates"], emergency_result.get("department"), emergency_result.get("emergency_level")
+        )
+    return appointment, messages, summary, emergency_result, closest_departments
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@csrf_exempt
+@require_POST
+async def chat_flow_stream(request):
+    """
+    Streaming chat_flow over Server-Sent Events.
+
+    Events, in order: ``facilities`` (classification and nearby facilities,
+    sent before any LLM output), ``token`` (one per reply delta) and
+    ``done`` (the full reply, after it has been saved). When the latency
+    budget runs out mid-reply the LLM stream stops there and the templated
+    fallback reply is sent as a last token, so the user still gets the
+    nearby facilities; the saved reply is exactly the text the user saw.
+    """
+    data, error = _read_chat_request(request)
+    if error:
+        return error
+    user_message, session_id, latency = data["message"], data["session_id"], data["latency"]
+    deadline = Deadline.from_latency(latency)
+
+    async def events():
+        # Flush headers straight away; the first real event needs the classification
+        yield ": stream open\n\n"
+
+        appointment, messages, summary, emergency_result, closest_departments = await _aload_turn(data, deadline)
+        yield _sse("facilities", {
+            "department": emergency_result.get("department"),
+            "emergency_level": emergency_result.get("emergency_level"),
+            "departments": closest_departments,
+        })
+
+        booking = None
+        if not appointment:
+            parts = []
+            stream = astream_user_facing_agent(
+                latency, user_message, summary, messages, closest_departments, emergency_result.get("emergency_level")
+            )
+            cut_short = False
+            try:
+                while True:
+                    # Bound each wait rather than the whole loop, so the timeout never fires while suspended at yield
+                    timeout = deadline.timeout_for("reply")
+                    if timeout == 0:
+                        raise TimeoutError
+                    delta = await asyncio.wait_for(anext(stream), timeout)
+                    parts.append(delta)
+                    yield _sse("token", {"text": delta})
+            except StopAsyncIteration:
+                pass
+            except TimeoutError:
+                deadline.skip("reply")
+                await stream.aclose()
+                cut_short = True
+            # Store exactly what the user saw
+            response = "".join(parts)
+            if cut_short or not response.strip():
+                fallback = fallback_reply(closest_departments, emergency_result.get("emergency_level"))
+                fallback = f"\n\n{fallback}" if response.strip() else fallback
+                yield _sse("token", {"text": fallback})
+                response += fallback
+        else:
+            info = await _aappointment(deadline, latency, user_message, summary, messages, closest_departments)
+            response = info.get("answer")
+            booking = _booking(info)
+            yield _sse("token", {"text": response})
+
+        with stage("persist"):
+            await sync_to_async(record_turn)(session_id, user_message, response, booking)
+        enqueue_summary(session_id, latency, user_message)
+        yield _sse("done", {"agent_response": response, "skipped_stages": deadline.skipped})
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def _may_scrape(request):
+    """Whether the client is in METRICS_ALLOWED_IPS or sends the METRICS_TOKEN bearer token."""
+    if request.META.get("REMOTE_ADDR") in settings.METRICS_ALLOWED_IPS:
+        return True
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return bool(settings.METRICS_TOKEN) and scheme.lower() == "bearer" and hmac.compare_digest(
+        token.strip().encode(), settings.METRICS_TOKEN.encode()
+    )
+
+
+def metrics(request):
+    """Prometheus text exposition of this process's metrics (frontline.metrics)."""
+    if not _may_scrape(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'frontline_worker.settings')
+# Without DB_POOL, ASGI gets a connection per request (see frontline_worker/database.py)
+os.environ.setdefault('SERVER_INTERFACE', 'asgi')
 
 application = get_asgi_application()
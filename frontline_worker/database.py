@@ -0,0 +1,81 @@
+"""
+PostgreSQL connection settings shared by the Django app (DATABASES) and
+the db_utils loaders, read from the environment.
+
+DB_POOL chooses how the app holds on to connections:
+
+- ``persistent`` (default under WSGI): every worker thread keeps its connection for
+  DB_CONN_MAX_AGE seconds and checks it still works before reusing it in
+  a new request (CONN_HEALTH_CHECKS), so a request no longer pays for a
+  TCP and auth handshake.
+- ``pool``: Django's native pool, DB_POOL_MIN_SIZE to DB_POOL_MAX_SIZE
+  connections per process shared by all threads; needs psycopg 3 with
+  psycopg_pool (``pip install "psycopg[binary,pool]"``). Use it when a
+  process runs more threads than the database should see connections
+  (ASGI, gthread workers).
+- ``none`` (default under ASGI): a new connection per request.
+
+Django advises against persistent connections under ASGI, where async
+code reaches the database from threads that do not see the end of a
+request and so never close or recycle their connection. asgi.py sets
+SERVER_INTERFACE=asgi, which makes ``none`` the default there; set
+DB_POOL=pool to share connections between requests under ASGI instead.
+
+This module is kept free of Django imports so db_utils can use it too.
+"""
+import importlib.util
+import os
+
+POOL_MODES = ("persistent", "pool", "none")
+
+
+def pool_mode():
+    default = "none" if os.getenv("SERVER_INTERFACE") == "asgi" else "persistent"
+    mode = os.getenv("DB_POOL", default).lower()
+    if mode not in POOL_MODES:
+        raise ValueError(f"DB_POOL must be one of {', '.join(POOL_MODES)}, not {mode!r}")
+    return mode
+
+
+def connection_params():
+    """libpq connection parameters, as keyword arguments for psycopg2.connect / psycopg.connect."""
+    return {
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT") or 5432,
+        "dbname": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "10")),
+        # Detect connections dropped by a NAT or load balancer instead of hanging on them
+        "keepalives": 1,
+        "keepalives_idle": int(os.getenv("DB_KEEPALIVES_IDLE", "60")),
+    }
+
+
+def django_database(mode=None):
+    """DATABASES['default'] for ``mode`` (DB_POOL by default)."""
+    mode = mode or pool_mode()
+    params = connection_params()
+    database = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": params.pop("dbname"),
+        "USER": params.pop("user"),
+        "PASSWORD": params.pop("password"),
+        "HOST": params.pop("host"),
+        "PORT": params.pop("port"),
+        "OPTIONS": params,
+        "CONN_MAX_AGE": 0,
+        "CONN_HEALTH_CHECKS": False,
+    }
+    if mode == "persistent":
+        database["CONN_MAX_AGE"] = int(os.getenv("DB_CONN_MAX_AGE", "600"))
+        database["CONN_HEALTH_CHECKS"] = True
+    elif mode == "pool":
+        if importlib.util.find_spec("psycopg") is None or importlib.util.find_spec("psycopg_pool") is None:
+            raise ValueError('DB_POOL=pool needs psycopg 3 and psycopg_pool: pip install "psycopg[binary,pool]"')
+        database["OPTIONS"]["pool"] = {
+            "min_size": int(os.getenv("DB_POOL_MIN_SIZE", "2")),
+            "max_size": int(os.getenv("DB_POOL_MAX_SIZE", "10")),
+            "timeout": float(os.getenv("DB_POOL_TIMEOUT", "10")),
+        }
+    return database
@@ -13,6 +13,9 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 import os
 from dotenv import load_dotenv
+from django.core.exceptions import ImproperlyConfigured
+
+from .database import django_database
 
 load_dotenv()
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +48,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'frontline.metrics.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,16 +80,159 @@ WSGI_APPLICATION = 'frontline_worker.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': os.getenv("DB_NAME"),
-        'USER': os.getenv("DB_USER"),
-        'PASSWORD': os.getenv("DB_PASSWORD"),
-        'HOST': os.getenv("DB_HOST"),
-        'PORT': os.getenv("DB_PORT"),
+# Connection parameters and the pooling mode (DB_POOL: persistent, pool or none) come from
+# the environment and are shared with db_utils (frontline_worker.database). DB_POOL defaults
+# to persistent under WSGI and to none under ASGI, where Django advises against persistent
+# connections; DB_POOL=pool needs psycopg 3 with psycopg_pool installed.
+
+try:
+    DATABASES = {
+        'default': django_database(),
     }
+except ValueError as e:
+    raise ImproperlyConfigured(e) from e
+
+
+# Background summarization
+# Worker threads that run summarizing_agent outside the request (frontline.summary_queue)
+
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+
+
+# Emergency classification cache
+# Results of classify_emergency_agent keyed by the normalized message (frontline.classification_cache).
+# Set CLASSIFICATION_CACHE_BACKEND to a CACHES alias to share results between worker processes.
+
+CLASSIFICATION_CACHE_SIZE = int(os.getenv("CLASSIFICATION_CACHE_SIZE", "2048"))
+CLASSIFICATION_CACHE_TTL = int(os.getenv("CLASSIFICATION_CACHE_TTL", "900"))
+CLASSIFICATION_CACHE_BACKEND = os.getenv("CLASSIFICATION_CACHE_BACKEND") or None
+
+
+# Local triage
+# Rule table and hashed n-gram model tried before the LLM classifier (frontline.triage).
+# Train the model with `manage.py train_triage_model`.
+
+LOCAL_TRIAGE_THRESHOLD = float(os.getenv("LOCAL_TRIAGE_THRESHOLD", "0.85"))
+LOCAL_TRIAGE_MODEL_PATH = os.getenv("LOCAL_TRIAGE_MODEL_PATH", str(BASE_DIR / "triage_model.npz"))
+
+
+# Triage mode
+# "two_call": classify the message, then write the reply with the department's facilities.
+# "single_call": for non-appointment turns, look up facilities for every department first and let
+# one LLM call classify and reply (frontline.helpers.triage_agent), one round trip less per turn.
+# Applies to chat_flow and chat_flow_async; the streaming view always classifies first.
+
+TRIAGE_MODE = os.getenv("TRIAGE_MODE", "two_call")
+
+
+# Latency budget
+# The request's latency field is the seconds the client will wait (frontline.deadline).
+# Each LLM stage may use its share of what is left; stages with less than
+# LATENCY_MIN_STAGE_SECONDS available are skipped and answered with a fallback.
+
+DEFAULT_LATENCY_BUDGET = float(os.getenv("DEFAULT_LATENCY_BUDGET")) if os.getenv("DEFAULT_LATENCY_BUDGET") else None
+LATENCY_STAGE_SHARES = {
+    "classify": 0.4,
+    "reply": 0.9,
+    "appointment": 0.9,
+    "triage": 0.9,
+}
+LATENCY_MIN_STAGE_SECONDS = float(os.getenv("LATENCY_MIN_STAGE_SECONDS", "0.2"))
+
+
+# Facility index refresh
+# How often each process checks facility_changes (written by db_utils/sync.py) and
+# applies new rows to its in-memory index; larger change sets trigger a full rebuild.
+
+FACILITY_CHANGES_POLL_SECONDS = float(os.getenv("FACILITY_CHANGES_POLL_SECONDS", "30"))
+FACILITY_CHANGES_MAX_APPLY = int(os.getenv("FACILITY_CHANGES_MAX_APPLY", "5000"))
+
+# Snapshot written by `manage.py export_facility_snapshot`; when the file exists, workers map it
+# at startup instead of loading health_facilities, then apply the changes logged since the export.
+FACILITY_SNAPSHOT_PATH = os.getenv("FACILITY_SNAPSHOT_PATH") or None
+
+
+# Nearest-facility cache
+# Candidates per (department, geohash cell) in front of the facility index (frontline.nearest_cache).
+# Precision 6 cells are about 1.2 x 0.6 km; entries are dropped whenever the index is reloaded.
+
+NEAREST_CACHE_SIZE = int(os.getenv("NEAREST_CACHE_SIZE", "20000"))
+NEAREST_CACHE_PRECISION = int(os.getenv("NEAREST_CACHE_PRECISION", "6"))
+
+
+# Opening hours
+# Facilities are ranked open first, then unknown hours, then closed, among the
+# OPEN_NOW_CANDIDATES nearest ones (frontline.opening_hours). For emergency levels 3-5
+# a facility opening within OPENING_SOON_MINUTES counts as open.
+
+OPENING_HOURS_TIME_ZONE = os.getenv("OPENING_HOURS_TIME_ZONE", "Asia/Karachi")
+OPENING_SOON_MINUTES = int(os.getenv("OPENING_SOON_MINUTES", "30"))
+OPEN_NOW_CANDIDATES = int(os.getenv("OPEN_NOW_CANDIDATES", "10"))
+
+
+# Session state cache
+# Appointment flag, latest summary and recent messages per session (frontline.session_state).
+# Off by default (TTL 0): a worker does not see writes other workers make to a session it has
+# cached. Only set a TTL (e.g. 30) when sessions are sticky, i.e. the load balancer sends every
+# turn of a session to the same worker process.
+
+SESSION_STATE_CACHE_SIZE = int(os.getenv("SESSION_STATE_CACHE_SIZE", "10000"))
+SESSION_STATE_CACHE_TTL = int(os.getenv("SESSION_STATE_CACHE_TTL", "0"))
+
+
+# Chat write-behind
+# When enabled, chat rows are written by a background flusher in batched commits (frontline.turn_buffer)
+# instead of one commit per turn. Rows still in the buffer are lost if the process is killed, and
+# without the session state cache a quick follow-up turn may not see them yet.
+
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+CHAT_WRITE_BEHIND_BATCH = int(os.getenv("CHAT_WRITE_BEHIND_BATCH", "500"))
+CHAT_WRITE_BEHIND_INTERVAL = float(os.getenv("CHAT_WRITE_BEHIND_INTERVAL", "0.05"))
+
+
+# Metrics
+# /api/v1/metrics serves Prometheus text (frontline.metrics) to clients whose address is in
+# METRICS_ALLOWED_IPS, or that send "Authorization: Bearer <METRICS_TOKEN>" when a token is set.
+# Behind a proxy the address is the proxy's, so scrape through the token instead.
+
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1").split(",") if ip.strip()]
+METRICS_TOKEN = os.getenv("METRICS_TOKEN") or None
+
+
+# Logging
+# JSON lines on stdout, written by a background thread (frontline.log). LOG_LEVEL applies to the
+# frontline loggers; LOG_LEVELS overrides it per module, e.g. "frontline.helpers=DEBUG,django.db=INFO".
+# Only a LOG_DEBUG_SAMPLE_RATE fraction of DEBUG records is kept.
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = {
+    name.strip(): level.strip().upper()
+    for name, _, level in (item.partition("=") for item in os.getenv("LOG_LEVELS", "").split(",") if "=" in item)
+}
+LOG_DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {"()": "frontline.log.JsonFormatter"},
+    },
+    "filters": {
+        "sample_debug": {"()": "frontline.log.SampleFilter", "rate": LOG_DEBUG_SAMPLE_RATE},
+    },
+    "handlers": {
+        "background": {
+            "()": "frontline.log.BackgroundHandler",
+            "formatter": "json",
+            "filters": ["sample_debug"],
+        },
+    },
+    "root": {"handlers": ["background"], "level": "WARNING"},
+    "loggers": {
+        "django": {"level": os.getenv("DJANGO_LOG_LEVEL", "INFO")},
+        "frontline": {"level": LOG_LEVEL},
+        **{name: {"level": level} for name, level in LOG_LEVELS.items()},
+    },
 }
 
 